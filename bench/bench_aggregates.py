@@ -0,0 +1,108 @@
+# bench/bench_aggregates.py
+# Temps de rafraîchissement du dashboard: anciennes vues (scan de flat_texts) vs vues sur agrégats,
+# et coût du rafraîchissement incrémental après l'arrivée de nouveaux commentaires.
+# Données générées en SQL (generate_series) dans un schéma jetable (bench_aggregates).
+#   python -m bench.bench_aggregates --rows 3000000 --posts 2000
+import argparse, os, time
+from etl import aggregates, load
+
+BENCH_SCHEMA = "bench_aggregates"
+
+# anciennes définitions (avant agrégats) des vues les plus lues, pour comparaison
+LEGACY_QUERIES = {
+    "overview": """
+        SELECT COUNT(DISTINCT p.post_id), COUNT(DISTINCT c.comment_id), COALESCE(AVG(p.like_count), 0),
+               COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END)
+        FROM posts p LEFT JOIN comments c ON p.post_id = c.post_id LEFT JOIN flat_texts f ON f.post_id = p.post_id""",
+    "timeline_daily": """
+        SELECT DATE_TRUNC('day', created_time)::date, COUNT(CASE WHEN predicted_sentiment = 'positif' THEN 1 END), COUNT(*)
+        FROM flat_texts WHERE created_time IS NOT NULL GROUP BY DATE_TRUNC('day', created_time)""",
+    "top_users": """
+        SELECT username, COUNT(*), SUM(like_count) FROM flat_texts
+        WHERE username IS NOT NULL AND source_type != 'post' GROUP BY username HAVING COUNT(*) > 1
+        ORDER BY 2 DESC LIMIT 20""",
+    "emoji": """
+        SELECT key, SUM(value::int) FROM flat_texts f, LATERAL jsonb_each_text(f.emoji_summary)
+        WHERE emoji_summary != '{}' GROUP BY key ORDER BY 2 DESC LIMIT 20""",
+}
+NEW_QUERIES = {
+    "overview": "SELECT * FROM vw_dashboard_overview",
+    "timeline_daily": "SELECT * FROM vw_sentiment_timeline_daily",
+    "top_users": "SELECT * FROM vw_top_users",
+    "emoji": "SELECT * FROM vw_emoji_analysis",
+}
+
+# commentaires répartis sur ~1 an, 50 000 utilisateurs, sentiments et émojis pseudo-aléatoires
+GENERATE_SQL = """
+    INSERT INTO posts (post_id, caption, media_type, created_time, like_count, comments_count)
+    SELECT 'p' || i, 'post ' || i, 'IMAGE', now() - (i %% 365) * interval '1 day', i %% 500, %(per_post)s
+    FROM generate_series(1, %(posts)s) i;
+    INSERT INTO flat_texts (source_type, source_id, post_id, username, text, like_count, emoji_summary,
+                            created_time, predicted_sentiment)
+    SELECT 'comment', 'c' || i, 'p' || (1 + i %% %(posts)s), 'user' || (i * 7919 %% 50000), 'texte ' || i, i %% 7,
+           CASE WHEN i %% 5 = 0 THEN '{"🔥": 2}'::jsonb WHEN i %% 7 = 0 THEN '{"❤️": 1}'::jsonb ELSE '{}'::jsonb END,
+           now() - ((1 + i %% %(posts)s) %% 365) * interval '1 day' + (i %% 86400) * interval '1 second',
+           (ARRAY['positif', 'negatif', 'neutre', NULL])[1 + i %% 4]
+    FROM generate_series(1, %(rows)s) i;
+    INSERT INTO text_emojis (flat_text_id, emoji, count)
+    SELECT f.id, e.key, e.value::int FROM flat_texts f CROSS JOIN LATERAL jsonb_each_text(f.emoji_summary) e;
+    ANALYZE posts;
+    ANALYZE flat_texts;
+    ANALYZE text_emojis;
+"""
+
+NEW_COMMENTS_SQL = """
+    INSERT INTO flat_texts (source_type, source_id, post_id, username, text, like_count, created_time, predicted_sentiment)
+    SELECT 'comment', 'n' || i, 'p' || (1 + i %% 50), 'user' || i %% 1000, 'nouveau ' || i, 0, now(), 'positif'
+    FROM generate_series(1, %(n)s) i
+"""
+
+def timed(cur, sql, params=None):
+    start = time.time()
+    cur.execute(sql, params)
+    if cur.description:
+        cur.fetchall()
+    return time.time() - start
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=3_000_000)
+    ap.add_argument("--posts", type=int, default=2000)
+    ap.add_argument("--new", type=int, default=5000, help="nouveaux commentaires avant le rafraîchissement incrémental")
+    a = ap.parse_args()
+
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA},public"
+    conn = load.connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}")
+    conn.commit()
+    try:
+        load.ensure_schema(conn)
+        print(f"[bench_aggregates] génération de {a.rows} lignes...")
+        cur.execute(GENERATE_SQL, {"posts": a.posts, "rows": a.rows, "per_post": a.rows // a.posts})
+        conn.commit()
+        aggregates.ensure_aggregates(conn, views=True)
+        start = time.time()
+        aggregates.refresh(conn, full=True)
+        print(f"[bench_aggregates] construction complète des agrégats: {time.time() - start:.1f}s")
+
+        for name in LEGACY_QUERIES:
+            old = timed(cur, LEGACY_QUERIES[name])
+            new = timed(cur, NEW_QUERIES[name])
+            print(f"[bench_aggregates] {name:15s}: ancienne vue {old * 1000:8.0f}ms, sur agrégats {new * 1000:6.1f}ms")
+        conn.rollback()
+
+        cur.execute(NEW_COMMENTS_SQL, {"n": a.new})
+        conn.commit()
+        start = time.time()
+        aggregates.refresh(conn)
+        print(f"[bench_aggregates] rafraîchissement incrémental après {a.new} nouveaux commentaires: "
+              f"{time.time() - start:.2f}s")
+    finally:
+        conn.rollback()
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
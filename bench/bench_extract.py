@@ -0,0 +1,34 @@
+# bench/bench_extract.py
+# Compare l'extraction séquentielle et concurrente contre le stub local de l'API Graph
+#   python -m bench.bench_extract --posts 500 --comments 100 --workers 1 8 16
+import argparse, os, tempfile, time
+from bench.synthetic import SyntheticAccount
+from bench.stub_graph_api import serve
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--posts", type=int, default=200)
+    ap.add_argument("--comments", type=int, default=100)
+    ap.add_argument("--latency-ms", type=int, default=50)
+    ap.add_argument("--fail-rate", type=float, default=0.02)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 8, 16])
+    a = ap.parse_args()
+
+    httpd = serve(SyntheticAccount(a.posts, a.comments), port=0, latency_ms=a.latency_ms,
+                  fail_rate=a.fail_rate, background=True)
+    # les settings sont lus à l'import: on configure l'environnement avant d'importer extract
+    os.environ["IG_API_BASE"] = f"http://127.0.0.1:{httpd.server_address[1]}/v19.0"
+    os.environ.setdefault("IG_ACCESS_TOKEN", "stub")
+    os.environ.setdefault("IG_BUSINESS_ID", "stub")
+    from etl import extract
+
+    out = os.path.join(tempfile.mkdtemp(), "raw.ndjson")
+    for w in a.workers:
+        start = time.time()
+        posts = extract.extract_all(limit_posts=a.posts, save_path=out, workers=w)
+        n_comments = sum(len(p["fetched_comments"]) for p in posts)
+        print(f"[bench_extract] workers={w}: {time.time() - start:.2f}s, {n_comments} commentaires")
+    httpd.shutdown()
+
+if __name__ == "__main__":
+    main()
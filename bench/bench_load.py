@@ -0,0 +1,55 @@
+# bench/bench_load.py
+# Compare le chargement ligne à ligne (INSERT par ligne) et le chargement COPY + upsert ensembliste.
+# Tout se passe dans un schéma jetable (bench_load) de la base configurée dans .env.
+#   python -m bench.bench_load --posts 200 --comments 250 --batch-size 10000
+import argparse, tempfile, time
+from bench.synthetic import SyntheticAccount
+from etl import load, transform
+
+BENCH_SCHEMA = "bench_load"
+
+def fresh_schema(conn):
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}")
+    cur.execute(f"SET search_path TO {BENCH_SCHEMA}, public")
+    conn.commit()
+    cur.close()
+    load.ensure_schema(conn)
+
+def run(method, conn, data, batch_size):
+    fresh_schema(conn)
+    n = sum(len(x) for x in data)
+    start = time.time()
+    if method == "copy":
+        load.bulk_load(conn, *data, batch_size=batch_size)
+    else:
+        load.load_rows(conn, *data)
+    elapsed = time.time() - start
+    print(f"[bench_load] {method:5s}: {n} rows en {elapsed:.2f}s -> {n / elapsed:,.0f} rows/s")
+    return n / elapsed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--posts", type=int, default=100)
+    ap.add_argument("--comments", type=int, default=200)
+    ap.add_argument("--batch-size", type=int, default=10000)
+    a = ap.parse_args()
+
+    proc_dir = tempfile.mkdtemp()
+    transform.PROC_DIR = proc_dir
+    transform.transform(posts=SyntheticAccount(a.posts, a.comments).iter_posts())
+    data = load.read_processed(proc_dir)
+
+    conn = load.connect()
+    try:
+        before = run("rows", conn, data, a.batch_size)
+        after = run("copy", conn, data, a.batch_size)
+        print(f"[bench_load] speedup x{after / before:.1f}")
+    finally:
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
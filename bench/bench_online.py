@@ -0,0 +1,74 @@
+# bench/bench_online.py
+# Compare le réentraînement complet (TF-IDF + LogisticRegression, comme train_and_select) et le mode
+# incrémental (HashingVectorizer + SGD partial_fit, comme train_online) sur un corpus synthétique:
+# entraînement initial, puis ajout de nouvelles lignes (--new-fraction) et mise à jour.
+#   python -m bench.bench_online --texts 500000
+import argparse, time
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score
+from bench.synthetic import SyntheticAccount
+from scripts_models import train_online
+from scripts_models.train_and_select import VECT_PARAMS, label_texts
+
+def corpus(n_texts, comments_per_post=500):
+    acc = SyntheticAccount(max(1, n_texts // comments_per_post), comments_per_post, reply_ratio=0.2)
+    texts = [c["text"] for p in acc.iter_posts() for c in p["fetched_comments"]][:n_texts]
+    return np.array(texts, dtype=object), np.array(label_texts(texts))
+
+def batch_fit(texts, labels):
+    vect = TfidfVectorizer(**VECT_PARAMS)
+    model = LogisticRegression(max_iter=1000, random_state=42).fit(vect.fit_transform(texts), labels)
+    return model, vect
+
+def chunks(texts, labels, size):
+    for i in range(0, len(texts), size):
+        yield list(texts[i:i + size]), list(labels[i:i + size])
+
+def scores(model, vect, texts, labels):
+    preds = model.predict(vect.transform(texts))
+    return accuracy_score(labels, preds), f1_score(labels, preds, average="macro")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--texts", type=int, default=200000)
+    ap.add_argument("--new-fraction", type=float, default=0.05, help="part du corpus ajoutée après le 1er entraînement")
+    ap.add_argument("--chunk-size", type=int, default=train_online.CHUNK_SIZE)
+    a = ap.parse_args()
+
+    start = time.time()
+    texts, labels = corpus(a.texts)
+    print(f"[bench_online] corpus: {len(texts)} textes labellisés en {time.time() - start:.0f}s")
+    # test = 10% en fin de corpus; "nouvelles" lignes = les dernières avant le test
+    n_test = len(texts) // 10
+    train_t, train_y, test_t, test_y = texts[:-n_test], labels[:-n_test], texts[-n_test:], labels[-n_test:]
+    n_new = int(len(train_t) * a.new_fraction)
+    old_t, old_y, new_t, new_y = train_t[:-n_new], train_y[:-n_new], train_t[-n_new:], train_y[-n_new:]
+
+    start = time.time()
+    model, vect = batch_fit(old_t, old_y)
+    t_batch = time.time() - start
+    start = time.time()
+    model, vect = batch_fit(train_t, train_y)
+    t_batch_update = time.time() - start
+    b_acc, b_f1 = scores(model, vect, test_t, test_y)
+
+    vect = train_online.make_vectorizer()
+    model = train_online.make_model()
+    start = time.time()
+    train_online.partial_train(model, vect, chunks(old_t, old_y, a.chunk_size))
+    t_online = time.time() - start
+    start = time.time()
+    train_online.partial_train(model, vect, chunks(new_t, new_y, a.chunk_size))
+    t_online_update = time.time() - start
+    o_acc, o_f1 = scores(model, vect, test_t, test_y)
+
+    print(f"[bench_online] batch  : initial {t_batch:.1f}s, mise à jour (+{n_new}) {t_batch_update:.1f}s, "
+          f"acc={b_acc:.4f} f1_macro={b_f1:.4f}")
+    print(f"[bench_online] online : initial {t_online:.1f}s, mise à jour (+{n_new}) {t_online_update:.1f}s, "
+          f"acc={o_acc:.4f} f1_macro={o_f1:.4f}")
+    print(f"[bench_online] mise à jour x{t_batch_update / max(t_online_update, 1e-9):.0f} plus rapide en incrémental")
+
+if __name__ == "__main__":
+    main()
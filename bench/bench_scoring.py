@@ -0,0 +1,59 @@
+# bench/bench_scoring.py
+# Débit du scoring (textes/s) selon le nombre de workers, dans un schéma jetable (bench_scoring)
+#   python -m bench.bench_scoring --posts 200 --comments 500 --workers 1 2 4 8 16 32
+import argparse, os, tempfile, time, joblib
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from bench.synthetic import SyntheticAccount
+
+BENCH_SCHEMA = "bench_scoring"
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--posts", type=int, default=200)
+    ap.add_argument("--comments", type=int, default=500)
+    ap.add_argument("--batch-size", type=int, default=5000)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    a = ap.parse_args()
+
+    # toutes les connexions (y compris celles des workers) travaillent dans le schéma de bench
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA},public"
+    from etl import load, transform
+    from scripts_models import apply_model
+    from scripts_models.train_and_select import get_sentiment_label
+
+    conn = load.connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}")
+    conn.commit()
+    load.ensure_schema(conn)
+    transform.PROC_DIR = tempfile.mkdtemp()
+    transform.transform(posts=SyntheticAccount(a.posts, a.comments).iter_posts())
+    data = load.read_processed(transform.PROC_DIR, "csv")
+    load.bulk_load(conn, *data)
+
+    # petit modèle entraîné sur un échantillon, sauvegardé sans compression (mmap possible)
+    texts = [r["text"] for r in data[2][:20000]]
+    vect = TfidfVectorizer(ngram_range=(1, 2), max_features=5000)
+    model = LogisticRegression(max_iter=1000).fit(vect.fit_transform(texts), [get_sentiment_label(t) for t in texts])
+    apply_model.MODEL_DIR = tempfile.mkdtemp()
+    joblib.dump(vect, os.path.join(apply_model.MODEL_DIR, "vectorizer.joblib"))
+    joblib.dump(model, os.path.join(apply_model.MODEL_DIR, "best_model_logreg.joblib"))
+
+    try:
+        results = {}
+        for w in a.workers:
+            cur.execute("UPDATE flat_texts SET predicted_sentiment = NULL, predicted_score = NULL")
+            conn.commit()
+            start = time.time()
+            n = apply_model.apply_model_parallel(workers=w, batch_size=a.batch_size)
+            results[w] = n / (time.time() - start)
+        for w, rate in results.items():
+            print(f"[bench_scoring] workers={w:3d}: {rate:,.0f} textes/s (x{rate / results[a.workers[0]]:.1f})")
+    finally:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
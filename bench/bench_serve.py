@@ -0,0 +1,76 @@
+# bench/bench_serve.py
+# Latence (p50/p99) et requêtes/s du service de prédiction sous charge concurrente,
+# avec et sans micro-batching, sur un petit modèle entraîné sur des textes synthétiques
+#   python -m bench.bench_serve --clients 32 --requests 200
+import argparse, os, tempfile, threading, time, joblib
+import numpy as np
+import requests
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from bench.synthetic import SyntheticAccount
+from scripts_models import serve
+
+def build_model(model_dir, n_posts=20, comments_per_post=200):
+    # textes des commentaires synthétiques, labels arbitraires mais stables
+    acc = SyntheticAccount(n_posts, comments_per_post)
+    texts = [c["text"] for p in acc.iter_posts() for c in p["fetched_comments"]]
+    labels = [("positif", "neutre", "negatif")[len(t) % 3] for t in texts]
+    vect = TfidfVectorizer(ngram_range=(1, 2), max_features=20000)
+    model = LogisticRegression(max_iter=1000).fit(vect.fit_transform(texts), labels)
+    joblib.dump(vect, os.path.join(model_dir, "vectorizer.joblib"))
+    joblib.dump(model, os.path.join(model_dir, "best_model_LogisticRegression.joblib"))
+    return texts
+
+def run(label, texts, clients, n_requests, **kwargs):
+    server, predictor = serve.serve(port=0, model_dir=kwargs.pop("model_dir"), background=True,
+                                    reload_seconds=0, **kwargs)
+    url = f"http://127.0.0.1:{server.server_port}"
+    latencies = []
+    lock = threading.Lock()
+
+    def client(k):
+        s = requests.Session()
+        local = []
+        for i in range(n_requests):
+            start = time.perf_counter()
+            r = s.post(f"{url}/predict", json={"text": texts[(k * n_requests + i) % len(texts)]})
+            r.raise_for_status()
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.time()
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    metrics = requests.get(f"{url}/metrics").json()
+    server.shutdown()
+    server.server_close()
+    predictor.stop()
+
+    lat = np.array(latencies) * 1000
+    rps = len(lat) / elapsed
+    print(f"[bench_serve] {label:14s}: {rps:,.0f} req/s, client p50 {np.percentile(lat, 50):.1f}ms "
+          f"p99 {np.percentile(lat, 99):.1f}ms, lot moyen {metrics['avg_batch_size']}")
+    return rps
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=200, help="requêtes par client")
+    ap.add_argument("--max-batch", type=int, default=256)
+    ap.add_argument("--max-wait-ms", type=float, default=2)
+    a = ap.parse_args()
+
+    model_dir = tempfile.mkdtemp()
+    texts = build_model(model_dir)
+    single = run("sans batching", texts, a.clients, a.requests, model_dir=model_dir, max_batch=1, max_wait_ms=0)
+    batched = run("micro-batching", texts, a.clients, a.requests, model_dir=model_dir,
+                  max_batch=a.max_batch, max_wait_ms=a.max_wait_ms)
+    print(f"[bench_serve] speedup x{batched / single:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# bench/bench_transform.py
+# Compare le transform par boucle Python et le transform vectorisé sur un jeu synthétique
+#   python -m bench.bench_transform --comments-total 1000000
+import argparse, json, os, tempfile, time, filecmp
+from bench.synthetic import SyntheticAccount
+from etl import raw_store, transform
+
+def build_raw(path, n_posts, comments_per_post):
+    # le jeu brut est généré une fois (faker est lent) puis relu depuis le NDJSON
+    if os.path.exists(path):
+        return path
+    start = time.time()
+    with raw_store.RawWriter(path=path) as w:
+        for p in SyntheticAccount(n_posts, comments_per_post, reply_ratio=0.2).iter_posts():
+            w.write(p)
+    print(f"[bench_transform] jeu synthétique généré en {time.time() - start:.0f}s: {path}")
+    return path
+
+def run(engine, raw_path, out_dir):
+    transform.PROC_DIR = out_dir
+    start = time.time()
+    transform.transform(posts=raw_store.iter_part(raw_path), engine=engine)
+    elapsed = time.time() - start
+    print(f"[bench_transform] {engine:10s}: {elapsed:.1f}s")
+    return elapsed
+
+def run_core(raw_path):
+    # transformation seule (sans lecture NDJSON ni écriture des fichiers)
+    posts = list(raw_store.iter_part(raw_path))
+    start = time.time()
+    for _ in transform.iter_transformed(posts):
+        pass
+    t_python = time.time() - start
+    start = time.time()
+    for _ in transform.iter_transformed_frames(posts):
+        pass
+    t_vector = time.time() - start
+    print(f"[bench_transform] coeur seul: python {t_python:.1f}s, vectorized {t_vector:.1f}s (x{t_python / t_vector:.1f})")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--comments-total", type=int, default=1_000_000)
+    ap.add_argument("--comments-per-post", type=int, default=500)
+    ap.add_argument("--raw", default=None, help="chemin du NDJSON synthétique (réutilisé s'il existe)")
+    a = ap.parse_args()
+
+    n_posts = max(1, a.comments_total // a.comments_per_post)
+    raw = a.raw or os.path.join(tempfile.gettempdir(), f"bench_transform_{a.comments_total}.ndjson.gz")
+    build_raw(raw, n_posts, a.comments_per_post)
+
+    out = tempfile.mkdtemp()
+    t_python = run("python", raw, os.path.join(out, "python"))
+    t_vector = run("vectorized", raw, os.path.join(out, "vectorized"))
+
+    same = all(filecmp.cmp(os.path.join(out, "python", n), os.path.join(out, "vectorized", n), shallow=False)
+               for n in ("posts.csv", "comments.csv"))
+    with open(os.path.join(out, "python", "flat_texts.json"), encoding="utf-8") as f1, \
+         open(os.path.join(out, "vectorized", "flat_texts.json"), encoding="utf-8") as f2:
+        same = same and json.load(f1) == json.load(f2)
+    print(f"[bench_transform] bout en bout: speedup x{t_python / t_vector:.1f}, sorties identiques: {same}")
+    run_core(raw)
+
+if __name__ == "__main__":
+    main()
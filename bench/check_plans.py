@@ -0,0 +1,152 @@
+# bench/check_plans.py
+# Non-régression des plans des files de travail (apply_model: textes non prédits, labels: textes non
+# labellisés): à chaque palier de taille de flat_texts, EXPLAIN doit montrer les index partiels
+# idx_flat_texts_unpredicted / idx_flat_texts_unlabeled (Index Only Scan pour les ids et les comptages),
+# jamais un Seq Scan de la table. idx_flat_texts_sentiment (predicted_sentiment, NULL compris) sert la file
+# des prédictions aussi bien et le planificateur le préfère souvent: accepté (en Index Scan, il n'a pas l'id).
+# Table partitionnée: les UPDATE par lot (prédictions, labels) doivent sonder la clé primaire avec
+# created_time dans la condition (une partition par ligne). Sur la table simple, le hash join que choisit le
+# planificateur pour un lot de 5000 lignes vaut la boucle imbriquée: non vérifié.
+# Code de sortie 1 si un plan est en régression.
+# Données générées en SQL dans un schéma jetable (bench_plans), file = 1% de la table par défaut.
+#   python -m bench.check_plans --sizes 100000,1000000,5000000 [--partitioned] [--batch 5000]
+import argparse, os, sys
+from etl import load, partitions
+from scripts_models.apply_model import (UNPREDICTED_SQL, PARTITION_SQL, NESTED_LOOP_SQL,
+                                        UPDATE_PREDICTIONS_PARTITIONED_SQL)
+from scripts_models.train_and_select import UNLABELED_SQL, UPDATE_LABELS_PARTITIONED_SQL
+
+BENCH_SCHEMA = "bench_plans"
+SEQ_SCAN_MIN_ROWS = 1000  # un Seq Scan sur une partition vide ou presque n'est pas une régression
+
+# lignes sur ~2 ans; une ligne sur 1/queue sans prédiction, une autre sans label
+GROW_SQL = """
+    INSERT INTO flat_texts (source_type, source_id, post_id, username, text, like_count, created_time,
+                            predicted_sentiment, sentiment_label)
+    SELECT 'comment', 'c' || i, 'p' || i %% 2000, 'user' || i %% 50000, 'texte ' || i, i %% 7,
+           now() - (i %% 730) * interval '1 day',
+           CASE WHEN i %% %(every)s = 0 THEN NULL ELSE 'positif' END,
+           CASE WHEN i %% %(every)s = 1 THEN NULL ELSE 'neutre' END
+    FROM generate_series(%(lo)s, %(hi)s) i
+"""
+
+# index partitionné: les index des partitions lui sont rattachés
+INDEX_FAMILY_SQL = """
+    SELECT %(name)s UNION ALL
+    SELECT c.relname::text FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(%(name)s)
+"""
+
+UNPREDICTED_INDEXES = ("idx_flat_texts_unpredicted", "idx_flat_texts_sentiment")
+
+# (nom, requête, index attendus, types de nœuds acceptés sur flat_texts)
+CHECKS = [
+    ("unpredicted_ids", "SELECT id FROM flat_texts WHERE predicted_sentiment IS NULL",
+     UNPREDICTED_INDEXES, {"Index Only Scan", "Index Scan"}),
+    ("unpredicted_count", f"SELECT COUNT(*) FROM ({UNPREDICTED_SQL}) t",
+     UNPREDICTED_INDEXES, {"Index Only Scan"}),
+    ("unpredicted_fetch", UNPREDICTED_SQL,
+     UNPREDICTED_INDEXES, {"Index Only Scan", "Index Scan", "Bitmap Index Scan"}),
+    ("unpredicted_worker", UNPREDICTED_SQL + PARTITION_SQL % (4, 0),
+     UNPREDICTED_INDEXES, {"Index Only Scan", "Index Scan", "Bitmap Index Scan"}),
+    ("unlabeled_count", f"SELECT COUNT(*) FROM ({UNLABELED_SQL}) t",
+     ("idx_flat_texts_unlabeled",), {"Index Only Scan"}),
+    ("unlabeled_fetch", UNLABELED_SQL,
+     ("idx_flat_texts_unlabeled",), {"Index Only Scan", "Index Scan", "Bitmap Index Scan"}),
+]
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def update_checks(cur, batch):
+    """UPDATE par lot de la table partitionnée tels qu'exécutés par apply_model / labels, sur batch lignes
+    réelles de chaque file"""
+    checks = []
+    for name, queue_sql, sql, template, row in (
+            ("update_predictions", UNPREDICTED_SQL, UPDATE_PREDICTIONS_PARTITIONED_SQL,
+             "(%s, %s, %s::float8, %s, %s::timestamptz)", lambda r: (r[0], "positif", 0.9, "check", r[2])),
+            ("update_labels", UNLABELED_SQL, UPDATE_LABELS_PARTITIONED_SQL,
+             "(%s, %s, %s::timestamptz)", lambda r: (r[0], "neutre", r[2]))):
+        cur.execute(queue_sql + f" LIMIT {batch}")
+        values = ",".join(cur.mogrify(template, row(r)).decode() for r in cur.fetchall())
+        checks.append((name, sql.replace("%s", values), ("flat_texts_pkey",), {"Index Scan"}, "created_time"))
+    return checks
+
+def check_plan(cur, sql, indexes, accepted, cond=None):
+    """Liste des problèmes du plan (vide si conforme). cond: texte attendu dans l'Index Cond"""
+    family = set()
+    for index in indexes:
+        cur.execute(INDEX_FAMILY_SQL, {"name": index})
+        family.update(r[0] for r in cur.fetchall())
+    # réglages de la transaction (SET LOCAL) appliqués, seul l'UPDATE est expliqué
+    if sql.startswith(NESTED_LOOP_SQL):
+        cur.execute(NESTED_LOOP_SQL)
+        sql = sql[len(NESTED_LOOP_SQL):]
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+    problems, used = [], False
+    for node in plan_nodes(cur.fetchone()[0][0]["Plan"]):
+        kind = node["Node Type"]
+        if kind == "Seq Scan" and node.get("Relation Name", "").startswith("flat_texts"):
+            cur.execute("SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", (node["Relation Name"],))
+            if cur.fetchone()[0] >= SEQ_SCAN_MIN_ROWS:
+                problems.append(f"Seq Scan sur {node['Relation Name']}")
+        if node.get("Index Name") in family:
+            used = True
+            if kind not in accepted:
+                problems.append(f"{kind} sur {node['Index Name']} (attendu: {', '.join(sorted(accepted))})")
+            if cond and cond not in node.get("Index Cond", ""):
+                problems.append(f"{node['Index Name']} sans {cond} dans la condition")
+    if not used:
+        problems.append(f"{' / '.join(indexes)} non utilisé")
+    return problems
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100000,1000000,5000000")
+    ap.add_argument("--queue", type=float, default=0.01, help="fraction de la table dans chaque file")
+    ap.add_argument("--partitioned", action="store_true", help="flat_texts partitionnée (etl/partitions.py)")
+    ap.add_argument("--batch", type=int, default=5000, help="lignes par UPDATE (batch_size de apply_model), --partitioned")
+    a = ap.parse_args()
+    sizes = [int(s) for s in a.sizes.split(",")]
+    every = max(int(round(1 / a.queue)), 2)
+
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA},public"
+    conn = load.connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}")
+    conn.commit()
+    failed = False
+    try:
+        load.ensure_schema(conn)
+        if a.partitioned:
+            partitions.migrate(conn)
+        done = 0
+        for size in sizes:
+            cur.execute(GROW_SQL, {"lo": done + 1, "hi": size, "every": every})
+            conn.commit()
+            if a.partitioned:
+                # mois passés arrivés dans la partition par défaut: répartis comme le ferait le pipeline
+                partitions.ensure_partitions(conn)
+            done = size
+            # autovacuum: statistiques et visibility map à jour (Index Only Scan sans accès à la table)
+            conn.autocommit = True
+            cur.execute("VACUUM ANALYZE flat_texts")
+            conn.autocommit = False
+            checks = CHECKS + (update_checks(cur, a.batch) if a.partitioned else [])
+            for name, sql, indexes, accepted, *cond in checks:
+                problems = check_plan(cur, sql, indexes, accepted, *cond)
+                conn.rollback()
+                status = "OK" if not problems else "RÉGRESSION: " + "; ".join(problems)
+                print(f"[check_plans] {size:>9} lignes {name:20s} {status}")
+                failed = failed or bool(problems)
+    finally:
+        conn.rollback()
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bench/compare.py
+# Compare deux résultats de bench/run_suite.py (ex. avant / après un commit), étape par étape.
+# Régression: temps en hausse (ou débit en baisse) de plus de --threshold au-delà du plancher de bruit
+# --min-seconds, ou allers-retours base / requêtes HTTP en hausse (déterministes à échelle égale).
+# Code de sortie 1 si au moins une régression.
+#   python -m bench.compare bench/results/base.json bench/results/new.json [--threshold 0.10]
+import argparse, json, sys
+
+# compteurs comparés quand les deux runs ont la même échelle
+COUNTERS = ["db_roundtrips", "http_requests"]
+
+def load_result(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def pct(base, new):
+    return (new - base) / base if base else None
+
+def compare(base, new, threshold=0.10, min_seconds=0.5):
+    """Lignes du rapport et liste des régressions"""
+    lines, regressions = [], []
+    same_scale = base["scale"] == new["scale"]
+    if not same_scale:
+        lines.append(f"échelles différentes: {base['scale']} / {new['scale']} (compteurs non comparés)")
+    for label in ("python", "cpu_count", "postgres"):
+        if base["env"].get(label) != new["env"].get(label):
+            lines.append(f"environnement différent ({label}): {base['env'].get(label)} / {new['env'].get(label)}")
+
+    for key in [k for k in base["stages"] if k in new["stages"]]:
+        b, n = base["stages"][key], new["stages"][key]
+        bt, nt = b.get("wall_time"), n.get("wall_time")
+        if bt is None or nt is None:
+            continue
+        change = pct(bt, nt)
+        flags = []
+        if change is not None and change > threshold and nt - bt > min_seconds:
+            flags.append(f"temps +{change:.0%}")
+        br, nr = b.get("rows_per_s"), n.get("rows_per_s")
+        if br and nr and same_scale and (br - nr) / br > threshold and nt - bt > min_seconds:
+            flags.append(f"débit -{(br - nr) / br:.0%}")
+        if same_scale:
+            for c in COUNTERS:
+                if b.get(c) is not None and n.get(c) is not None and n[c] > b[c] * (1 + threshold):
+                    flags.append(f"{c} {b[c]} -> {n[c]}")
+        rate = f"{br or 0:>12,.0f} -> {nr or 0:>12,.0f} lignes/s" if (br or nr) else ""
+        status = "RÉGRESSION: " + ", ".join(flags) if flags else "ok"
+        lines.append(f"{key:24s} {bt:>9.2f}s -> {nt:>9.2f}s "
+                     f"({'+' if (change or 0) >= 0 else ''}{(change or 0):.0%}) {rate}  {status}")
+        if flags:
+            regressions.append((key, flags))
+    for key in sorted(set(base["stages"]) ^ set(new["stages"])):
+        lines.append(f"{key:24s} présent dans un seul des deux résultats")
+    return lines, regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("base")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=0.10, help="variation relative tolérée")
+    ap.add_argument("--min-seconds", type=float, default=0.5, help="écart absolu ignoré (bruit)")
+    a = ap.parse_args()
+    base, new = load_result(a.base), load_result(a.new)
+    print(f"[compare] {(base['git']['commit'] or '?')[:8]} -> {(new['git']['commit'] or '?')[:8]}")
+    lines, regressions = compare(base, new, a.threshold, a.min_seconds)
+    for line in lines:
+        print(f"[compare] {line}")
+    print(f"[compare] {len(regressions)} régression(s)")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
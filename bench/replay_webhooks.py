@@ -0,0 +1,184 @@
+# bench/replay_webhooks.py
+# Rejoue des notifications de commentaires Instagram sur le récepteur etl/webhook.py et mesure le débit
+# soutenu (commentaires chargés et scorés par seconde) et la latence réception -> prédiction (p50/p95/p99).
+#   python -m bench.replay_webhooks --events 20000 --rate 2000         # récepteur local, schéma bench_webhooks
+#   python -m bench.replay_webhooks --events 20000 --record data/raw/replay.ndjson
+#   python -m bench.replay_webhooks --file data/raw/replay.ndjson --url http://127.0.0.1:8710/webhook --secret ...
+# Sans --url, un récepteur est démarré dans ce processus (schéma jetable de la base configurée, petit modèle
+# entraîné sur des textes synthétiques, secret jetable si WEBHOOK_APP_SECRET est vide); avec --url, les mesures côté serveur viennent de son /metrics et
+# comptent tout ce qu'il a reçu depuis son démarrage.
+# --file: une notification JSON par ligne (enregistrée avec --record, ou dead letters de etl/webhook.py).
+import argparse, json, os, secrets, tempfile, threading, time
+from datetime import datetime, timezone
+import numpy as np
+import requests
+from bench.synthetic import SyntheticAccount
+
+BENCH_SCHEMA = "bench_webhooks"
+
+def synthetic_events(n_events, comments_per_post=200, seed=42):
+    # commentaires et réponses du compte synthétique, datés de maintenant (notifications "fraîches")
+    acc = SyntheticAccount(max(1, n_events // comments_per_post + 1), comments_per_post, seed=seed)
+    now = datetime.now(timezone.utc)
+    events = []
+    for i in range(acc.n_posts):
+        post_id = acc.media_id(i)
+        for c in acc.comments(i):
+            events.append({"comment_id": c["id"], "post_id": post_id, "parent_comment_id": None,
+                           "username": c["username"], "text": c["text"], "created_time": now})
+            for r in c.get("replies", {}).get("data", []):
+                events.append({"comment_id": r["id"], "post_id": post_id, "parent_comment_id": c["id"],
+                               "username": r["username"], "text": r["text"], "created_time": now})
+            if len(events) >= n_events:
+                return events[:n_events]
+    return events
+
+def build_bodies(events, per_notification):
+    from etl.webhook import build_payload
+    return [json.dumps(build_payload(events[k:k + per_notification]), ensure_ascii=False).encode("utf-8")
+            for k in range(0, len(events), per_notification)]
+
+def read_bodies(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip().encode("utf-8") for line in f if line.strip()]
+
+def count_events(body):
+    from etl.webhook import parse_notification
+    return len(parse_notification(json.loads(body)))
+
+def send_all(url, bodies, sizes, rate, clients, secret):
+    # envoi concurrent; rate (commentaires/s) fixe l'heure d'envoi de chaque notification, 0 = au plus vite
+    from etl.webhook import sign
+    offsets = np.cumsum([0] + sizes[:-1]) / rate if rate else None
+    lock = threading.Lock()
+    state = {"next": 0, "status": {}, "accepted": 0, "latencies": []}
+    start = time.perf_counter()
+
+    def client():
+        s = requests.Session()
+        local = []
+        while True:
+            with lock:
+                k = state["next"]
+                state["next"] += 1
+            if k >= len(bodies):
+                break
+            if offsets is not None:
+                wait = start + offsets[k] - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            headers = {"Content-Type": "application/json"}
+            if secret:
+                headers["X-Hub-Signature-256"] = sign(bodies[k], secret)
+            t = time.perf_counter()
+            try:
+                status = s.post(url, data=bodies[k], headers=headers, timeout=30).status_code
+            except requests.RequestException:
+                status = "erreur"
+            local.append(time.perf_counter() - t)
+            with lock:
+                state["status"][status] = state["status"].get(status, 0) + 1
+                if status == 200:
+                    state["accepted"] += sizes[k]
+
+        with lock:
+            state["latencies"].extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    state["elapsed"] = time.perf_counter() - start
+    return state
+
+def drain(metrics_url, expected, timeout):
+    # attend que le récepteur ait traité (chargé ou mis en dead letter) tout ce qu'il a accepté
+    deadline = time.time() + timeout
+    while True:
+        m = requests.get(metrics_url, timeout=10).json()
+        if m["ingested"] + m["failed"] >= expected or time.time() > deadline:
+            return m
+        time.sleep(0.2)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=20000, help="commentaires synthétiques à envoyer")
+    ap.add_argument("--per-notification", type=int, default=1, help="commentaires par notification (Meta regroupe)")
+    ap.add_argument("--file", default=None, help="notifications enregistrées (NDJSON) au lieu du synthétique")
+    ap.add_argument("--record", default=None, help="enregistre les notifications générées (NDJSON)")
+    ap.add_argument("--rate", type=float, default=0, help="commentaires/s visés (0 = au plus vite)")
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--url", default=None, help="récepteur existant (sinon démarré ici)")
+    ap.add_argument("--secret", default=None, help="secret de l'app pour signer (défaut: WEBHOOK_APP_SECRET)")
+    ap.add_argument("--max-batch", type=int, default=None)
+    ap.add_argument("--max-wait-ms", type=float, default=None)
+    ap.add_argument("--drain-timeout", type=float, default=300)
+    ap.add_argument("--keep-schema", action="store_true")
+    a = ap.parse_args()
+
+    if a.url is None:
+        # le récepteur local (pool etl.db compris) travaille dans le schéma de bench
+        os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA},public"
+    from config.settings import WEBHOOK_APP_SECRET
+    secret = WEBHOOK_APP_SECRET if a.secret is None else a.secret
+
+    if a.file:
+        bodies = read_bodies(a.file)
+    else:
+        bodies = build_bodies(synthetic_events(a.events), a.per_notification)
+    sizes = [count_events(b) for b in bodies]
+    if a.record:
+        os.makedirs(os.path.dirname(a.record) or ".", exist_ok=True)
+        with open(a.record, "w", encoding="utf-8") as f:
+            f.writelines(b.decode("utf-8") + "\n" for b in bodies)
+        print(f"[replay] {len(bodies)} notifications enregistrées dans {a.record}")
+
+    server = ingestor = conn = None
+    url = a.url
+    if url is None:
+        from etl import load, webhook
+        from bench.bench_serve import build_model
+        conn = load.connect()
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}")
+        conn.commit()
+        model_dir = tempfile.mkdtemp()
+        build_model(model_dir)
+        # récepteur local signé comme en production: secret jetable si aucun n'est configuré
+        secret = secret or secrets.token_hex(16)
+        kwargs = {k: v for k, v in (("max_batch", a.max_batch), ("max_wait_ms", a.max_wait_ms)) if v is not None}
+        server, ingestor = webhook.serve(port=0, background=True, app_secret=secret, model_dir=model_dir,
+                                         reload_seconds=0, failed_path=os.path.join(model_dir, "failed.ndjson"),
+                                         **kwargs)
+        url = f"http://127.0.0.1:{server.server_port}/webhook"
+    metrics_url = url.rsplit("/", 1)[0] + "/metrics"
+
+    try:
+        print(f"[replay] {sum(sizes)} commentaires en {len(bodies)} notifications -> {url} "
+              f"({a.clients} clients, {'au plus vite' if not a.rate else f'{a.rate:.0f} commentaires/s'})")
+        sent = send_all(url, bodies, sizes, a.rate, a.clients, secret)
+        m = drain(metrics_url, sent["accepted"], a.drain_timeout)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            ingestor.stop()
+        if conn is not None:
+            if not a.keep_schema:
+                cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+                conn.commit()
+            conn.close()
+
+    lat = np.array(sent["latencies"]) * 1000
+    print(f"[replay] envoi: {sum(sizes) / sent['elapsed']:,.0f} commentaires/s offerts, statuts {sent['status']}, "
+          f"POST p50 {np.percentile(lat, 50):.1f}ms p99 {np.percentile(lat, 99):.1f}ms")
+    print(f"[replay] récepteur: {m.get('events_per_s', 0):,.0f} commentaires/s soutenus, {m['ingested']} chargés, "
+          f"{m['predicted']} prédits, {m['failed']} en échec, lot moyen {m['avg_batch_size']}")
+    if "p50_ms" in m:
+        print(f"[replay] latence réception -> prédiction: p50 {m['p50_ms']:.0f}ms, p95 {m['p95_ms']:.0f}ms, "
+              f"p99 {m['p99_ms']:.0f}ms")
+    return m
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# bench/run_suite.py
+# Suite de bout en bout reproductible: compte synthétique (faker, graine fixe) servi par le stub de l'API Graph,
+# puis extract -> transform -> load -> labels -> train -> apply_model dans un schéma jetable (bench_suite)
+# de la base configurée dans .env. Mesures par étape reprises des enregistrements d'instrumentation
+# (temps, débit, requêtes HTTP, allers-retours base, mémoire) et écrites en JSON pour bench/compare.py.
+#   python -m bench.run_suite --comments 10000                       # ~10k commentaires, toutes les étapes
+#   python -m bench.run_suite --comments 10000000 --stages transform,load,apply_model --repeat 3
+# Sans l'étape extract, le jeu brut est généré directement en NDJSON (mis en cache entre deux runs).
+# apply_model a besoin d'un modèle: garder train (et labels) dans les étapes.
+import argparse, json, os, platform, statistics, subprocess, sys, tempfile
+from datetime import datetime, timezone
+from bench.synthetic import SyntheticAccount
+from bench.stub_graph_api import serve
+
+BENCH_SCHEMA = "bench_suite"
+STAGES = ["extract", "transform", "load", "labels", "train", "apply_model"]
+RESULTS_DIR = os.path.join("bench", "results")
+# métriques résumées par étape (médiane sur les répétitions pour les temps, première valeur sinon)
+TIMED_METRICS = ["wall_time", "rows_per_s", "http_p50_ms", "http_p95_ms"]
+COUNT_METRICS = ["rows_in", "rows_out", "http_requests", "http_errors", "db_roundtrips", "peak_rss_mb"]
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+            "dirty": bool(status) if status is not None else None}
+
+def fresh_schema(load):
+    conn = load.connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}")
+    conn.commit()
+    load.ensure_schema(conn)
+    cur.execute("SELECT version()")
+    version = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return version
+
+def drop_schema(load):
+    conn = load.connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+
+def stage_key(s):
+    return s["name"] if not s.get("parent") else f"{s['parent']}/{s['name']}"
+
+def run_once(a, stages, n_posts, raw):
+    from etl import extract, transform, load, raw_store, instrumentation
+    from scripts_models import apply_model, train_and_select
+
+    postgres = fresh_schema(load)
+    work = tempfile.mkdtemp(prefix="bench_suite_")
+    transform.PROC_DIR = load.PROC_DIR = train_and_select.PROC_DIR = os.path.join(work, "processed")
+    apply_model.MODEL_DIR = train_and_select.MODEL_DIR = os.path.join(work, "models")
+    train_and_select.FEATURES_DIR = os.path.join(work, "models", "features")
+    os.makedirs(train_and_select.FEATURES_DIR, exist_ok=True)
+
+    with instrumentation.run("bench_suite") as r:
+        if "extract" in stages:
+            raw = os.path.join(work, "raw.ndjson.gz")
+            extract.extract_all(limit_posts=n_posts, save_path=raw, workers=a.workers, raw_format="ndjson")
+        if "transform" in stages:
+            transform.transform(posts=raw_store.iter_part(raw))
+        if "load" in stages:
+            load.load()
+        if "labels" in stages:
+            train_and_select.generate_sentiment_labels(workers=a.workers)
+        if "train" in stages:
+            train_and_select.train_and_select(source="db")
+        if "apply_model" in stages:
+            apply_model.apply_model()
+    with open(r.path, encoding="utf-8") as f:
+        return json.load(f), postgres
+
+def summarize(records):
+    # une entrée par étape (clé parent/nom pour les étapes imbriquées, ex. apply_model/aggregates)
+    per_stage = {}
+    for rec in records:
+        seen = {}
+        for s in rec["stages"]:
+            key = stage_key(s)
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = f"{key}#{seen[key]}"
+            per_stage.setdefault(key, []).append(s)
+    out = {}
+    for key, runs in per_stage.items():
+        m = {}
+        for name in TIMED_METRICS:
+            values = [s[name] for s in runs if s.get(name) is not None]
+            m[name] = round(statistics.median(values), 3) if values else None
+        for name in COUNT_METRICS:
+            m[name] = runs[0].get(name)
+        m["timers"] = {t: round(statistics.median(s["timers"].get(t, 0) for s in runs), 3) for t in runs[0]["timers"]}
+        m["runs"] = len(runs)
+        out[key] = m
+    out["total"] = {"wall_time": round(statistics.median(rec["wall_time"] for rec in records), 3),
+                    "peak_rss_mb": max((rec.get("peak_rss_mb") or 0) for rec in records) or None,
+                    "runs": len(records)}
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--comments", type=int, default=10000, help="commentaires au total (10k à 10M)")
+    ap.add_argument("--comments-per-post", type=int, default=100)
+    ap.add_argument("--reply-ratio", type=float, default=0.2)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--repeat", type=int, default=1, help="runs complets (schéma recréé), médiane des temps")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extract et labels")
+    ap.add_argument("--latency-ms", type=int, default=0, help="latence simulée du stub par requête")
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--out", default=None, help="fichier de résultats (défaut: bench/results/...)")
+    ap.add_argument("--keep-schema", action="store_true", help="ne pas supprimer le schéma bench_suite à la fin")
+    a = ap.parse_args()
+    stages = [s for s in a.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        ap.error(f"étapes inconnues: {', '.join(sorted(unknown))} (connues: {', '.join(STAGES)})")
+
+    n_posts = max(1, a.comments // a.comments_per_post)
+    account = SyntheticAccount(n_posts, a.comments_per_post, reply_ratio=a.reply_ratio, seed=a.seed)
+    httpd = serve(account, port=0, latency_ms=a.latency_ms, fail_rate=a.fail_rate, background=True)
+    # les settings sont lus à l'import: environnement configuré avant d'importer etl / scripts_models.
+    # Toutes les connexions (pool de etl.db et workers compris) travaillent dans le schéma de bench.
+    os.environ["IG_API_BASE"] = f"http://127.0.0.1:{httpd.server_address[1]}/v19.0"
+    os.environ.setdefault("IG_ACCESS_TOKEN", "stub")
+    os.environ.setdefault("IG_BUSINESS_ID", "stub")
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA},public"
+    from config import settings
+    from etl import load
+
+    raw = None
+    if "extract" not in stages and "transform" in stages:
+        from bench.bench_transform import build_raw
+        raw = build_raw(os.path.join(tempfile.gettempdir(),
+                                     f"bench_suite_{a.comments}_{a.comments_per_post}_{a.seed}.ndjson.gz"),
+                        n_posts, a.comments_per_post)
+
+    records, postgres = [], None
+    try:
+        for i in range(a.repeat):
+            print(f"[run_suite] run {i + 1}/{a.repeat}: {n_posts} posts, ~{a.comments} commentaires, "
+                  f"étapes {', '.join(stages)}")
+            rec, postgres = run_once(a, stages, n_posts, raw)
+            records.append(rec)
+    finally:
+        httpd.shutdown()
+        if not a.keep_schema:
+            drop_schema(load)
+
+    result = {
+        "suite": "bench.run_suite",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git": git_info(),
+        "env": {
+            "python": sys.version.split()[0], "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "postgres": postgres,
+            "settings": {k: getattr(settings, k) for k in ("LOAD_BATCH_SIZE", "PROCESSED_FORMAT", "RAW_COMPRESSION",
+                                                          "EXTRACT_WORKERS", "PREDICTION_CACHE_PERSIST")},
+        },
+        "scale": {"comments": a.comments, "comments_per_post": a.comments_per_post, "posts": n_posts,
+                  "reply_ratio": a.reply_ratio, "seed": a.seed, "latency_ms": a.latency_ms,
+                  "fail_rate": a.fail_rate, "workers": a.workers},
+        "stages_run": stages,
+        "stages": summarize(records),
+        "runs": [rec["run_id"] for rec in records],
+    }
+    commit = (result["git"]["commit"] or "nogit")[:8] + ("-dirty" if result["git"]["dirty"] else "")
+    out = a.out or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}-{a.comments}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    for key, m in result["stages"].items():
+        if key == "total":
+            continue
+        rate = f"{m['rows_per_s']:>12,.0f} lignes/s" if m["rows_per_s"] else " " * 21
+        print(f"[run_suite] {key:24s} {m['wall_time']:>9.2f}s {rate} {m['http_requests']:>7} req "
+              f"{m['db_roundtrips']:>7} allers-retours base")
+    print(f"[run_suite] total {result['stages']['total']['wall_time']:.1f}s -> {out}")
+    return out
+
+if __name__ == "__main__":
+    main()
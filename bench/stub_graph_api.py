@@ -0,0 +1,122 @@
+# bench/stub_graph_api.py
+# Stub local des endpoints graph.facebook.com/v19.0 utilisés par etl/extract.py
+#   python -m bench.stub_graph_api --posts 500 --comments 200 --port 8765
+#   IG_API_BASE=http://127.0.0.1:8765/v19.0 IG_ACCESS_TOKEN=x IG_BUSINESS_ID=1 python -m etl.extract
+import argparse, json, random, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from bench.synthetic import SyntheticAccount
+
+API_VERSION = "v19.0"
+
+class StubState:
+    def __init__(self, account, latency_ms=0, fail_rate=0.0, quota_per_min=0):
+        self.account = account
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.quota_per_min = quota_per_min
+        self.lock = threading.Lock()
+        self.calls = deque()
+        self.served = 0
+        self.failed = 0
+
+    def usage(self):
+        # pourcentage d'usage simulé sur une fenêtre glissante d'une minute
+        now = time.time()
+        with self.lock:
+            self.calls.append(now)
+            while self.calls and self.calls[0] < now - 60:
+                self.calls.popleft()
+            n = len(self.calls)
+        if not self.quota_per_min:
+            return 0
+        return min(100, int(n * 100 / self.quota_per_min))
+
+class Handler(BaseHTTPRequestHandler):
+    state = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, usage=0):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-App-Usage", json.dumps({"call_count": usage, "total_cputime": usage // 2, "total_time": usage // 2}))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _page(self, items_fn, total, base_url, query):
+        limit = int(query.get("limit", ["25"])[0])
+        start = int(query.get("after", ["0"])[0])
+        stop = min(start + limit, total)
+        body = {"data": items_fn(start, stop), "paging": {"cursors": {"before": str(start), "after": str(stop)}}}
+        if stop < total:
+            q = {k: v[0] for k, v in query.items()}
+            q["after"] = str(stop)
+            body["paging"]["next"] = f"{base_url}?{urlencode(q)}"
+        return body
+
+    def do_GET(self):
+        st = self.state
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if st.latency_ms:
+            time.sleep(st.latency_ms / 1000)
+        usage = st.usage()
+        if usage >= 100:
+            with st.lock:
+                st.failed += 1
+            return self._send(400, {"error": {"code": 4, "message": "Application request limit reached"}}, usage)
+        if st.fail_rate and random.random() < st.fail_rate:
+            with st.lock:
+                st.failed += 1
+            return self._send(503, {"error": {"code": 2, "message": "Service temporarily unavailable"}}, usage)
+        if len(parts) != 3 or parts[0] != API_VERSION:
+            return self._send(404, {"error": {"code": 803, "message": "Unknown path"}}, usage)
+        base_url = f"http://{self.headers.get('Host')}/{'/'.join(parts)}"
+        acc = st.account
+        try:
+            if parts[2] == "media":
+                body = self._page(lambda a, b: [acc.media(i) for i in range(a, b)], acc.n_posts, base_url, query)
+            elif parts[2] == "comments":
+                i = acc.media_index(parts[1])
+                body = self._page(lambda a, b: acc.comments(i, a, b), acc.comment_count(i), base_url, query)
+            else:
+                return self._send(404, {"error": {"code": 803, "message": "Unknown edge"}}, usage)
+        except (KeyError, ValueError):
+            return self._send(404, {"error": {"code": 100, "message": "Unknown object"}}, usage)
+        with st.lock:
+            st.served += 1
+        self._send(200, body, usage)
+
+def serve(account, host="127.0.0.1", port=8765, latency_ms=0, fail_rate=0.0, quota_per_min=0, background=False):
+    handler = type("BoundHandler", (Handler,), {"state": StubState(account, latency_ms, fail_rate, quota_per_min)})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    if background:
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+    print(f"[stub] http://{host}:{httpd.server_address[1]}/{API_VERSION} ({account.n_posts} posts)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return httpd
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--posts", type=int, default=500)
+    ap.add_argument("--comments", type=int, default=100, help="commentaires moyens par post")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=int, default=50)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--quota-per-min", type=int, default=0)
+    a = ap.parse_args()
+    serve(SyntheticAccount(a.posts, a.comments, seed=a.seed), port=a.port,
+          latency_ms=a.latency_ms, fail_rate=a.fail_rate, quota_per_min=a.quota_per_min)
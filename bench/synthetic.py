@@ -0,0 +1,114 @@
+# bench/synthetic.py
+# Génération déterministe de comptes Instagram synthétiques (media / commentaires / réponses)
+import random
+from datetime import datetime, timedelta, timezone
+from faker import Faker
+
+MEDIA_ID_BASE = 17900000000000000
+COMMENT_ID_BASE = 18000000000000000
+MEDIA_TYPES = ["IMAGE", "CAROUSEL_ALBUM", "VIDEO"]
+EMOJIS = ["🔥", "❤️", "😍", "👏", "💯", "😂", "😡", "👎", "🙏", "✨", "🇫🇷", "👍🏽"]
+SHORT_COMMENTS = ["Super !", "🔥🔥🔥", "❤️", "Trop beau", "Bravo 👏", "Nul", "J'adore", "Magnifique 😍", "Bof..."]
+
+class SyntheticAccount:
+    """Compte synthétique: chaque media/commentaire est recalculé à partir de son index,
+    ce qui permet de servir des millions de commentaires sans tout garder en mémoire."""
+
+    def __init__(self, n_posts=100, comments_per_post=50, reply_ratio=0.2, seed=42, locale="fr_FR"):
+        self.n_posts = n_posts
+        self.comments_per_post = comments_per_post
+        self.reply_ratio = reply_ratio
+        self.seed = seed
+        self.fake = Faker(locale)
+        self.start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def media_id(self, i):
+        return str(MEDIA_ID_BASE + i)
+
+    def media_index(self, media_id):
+        i = int(media_id) - MEDIA_ID_BASE
+        if not 0 <= i < self.n_posts:
+            raise KeyError(media_id)
+        return i
+
+    def comment_id(self, i, j):
+        return str(COMMENT_ID_BASE + i * 1_000_000 + j)
+
+    def comment_count(self, i):
+        # nombre de commentaires variable autour de la moyenne demandée
+        rnd = random.Random(self.seed * 7919 + i)
+        return max(0, int(rnd.gauss(self.comments_per_post, self.comments_per_post / 4)))
+
+    def _text(self, rnd):
+        if rnd.random() < 0.4:
+            return rnd.choice(SHORT_COMMENTS)
+        text = self.fake.sentence(nb_words=rnd.randint(3, 20))
+        if rnd.random() < 0.5:
+            text += " " + "".join(rnd.choice(EMOJIS) for _ in range(rnd.randint(1, 3)))
+        if rnd.random() < 0.05:
+            text += " https://example.com/" + self.fake.uri_path()
+        return text
+
+    def _timestamp(self, dt):
+        return dt.strftime("%Y-%m-%dT%H:%M:%S+0000")
+
+    def media(self, i):
+        rnd = random.Random(self.seed * 104729 + i)
+        self.fake.seed_instance(self.seed * 104729 + i)
+        # les media les plus récents ont l'index le plus petit (ordre de l'API)
+        created = self.start + timedelta(hours=3 * (self.n_posts - i))
+        mid = self.media_id(i)
+        return {
+            "id": mid,
+            "caption": self._text(rnd),
+            "media_type": rnd.choice(MEDIA_TYPES),
+            "media_url": f"https://cdn.example.com/{mid}.jpg",
+            "permalink": f"https://www.instagram.com/p/{mid}/",
+            "timestamp": self._timestamp(created),
+            "like_count": rnd.randint(0, 5000),
+            "comments_count": self.comment_count(i),
+        }
+
+    def comment(self, i, j, with_replies=True):
+        key = self.seed * 1_000_003 + i * 1_000_000 + j
+        rnd = random.Random(key)
+        self.fake.seed_instance(key)
+        created = self.start + timedelta(hours=3 * (self.n_posts - i), minutes=j)
+        c = {
+            "id": self.comment_id(i, j),
+            "text": self._text(rnd),
+            "username": self.fake.user_name(),
+            "timestamp": self._timestamp(created),
+            "like_count": rnd.randint(0, 50),
+        }
+        if with_replies and rnd.random() < self.reply_ratio:
+            replies = []
+            for k in range(rnd.randint(1, 3)):
+                rkey = key * 7 + k
+                rr = random.Random(rkey)
+                self.fake.seed_instance(rkey)
+                replies.append({
+                    "id": f"{c['id']}{k + 1:02d}",
+                    "text": self._text(rr),
+                    "username": self.fake.user_name(),
+                    "timestamp": self._timestamp(created + timedelta(minutes=k + 1)),
+                    "like_count": rr.randint(0, 10),
+                })
+            c["replies"] = {"data": replies}
+        return c
+
+    def comments(self, i, start=0, stop=None, with_replies=True):
+        # l'API renvoie les commentaires du plus récent au plus ancien
+        n = self.comment_count(i)
+        stop = n if stop is None else min(stop, n)
+        return [self.comment(i, n - 1 - j, with_replies) for j in range(start, stop)]
+
+    def iter_posts(self):
+        # même forme que data/raw/instagram_raw_posts.json
+        for i in range(self.n_posts):
+            m = self.media(i)
+            m["fetched_comments"] = self.comments(i)
+            yield m
+
+    def total_comments(self):
+        return sum(self.comment_count(i) for i in range(self.n_posts))
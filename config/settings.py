@@ -13,3 +13,70 @@ DB_PORT = int(os.getenv("DB_PORT", 5432))
 DB_NAME = os.getenv("DB_NAME", "DB_NAME")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASS = os.getenv("DB_PASS", "DB_PASS")
+
+# Accès base (etl/db.py): pool de connexions par processus; réplique en lecture pour le scoring et
+# l'entraînement (DSN libpq, ex. "host=replica port=5432 dbname=insta user=ro password=..."; vide = primaire)
+DB_REPLICA_DSN = os.getenv("DB_REPLICA_DSN", "")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 8))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # attente max d'une connexion libre (s)
+
+# API Graph (surchargeable pour pointer vers un stub local, cf. bench/stub_graph_api.py)
+GRAPH_API_BASE = os.getenv("IG_API_BASE", "https://graph.facebook.com/v19.0")
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", 8))
+EXTRACT_MAX_RETRIES = int(os.getenv("EXTRACT_MAX_RETRIES", 5))
+
+# Couche brute: "ndjson" (append-only, partitionné) ou "json" (ancien fichier unique)
+RAW_FORMAT = os.getenv("RAW_FORMAT", "ndjson")
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION", "gzip")  # none, gzip ou zstd
+
+# Chargement: nombre de lignes par COPY
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", 10000))
+
+# Sortie de transform / entrée de load: "csv" (posts.csv, comments.csv, flat_texts.json),
+# "parquet" ou "arrow" (datasets typés partitionnés par date du post)
+PROCESSED_FORMAT = os.getenv("PROCESSED_FORMAT", "csv")
+
+# Service de prédiction (scripts_models/serve.py)
+SERVE_HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.getenv("SERVE_PORT", 8700))
+SERVE_MAX_BATCH = int(os.getenv("SERVE_MAX_BATCH", 256))        # textes max par vect.transform
+SERVE_MAX_WAIT_MS = float(os.getenv("SERVE_MAX_WAIT_MS", 2))    # attente max pour remplir un lot
+SERVE_RELOAD_SECONDS = float(os.getenv("SERVE_RELOAD_SECONDS", 5))  # 0 = pas de rechargement à chaud
+
+# Réception des webhooks Instagram (etl/webhook.py): jeton de vérification de l'abonnement, secret de l'app
+# pour X-Hub-Signature-256 (vide: le serveur refuse de démarrer, sauf --insecure en local), micro-lots de
+# commentaires, rafraîchissement des agrégats au plus toutes les N secondes, point de contrôle du run
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8710))
+WEBHOOK_VERIFY_TOKEN = os.getenv("WEBHOOK_VERIFY_TOKEN", "")
+WEBHOOK_APP_SECRET = os.getenv("WEBHOOK_APP_SECRET", "")
+WEBHOOK_MAX_BATCH = int(os.getenv("WEBHOOK_MAX_BATCH", 500))        # commentaires max par micro-lot
+WEBHOOK_MAX_WAIT_MS = float(os.getenv("WEBHOOK_MAX_WAIT_MS", 200))  # attente max pour remplir un lot
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100000))   # au-delà: 503, Meta renvoie plus tard
+WEBHOOK_AGG_REFRESH_SECONDS = float(os.getenv("WEBHOOK_AGG_REFRESH_SECONDS", 5))
+WEBHOOK_TIME_WINDOW_MINUTES = int(os.getenv("WEBHOOK_TIME_WINDOW_MINUTES", 10))  # heure notification / API
+WEBHOOK_CHECKPOINT_SECONDS = float(os.getenv("WEBHOOK_CHECKPOINT_SECONDS", 60))  # 0 = pas de point de contrôle
+
+# Cache des prédictions (scripts_models/cache.py): taille du LRU et table prediction_cache
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", 100000))
+PREDICTION_CACHE_PERSIST = os.getenv("PREDICTION_CACHE_PERSIST", "1") == "1"
+
+# Agrégats Power BI (etl/aggregates.py): marge de relecture pour les transactions encore ouvertes
+AGG_REFRESH_OVERLAP_MINUTES = int(os.getenv("AGG_REFRESH_OVERLAP_MINUTES", 5))
+
+# flat_texts partitionnée (etl/partitions.py): mois créés à l'avance
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+
+# Orchestrateur en flux (etl/orchestrator.py): media par lot et lots en attente entre deux étapes
+ORCH_BATCH_MEDIA = int(os.getenv("ORCH_BATCH_MEDIA", 10))
+ORCH_QUEUE_SIZE = int(os.getenv("ORCH_QUEUE_SIZE", 2))
+
+# Instrumentation (etl/instrumentation.py): enregistrements JSON des runs, copie dans pipeline_runs,
+# étapes appelées hors d'un run enregistrées seules (désactivé: les points d'entrée ouvrent leur run),
+# profilage des étapes listées ("load,transform" ou "all") en mode "cprofile" ou "sample"
+RUN_RECORDS_DIR = os.getenv("RUN_RECORDS_DIR", "logs/runs")
+RUN_RECORDS_DB = os.getenv("RUN_RECORDS_DB", "1") == "1"
+RUN_RECORDS_STANDALONE = os.getenv("RUN_RECORDS_STANDALONE", "0") == "1"
+PROFILE_STAGES = os.getenv("PROFILE_STAGES", "")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
@@ -0,0 +1,155 @@
+# etl/aggregates.py
+# Rafraîchissement des agrégats matérialisés (sql/aggregates.sql) lus par les vues Power BI (sql/vue.sql).
+#   python -m etl.aggregates            rafraîchissement incrémental
+#   python -m etl.aggregates --full     reconstruction complète (après une suppression de lignes)
+#   python -m etl.aggregates --views    (re)crée aussi les vues de sql/vue.sql
+# Incrémental: les lignes de flat_texts modifiées depuis le dernier rafraîchissement (updated_at) donnent
+# les clés (post, jour) et (utilisateur, jour) à recalculer; le coût dépend du volume modifié, pas de
+# l'historique. updated_at vaut le début de la transaction qui écrit: le watermark est donc le début de la
+# plus ancienne transaction encore ouverte (un chargement long, non visible ici, sera vu au prochain
+# rafraîchissement). La marge AGG_REFRESH_OVERLAP_MINUTES couvre les sessions que pg_stat_activity ne
+# montre pas à un rôle sans pg_read_all_stats.
+import sys, time
+from datetime import timedelta
+from config.settings import AGG_REFRESH_OVERLAP_MINUTES, WEBHOOK_TIME_WINDOW_MINUTES
+from etl import db, instrumentation
+
+AGGREGATES_SQL = "sql/aggregates.sql"
+VIEWS_SQL = "sql/vue.sql"
+
+DAY = "COALESCE(f.created_time::date, '-infinity'::date)"
+SENTIMENT = "COALESCE(f.predicted_sentiment, 'non_analysé')"
+
+POST_AGG_SELECT = f"""
+    SELECT f.post_id, {DAY}, {SENTIMENT},
+           COUNT(*), COUNT(*) FILTER (WHERE f.text != ''),
+           COUNT(*) FILTER (WHERE f.source_type = 'post'), COUNT(*) FILTER (WHERE f.source_type != 'post'),
+           COALESCE(SUM(f.like_count), 0)
+    FROM flat_texts f
+"""
+USER_AGG_SELECT = f"""
+    SELECT f.username, {DAY}, {SENTIMENT}, COUNT(*), COALESCE(SUM(f.like_count), 0)
+    FROM flat_texts f
+"""
+EMOJI_AGG_SELECT = f"""
+    SELECT f.post_id, {DAY}, e.emoji, SUM(e.count)
+    FROM flat_texts f JOIN text_emojis e ON e.flat_text_id = f.id
+"""
+
+FULL_REFRESH_SQL = f"""
+    TRUNCATE agg_post_daily, agg_user_daily, agg_emoji_daily;
+    INSERT INTO agg_post_daily {POST_AGG_SELECT} GROUP BY 1, 2, 3;
+    INSERT INTO agg_user_daily {USER_AGG_SELECT}
+    WHERE f.username IS NOT NULL AND f.source_type != 'post' GROUP BY 1, 2, 3;
+    INSERT INTO agg_emoji_daily {EMOJI_AGG_SELECT} GROUP BY 1, 2, 3;
+"""
+
+# clés touchées depuis %(since)s. Le batch remplace l'heure de notification d'un texte reçu par webhook par
+# la date de l'API (etl/load.py), à moins de %(window)s près: les jours voisins de la date actuelle sont
+# recalculés aussi, l'ancien jour d'un texte déplacé autour de minuit en fait partie
+DIRTY_DAYS = f"""(VALUES ({DAY}), (COALESCE((f.created_time - %(window)s)::date, '-infinity'::date)),
+                          (COALESCE((f.created_time + %(window)s)::date, '-infinity'::date))) d(day)"""
+DIRTY_SQL = f"""
+    CREATE TEMP TABLE dirty_post_days ON COMMIT DROP AS
+    SELECT DISTINCT f.post_id, d.day FROM flat_texts f CROSS JOIN LATERAL {DIRTY_DAYS}
+    WHERE f.updated_at >= %(since)s;
+    CREATE TEMP TABLE dirty_user_days ON COMMIT DROP AS
+    SELECT DISTINCT f.username, d.day FROM flat_texts f CROSS JOIN LATERAL {DIRTY_DAYS}
+    WHERE f.updated_at >= %(since)s AND f.username IS NOT NULL AND f.source_type != 'post';
+    ANALYZE dirty_post_days;
+    ANALYZE dirty_user_days;
+"""
+
+INCREMENTAL_SQL = f"""
+    DELETE FROM agg_post_daily a USING dirty_post_days d WHERE a.post_id = d.post_id AND a.day = d.day;
+    INSERT INTO agg_post_daily {POST_AGG_SELECT}
+    JOIN dirty_post_days d ON f.post_id = d.post_id AND {DAY} = d.day
+    GROUP BY 1, 2, 3;
+
+    DELETE FROM agg_emoji_daily a USING dirty_post_days d WHERE a.post_id = d.post_id AND a.day = d.day;
+    INSERT INTO agg_emoji_daily {EMOJI_AGG_SELECT}
+    JOIN dirty_post_days d ON f.post_id = d.post_id AND {DAY} = d.day
+    GROUP BY 1, 2, 3;
+
+    DELETE FROM agg_user_daily a USING dirty_user_days d WHERE a.username = d.username AND a.day = d.day;
+    INSERT INTO agg_user_daily {USER_AGG_SELECT}
+    JOIN dirty_user_days d ON f.username = d.username AND {DAY} = d.day
+    WHERE f.source_type != 'post'
+    GROUP BY 1, 2, 3;
+"""
+
+# lu avant DIRTY_SQL (snapshot par instruction): une transaction encore ouverte à ce moment-là a
+# xact_start >= watermark, une transaction commencée après a updated_at >= now().
+# Même borne pour tout horodatage écrit avec now() (flat_texts.labeled_at, scripts_models/train_online.py)
+OPEN_XACT_WATERMARK = """LEAST(now(), (SELECT MIN(xact_start) FROM pg_stat_activity
+                         WHERE datname = current_database() AND pid != pg_backend_pid()
+                         AND backend_type = 'client backend'))"""
+WATERMARK_SQL = f"""
+    SELECT {OPEN_XACT_WATERMARK},
+           (SELECT refreshed_at FROM agg_refresh_state)
+"""
+
+SET_WATERMARK_SQL = """
+    INSERT INTO agg_refresh_state (id, refreshed_at) VALUES (TRUE, %s)
+    ON CONFLICT (id) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at
+"""
+
+def ensure_aggregates(conn, views=False):
+    files = [AGGREGATES_SQL] + ([VIEWS_SQL] if views else [])
+    cur = conn.cursor()
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            cur.execute(f.read())
+    conn.commit()
+    cur.close()
+
+def _refresh(conn, full, overlap_minutes):
+    cur = conn.cursor()
+    # les CREATE INDEX de sql/aggregates.sql attendent la fin de toute écriture en cours sur flat_texts
+    # (et bloquent les suivantes): seulement au premier rafraîchissement ou en complet
+    cur.execute("SELECT to_regclass('agg_refresh_state')")
+    if full or cur.fetchone()[0] is None:
+        ensure_aggregates(conn)
+        cur = conn.cursor()
+    start = time.time()
+    # un seul rafraîchissement à la fois (pipeline et apply_model peuvent se chevaucher)
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('agg_refresh'))")
+    # début de la plus ancienne transaction en cours: ses lignes seront vues au prochain rafraîchissement
+    cur.execute(WATERMARK_SQL)
+    watermark, last = cur.fetchone()
+    if full or last is None:
+        cur.execute(FULL_REFRESH_SQL)
+        mode, keys = "complet", None
+    else:
+        cur.execute(DIRTY_SQL, {"since": last - timedelta(minutes=overlap_minutes),
+                                "window": timedelta(minutes=WEBHOOK_TIME_WINDOW_MINUTES)})
+        cur.execute("SELECT (SELECT COUNT(*) FROM dirty_post_days), (SELECT COUNT(*) FROM dirty_user_days)")
+        keys = cur.fetchone()
+        cur.execute(INCREMENTAL_SQL)
+        mode = "incrémental"
+    cur.execute(SET_WATERMARK_SQL, (watermark,))
+    conn.commit()
+    cur.close()
+    detail = f", {keys[0]} (post, jour) et {keys[1]} (utilisateur, jour) recalculés" if keys else ""
+    print(f"[aggregates] rafraîchissement {mode} en {time.time() - start:.2f}s{detail}")
+    return keys, mode
+
+def refresh(conn=None, full=False, overlap_minutes=AGG_REFRESH_OVERLAP_MINUTES, instrumented=True):
+    # instrumented=False: pas d'étape "aggregates" (appels répétés d'un processus long, ex. etl/webhook.py,
+    # dont le run accumulerait une étape par rafraîchissement)
+    if conn is None:
+        with db.connection() as conn:
+            return refresh(conn, full, overlap_minutes, instrumented)
+    if not instrumented:
+        return _refresh(conn, full, overlap_minutes)[0]
+    with instrumentation.stage("aggregates") as st:
+        keys, mode = _refresh(conn, full, overlap_minutes)
+        st.rows_out = sum(keys) if keys else None
+        st.extra["mode"] = mode
+        return keys
+
+if __name__ == "__main__":
+    with instrumentation.run("aggregates"), db.connection() as conn:
+        if "--views" in sys.argv:
+            ensure_aggregates(conn, views=True)
+        refresh(conn, full="--full" in sys.argv)
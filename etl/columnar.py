@@ -0,0 +1,123 @@
+# etl/columnar.py
+# Couche intermédiaire colonne (Parquet ou Arrow IPC) entre transform et load / entraînement:
+#   data/processed/datasets/<table>/post_date=2025-09-09/part-<run>-<n>.parquet
+# Types conservés (timestamps UTC, entiers, ids en texte), compression zstd pour Parquet,
+# fichiers IPC lisibles en memory-map, lecture de quelques colonnes seulement.
+# Les lots sont numérotés sur 6 chiffres: à la relecture, l'ordre des fichiers d'une partition
+# est l'ordre d'écriture (la dernière version d'une ligne reste la dernière).
+import os, json, shutil, uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+DATASETS_DIR = "datasets"
+FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+TS = pa.timestamp("us", tz="UTC")
+
+SCHEMAS = {
+    "posts": pa.schema([
+        ("post_id", pa.string()), ("caption", pa.string()), ("media_type", pa.string()),
+        ("media_url", pa.string()), ("permalink", pa.string()), ("created_time", TS),
+        ("like_count", pa.int64()), ("comments_count", pa.int64()), ("post_date", pa.date32()),
+    ]),
+    "comments": pa.schema([
+        ("comment_id", pa.string()), ("post_id", pa.string()), ("parent_comment_id", pa.string()),
+        ("username", pa.string()), ("text", pa.string()), ("like_count", pa.int64()),
+        ("created_time", TS), ("post_date", pa.date32()),
+    ]),
+    "flat_texts": pa.schema([
+        ("source_type", pa.string()), ("source_id", pa.string()), ("post_id", pa.string()),
+        ("parent_comment_id", pa.string()), ("username", pa.string()), ("text", pa.string()),
+        ("like_count", pa.int64()), ("emoji_summary", pa.string()), ("created_time", TS),
+        ("post_date", pa.date32()),
+    ]),
+}
+
+def dataset_path(name, proc_dir):
+    return os.path.join(proc_dir, DATASETS_DIR, name)
+
+def exists(name, proc_dir):
+    return os.path.isdir(dataset_path(name, proc_dir))
+
+def _to_table(df, name):
+    schema = SCHEMAS[name]
+    df = df.copy()
+    for field in schema:
+        if field.name not in df:
+            df[field.name] = None
+        if pa.types.is_string(field.type):
+            # colonnes entièrement vides (float NaN) ou chaînes pandas: objets Python / None
+            df[field.name] = df[field.name].astype(object).where(df[field.name].notna(), None)
+    if "emoji_summary" in df:
+        df["emoji_summary"] = df["emoji_summary"].map(
+            lambda d: d if d is None or isinstance(d, str) else json.dumps(d, ensure_ascii=False))
+    df["created_time"] = pd.to_datetime(df["created_time"], utc=True)
+    return pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+class DatasetWriter:
+    """Même interface que transform.ProcessedWriter, en datasets partitionnés par date du post"""
+
+    def __init__(self, proc_dir, fmt="parquet"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Format colonne inconnu: {fmt}")
+        self.fmt = fmt
+        self.root = os.path.join(proc_dir, DATASETS_DIR)
+        # comme les CSV, un transform remplace la sortie précédente
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.run = uuid.uuid4().hex[:8]
+        self.batch = 0
+        self.counts = {"posts": 0, "comments": 0, "flat": 0}
+
+    def _write(self, name, df):
+        if not len(df):
+            return
+        opts = {}
+        if self.fmt == "parquet":
+            opts["file_options"] = ds.ParquetFileFormat().make_write_options(compression="zstd")
+        ds.write_dataset(
+            _to_table(df, name), os.path.join(self.root, name), format=FORMATS[self.fmt],
+            partitioning=["post_date"], partitioning_flavor="hive",
+            basename_template=f"part-{self.run}-{self.batch:06d}-{{i}}.{self.fmt}",
+            existing_data_behavior="overwrite_or_ignore", **opts)
+
+    def write(self, posts_rows, comments_rows, flat_rows):
+        posts_df = pd.DataFrame(posts_rows, columns=SCHEMAS["posts"].names[:-1])
+        comments_df = pd.DataFrame(comments_rows, columns=SCHEMAS["comments"].names[:-1])
+        flat_df = pd.DataFrame(flat_rows, columns=SCHEMAS["flat_texts"].names[:-1])
+        # partition = date du post parent, pour les commentaires et les textes aussi
+        post_date = pd.to_datetime(posts_df["created_time"], utc=True).dt.date
+        dates = dict(zip(posts_df["post_id"], post_date))
+        posts_df["post_date"] = post_date
+        comments_df["post_date"] = comments_df["post_id"].map(dates)
+        flat_df["post_date"] = flat_df["post_id"].map(dates)
+        self._write("posts", posts_df)
+        self._write("comments", comments_df)
+        self._write("flat_texts", flat_df)
+        self.batch += 1
+        self.counts["posts"] += len(posts_df)
+        self.counts["comments"] += len(comments_df)
+        self.counts["flat"] += len(flat_df)
+
+    def close(self):
+        pass
+
+def _format_of(path):
+    for root, _, files in os.walk(path):
+        for f in files:
+            if f.endswith(".arrow"):
+                return "ipc"
+            if f.endswith(".parquet"):
+                return "parquet"
+    return "parquet"
+
+def read_table(name, proc_dir, columns=None, filter=None):
+    # lit seulement les colonnes demandées; les fichiers IPC sont memory-mappés
+    path = os.path.abspath(dataset_path(name, proc_dir))
+    fmt = _format_of(path)
+    dataset = ds.dataset(path, format=fmt, partitioning="hive",
+                         filesystem=fs.LocalFileSystem(use_mmap=(fmt == "ipc")))
+    df = dataset.to_table(columns=columns, filter=filter).to_pandas()
+    if "post_date" in df and (columns is None or "post_date" not in columns):
+        df = df.drop(columns="post_date")
+    return df
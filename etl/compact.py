@@ -0,0 +1,65 @@
+# etl/compact.py
+# Dédoublonnage en place de flat_texts (une ligne par source_type, source_id), à lancer une fois
+# sur une base alimentée avant la clé naturelle:  python -m etl.compact [--full]
+import sys
+from etl import aggregates, db, partitions
+
+# on garde la ligne la plus utile: déjà prédite, puis déjà labellisée, puis la plus récente
+DEDUP_SQL = """
+    DELETE FROM flat_texts f
+    USING (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY source_type, source_id
+            ORDER BY (predicted_sentiment IS NOT NULL) DESC,
+                     (sentiment_label IS NOT NULL) DESC,
+                     updated_at DESC NULLS LAST,
+                     created_at DESC NULLS LAST
+        ) AS rn
+        FROM flat_texts
+    ) d
+    WHERE f.id = d.id AND d.rn > 1
+"""
+
+# clé naturelle posée une fois les doublons supprimés, comme dans sql/schema.sql (index créé s'il manque
+# puis promu en contrainte nommée pour ON CONFLICT ON CONSTRAINT). Table simple seulement
+SOURCE_KEY_SQL = """
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE i.indrelid = 'flat_texts'::regclass AND c.relname = 'uq_flat_texts_source') THEN
+        CREATE UNIQUE INDEX uq_flat_texts_source ON flat_texts(source_type, source_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conname = 'uq_flat_texts_source' AND conrelid = 'flat_texts'::regclass) THEN
+        ALTER TABLE flat_texts ADD CONSTRAINT uq_flat_texts_source UNIQUE USING INDEX uq_flat_texts_source;
+    END IF;
+END $$;
+"""
+
+def compact(full=False):
+    with db.connection() as conn:
+        cur = conn.cursor()
+        # bloque les écritures concurrentes (pipeline) le temps du dédoublonnage
+        cur.execute("LOCK TABLE flat_texts IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute("SELECT COUNT(*) FROM flat_texts")
+        before = cur.fetchone()[0]
+        cur.execute(DEDUP_SQL)
+        removed = cur.rowcount
+        # table partitionnée: la contrainte uq_flat_texts_source (created_time compris) vient de
+        # partitions.migrate, un index unique sans la clé de partition serait refusé
+        if not partitions.is_partitioned(conn):
+            cur.execute(SOURCE_KEY_SQL)
+        conn.commit()
+
+        # VACUUM ne peut pas tourner dans une transaction; FULL réécrit la table (verrou exclusif)
+        conn.autocommit = True
+        cur.execute("VACUUM (FULL, ANALYZE) flat_texts" if full else "VACUUM (ANALYZE) flat_texts")
+        cur.close()
+    print(f"[compact] flat_texts: {before} -> {before - removed} lignes ({removed} doublons supprimés)")
+    # les suppressions ne laissent pas de trace dans updated_at: agrégats reconstruits
+    if removed:
+        aggregates.refresh(full=True)
+    return removed
+
+if __name__ == "__main__":
+    compact(full="--full" in sys.argv)
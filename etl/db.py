@@ -0,0 +1,194 @@
+# etl/db.py
+# Accès base partagé par l'ETL et les scripts modèles.
+#   with db.connection() as conn: ...                  connexion du pool, rendue (transaction annulée) en sortie
+#   with db.connection(readonly=True) as conn: ...     lectures lourdes: réplique si DB_REPLICA_DSN, sinon primaire
+#   for rows in db.stream(sql, params): ...            curseur serveur, chunk_size lignes en mémoire à la fois
+#   df = db.read_frame(sql, params)                    DataFrame lu par curseur serveur (sans SQLAlchemy)
+#   db.write_values(conn, sql, rows, template)         INSERT / UPDATE ... VALUES %s par paquets, commit par paquet
+#   db.copy_rows(cur, table, columns, rows)            COPY FROM STDIN par paquets
+# Un pool par processus et par cible (primaire / réplique), borné à DB_POOL_MAX: au-delà, connection() attend
+# qu'une connexion soit rendue. Un worker forké crée son propre pool et ne touche jamais aux sockets du parent.
+# db.connect() ouvre une connexion dédiée hors pool, pour les sessions modifiées (SET search_path des bench).
+# La réplique peut être en retard sur le primaire: une lecture qui doit voir une écriture qui vient d'être
+# commitée (orchestrateur, entraînement juste après la génération des labels) reste sur le primaire.
+import atexit, io, json, math, os, threading
+from contextlib import contextmanager
+import pandas as pd
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+from config.settings import (DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS, DB_REPLICA_DSN,
+                             DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, LOAD_BATCH_SIZE)
+from etl.instrumentation import CountingConnection
+
+PRIMARY, REPLICA = "primary", "replica"
+STREAM_CHUNK_SIZE = 5000
+
+_lock = threading.Lock()
+_pools = {}       # (pid, cible) -> _Pool
+_inherited = []   # pools hérités du parent après un fork: gardés en vie (les libérer fermerait ses sockets)
+
+def _target(readonly):
+    return REPLICA if readonly and DB_REPLICA_DSN else PRIMARY
+
+def _params(target):
+    if target == REPLICA:
+        return {"dsn": DB_REPLICA_DSN}
+    return {"host": DB_HOST, "port": DB_PORT, "dbname": DB_NAME, "user": DB_USER, "password": DB_PASS}
+
+def connect(readonly=False):
+    """Connexion dédiée hors pool, à fermer par l'appelant"""
+    return psycopg2.connect(connection_factory=CountingConnection, **_params(_target(readonly)))
+
+class _Pool:
+    def __init__(self, target):
+        self.target = target
+        self.pool = psycopg2.pool.ThreadedConnectionPool(min(DB_POOL_MIN, DB_POOL_MAX), DB_POOL_MAX,
+                                                         connection_factory=CountingConnection, **_params(target))
+        # ThreadedConnectionPool lève PoolError quand il est plein: le sémaphore fait attendre à la place
+        self.slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+def _pool(target):
+    pid = os.getpid()
+    with _lock:
+        pool = _pools.get((pid, target))
+        if pool is None:
+            for key in [k for k in _pools if k[0] != pid]:
+                _inherited.append(_pools.pop(key))
+            pool = _pools[(pid, target)] = _Pool(target)
+        return pool
+
+def getconn(readonly=False):
+    """Connexion empruntée au pool; à rendre avec putconn (ou utiliser connection())"""
+    pool = _pool(_target(readonly))
+    if not pool.slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError(f"pool {pool.target}: aucune connexion libre après {DB_POOL_TIMEOUT:.0f}s "
+                                      f"(DB_POOL_MAX={DB_POOL_MAX})")
+    try:
+        conn = pool.pool.getconn()
+        if conn.closed:
+            # connexion perdue pendant qu'elle dormait dans le pool: remplacée
+            pool.pool.putconn(conn, close=True)
+            conn = pool.pool.getconn()
+    except BaseException:
+        pool.slots.release()
+        raise
+    conn.db_pool = pool
+    return conn
+
+def putconn(conn):
+    # le pool annule la transaction en cours; autocommit (VACUUM, compact) est remis à sa valeur par défaut
+    pool = conn.db_pool
+    try:
+        broken = bool(conn.closed)
+        if not broken and conn.autocommit:
+            try:
+                conn.autocommit = False
+            except psycopg2.Error:
+                broken = True
+        pool.pool.putconn(conn, close=broken)
+    finally:
+        pool.slots.release()
+
+@contextmanager
+def connection(readonly=False):
+    conn = getconn(readonly)
+    try:
+        yield conn
+    finally:
+        putconn(conn)
+
+def close_all():
+    with _lock:
+        for key in [k for k in _pools if k[0] == os.getpid()]:
+            _pools.pop(key).pool.closeall()
+
+atexit.register(close_all)
+
+# --- lectures ------------------------------------------------------------------------------------------
+
+def iter_chunks(conn, sql, params=None, chunk_size=STREAM_CHUNK_SIZE, name="stream"):
+    # curseur nommé (côté serveur) sur une connexion fournie: listes de chunk_size lignes au plus
+    cur = conn.cursor(name=name)
+    cur.itersize = chunk_size
+    cur.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+def stream(sql, params=None, chunk_size=STREAM_CHUNK_SIZE, readonly=True, name="stream"):
+    """iter_chunks sur une connexion du pool, rendue quand la lecture est terminée (ou abandonnée)"""
+    with connection(readonly) as conn:
+        yield from iter_chunks(conn, sql, params, chunk_size, name)
+
+def read_frame(sql, params=None, readonly=True, chunk_size=50000):
+    with connection(readonly) as conn:
+        cur = conn.cursor(name="read_frame")
+        cur.itersize = chunk_size
+        cur.execute(sql, params)
+        rows = []
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            rows.extend(chunk)
+        columns = [d[0] for d in cur.description]
+        cur.close()
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+# --- écritures -----------------------------------------------------------------------------------------
+
+def write_values(conn, sql, rows, template=None, chunk_size=STREAM_CHUNK_SIZE, commit=True):
+    """sql avec un seul VALUES %s (INSERT, UPDATE ... FROM (VALUES %s)): une instruction par paquet de
+    chunk_size lignes, commitée si commit. rows peut être un itérable quelconque. Renvoie le nombre de lignes."""
+    cur = conn.cursor()
+    total, chunk = 0, []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                total += _write_chunk(conn, cur, sql, chunk, template, commit)
+                chunk = []
+        if chunk:
+            total += _write_chunk(conn, cur, sql, chunk, template, commit)
+    finally:
+        cur.close()
+    return total
+
+def _write_chunk(conn, cur, sql, chunk, template, commit):
+    psycopg2.extras.execute_values(cur, sql, chunk, template=template, page_size=len(chunk))
+    if commit:
+        conn.commit()
+    return len(chunk)
+
+def _csv_field(v):
+    # champ CSV pour COPY: NULL = champ vide non quoté, toute autre valeur est quotée
+    # (une chaîne vide reste donc une chaîne vide et non un NULL)
+    if v is None or v is pd.NaT or (isinstance(v, float) and math.isnan(v)):
+        return ""
+    if isinstance(v, dict):
+        v = json.dumps(v, ensure_ascii=False)
+    return '"' + str(v).replace('"', '""') + '"'
+
+def copy_rows(cur, table, columns, rows, batch_size=LOAD_BATCH_SIZE):
+    # COPY ... FROM STDIN par paquets de batch_size lignes (mémoire bornée)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    buf, n, total = io.StringIO(), 0, 0
+    for row in rows:
+        buf.write(",".join(_csv_field(v) for v in row) + "\n")
+        n += 1
+        if n >= batch_size:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            total += n
+            buf, n = io.StringIO(), 0
+    if n:
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        total += n
+    return total
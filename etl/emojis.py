@@ -0,0 +1,57 @@
+# etl/emojis.py
+# Reconstruction de flat_texts.emoji_summary et de text_emojis avec le détecteur d'émojis actuel
+# (etl/transform.py), pour les lignes chargées avant la table text_emojis ou avec l'ancienne détection
+# (ord(ch) > 10000: ❤️ comptait pour deux entrées, les idéogrammes CJK pour des émojis).
+#   python -m etl.emojis
+# Lecture en streaming et commit par morceau: un run interrompu peut simplement être relancé.
+import time
+import pandas as pd
+from etl import aggregates, db
+from etl.db import copy_rows
+from etl.load import MERGE_EMOJIS_SQL
+from etl.transform import emoji_summary_series
+
+CHUNK_SIZE = 50000
+
+ROWS_SQL = "SELECT id::text, text, emoji_summary != '{}' FROM flat_texts"
+
+STAGE_SQL = "CREATE TEMP TABLE IF NOT EXISTS stage_merged_flat (id UUID, emoji_summary JSONB) ON COMMIT DROP"
+
+# emoji_summary n'est réécrit que s'il change (pas de mise à jour inutile de updated_at)
+UPDATE_SUMMARY_SQL = """
+    UPDATE flat_texts f SET emoji_summary = m.emoji_summary
+    FROM stage_merged_flat m
+    WHERE f.id = m.id AND f.emoji_summary IS DISTINCT FROM m.emoji_summary
+"""
+
+def backfill(chunk_size=CHUNK_SIZE):
+    # lecture sur la réplique si configurée: les lignes qu'elle n'a pas encore reçues sont récentes,
+    # donc déjà chargées avec le détecteur actuel
+    done = staged = changed = 0
+    start = time.time()
+    with db.connection(readonly=True) as read_conn, db.connection() as write_conn:
+        cur = write_conn.cursor()
+        for rows in db.iter_chunks(read_conn, ROWS_SQL, chunk_size=chunk_size, name="emoji_backfill"):
+            df = pd.DataFrame(rows, columns=["id", "text", "had_emojis"])
+            df["emoji_summary"] = emoji_summary_series(df["text"].fillna(""))
+            # lignes sans émoji avant comme après: rien à écrire
+            df = df[df["had_emojis"] | df["emoji_summary"].astype(bool)]
+            cur.execute(STAGE_SQL)
+            staged += copy_rows(cur, "stage_merged_flat", ["id", "emoji_summary"],
+                                df[["id", "emoji_summary"]].itertuples(index=False, name=None))
+            cur.execute(UPDATE_SUMMARY_SQL)
+            changed += cur.rowcount
+            cur.execute(MERGE_EMOJIS_SQL)
+            write_conn.commit()
+            done += len(rows)
+            print(f"[emojis] {done} textes relus ({done / max(time.time() - start, 1e-9):.0f} textes/s)")
+        cur.close()
+
+        # text_emojis a pu changer sans que updated_at bouge: agrégats d'émojis reconstruits
+        aggregates.refresh(write_conn, full=True)
+    print(f"[emojis] {staged} textes avec émojis indexés, emoji_summary corrigé sur {changed} lignes "
+          f"en {time.time() - start:.1f}s")
+    return staged, changed
+
+if __name__ == "__main__":
+    backfill()
@@ -1,71 +1,291 @@
 # etl/extract.py
-import os, json, time, requests
-from config.settings import INSTAGRAM_ACCESS_TOKEN, INSTAGRAM_BUSINESS_ID
+import os, json, time, random, threading, requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from etl import state, raw_store, instrumentation
+from config.settings import (
+    INSTAGRAM_ACCESS_TOKEN, INSTAGRAM_BUSINESS_ID,
+    GRAPH_API_BASE, EXTRACT_WORKERS, EXTRACT_MAX_RETRIES, RAW_FORMAT,
+)
 
 RAW_DIR = "data/raw"
-API_BASE = "https://graph.facebook.com/v19.0"
+API_BASE = GRAPH_API_BASE
+
+# statuts HTTP et codes d'erreur Graph API considérés comme transitoires
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_CODES = {4, 17, 32, 613, 80001, 80002}
+USAGE_HEADERS = ("X-App-Usage", "X-Business-Use-Case-Usage")
+
+class GraphClient:
+    """Session HTTP partagée entre threads, avec retries et throttling sur les headers d'usage"""
+
+    def __init__(self, pool_size=EXTRACT_WORKERS, max_retries=EXTRACT_MAX_RETRIES, timeout=30):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pause_until = 0.0
+        self.usage = 0.0
+        self.requests = 0
+        self.retries = 0
+
+    def _usage_from_headers(self, headers):
+        # pourcentage d'usage max (0-100) et temps d'attente annoncé (secondes)
+        usage, regain = 0.0, 0
+        for h in USAGE_HEADERS:
+            raw = headers.get(h)
+            if not raw:
+                continue
+            try:
+                j = json.loads(raw)
+            except ValueError:
+                continue
+            entries = [j] if h == "X-App-Usage" else [e for v in j.values() for e in v]
+            for e in entries:
+                for k in ("call_count", "total_cputime", "total_time"):
+                    usage = max(usage, float(e.get(k) or 0))
+                regain = max(regain, int(e.get("estimated_time_to_regain_access") or 0) * 60)
+        return usage, regain
+
+    def _throttle(self, headers):
+        usage, regain = self._usage_from_headers(headers)
+        # backoff adaptatif: rien sous 50%, puis délai croissant jusqu'à la saturation
+        if regain:
+            delay = regain
+        elif usage >= 95:
+            delay = 60.0
+        elif usage >= 50:
+            delay = ((usage - 50) / 45) ** 2 * 5
+        else:
+            delay = 0.0
+        with self.lock:
+            self.usage = usage
+            if delay:
+                self.pause_until = max(self.pause_until, time.time() + delay)
+
+    def _wait(self):
+        with self.lock:
+            wait = self.pause_until - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _backoff(self, attempt, rate_limited=False):
+        # seul un rate limit met tous les workers en pause; une erreur transitoire (5xx, réseau)
+        # ne fait attendre que le worker concerné
+        delay = min(60, 2 ** attempt) * (0.5 + random.random() / 2)
+        with self.lock:
+            self.retries += 1
+            if rate_limited:
+                self.pause_until = max(self.pause_until, time.time() + delay)
+        if not rate_limited:
+            time.sleep(delay)
+
+    def get(self, url, params=None):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self._wait()
+            with self.lock:
+                self.requests += 1
+            start = time.perf_counter()
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                instrumentation.record_http(time.perf_counter() - start)
+                last_error = e
+                self._backoff(attempt)
+                continue
+            instrumentation.record_http(time.perf_counter() - start, r.status_code)
+            self._throttle(r.headers)
+            rate_limited = r.status_code == 429 or self._is_rate_limited(r)
+            if rate_limited or r.status_code in RETRY_STATUS:
+                last_error = requests.HTTPError(f"{r.status_code} sur {url}", response=r)
+                self._backoff(attempt, rate_limited)
+                continue
+            r.raise_for_status()
+            return r.json()
+        raise RuntimeError(f"Échec après {self.max_retries} retries: {last_error}")
+
+    @staticmethod
+    def _is_rate_limited(r):
+        if r.status_code != 400 and r.status_code != 403:
+            return False
+        try:
+            code = r.json().get("error", {}).get("code")
+        except ValueError:
+            return False
+        return code in RATE_LIMIT_CODES
+
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = GraphClient()
+    return _client
 
 def save_json(obj, path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
 
-def get_media_list(limit=25):
+def get_media_list(limit=25, client=None):
     if not INSTAGRAM_ACCESS_TOKEN or not INSTAGRAM_BUSINESS_ID:
         raise RuntimeError("IG_ACCESS_TOKEN ou IG_BUSINESS_ID manquant dans config/settings.py")
+    client = client or get_client()
     url = f"{API_BASE}/{INSTAGRAM_BUSINESS_ID}/media"
     params = {
         "fields": "id,caption,media_type,media_url,permalink,timestamp,like_count,comments_count",
         "access_token": INSTAGRAM_ACCESS_TOKEN,
-        "limit": limit
+        "limit": min(limit, 100)
     }
-    r = requests.get(url, params=params)
-    r.raise_for_status()
-    return r.json()
+    # l'API pagine au-delà de 100 media: on suit paging.next jusqu'à la limite demandée
+    data = []
+    while url and len(data) < limit:
+        j = client.get(url, params=params)
+        data.extend(j.get("data", []))
+        url = j.get("paging", {}).get("next")
+        params = None
+    return {"data": data[:limit]}
 
-def get_comments_for_media(media_id, limit=50):
-    results = []
+def iter_comment_pages(media_id, limit=50, client=None):
+    client = client or get_client()
     url = f"{API_BASE}/{media_id}/comments"
     params = {
         "fields": "id,text,username,timestamp,like_count",
         "access_token": INSTAGRAM_ACCESS_TOKEN,
         "limit": limit
     }
-    while True:
-        r = requests.get(url, params=params)
-        r.raise_for_status()
-        j = r.json()
-        results.extend(j.get("data", []))
-        paging = j.get("paging", {})
-        next_url = paging.get("next")
-        if not next_url:
-            break
-        url = next_url
-        params = {}
-        time.sleep(0.2)
-    return results
-
-def extract_all(limit_posts=20, save_path="data/raw/instagram_raw_posts.json"):
-    # récupère les posts et commentaires et sauvegarde en JSON
+    while url:
+        j = client.get(url, params=params)
+        yield j
+        url = j.get("paging", {}).get("next")
+        params = None
+
+def read_comments(media_id, limit=50, client=None, since=None):
+    # since: timestamp du dernier commentaire connu; l'API renvoie les plus récents d'abord,
+    # on s'arrête donc à la première page qui contient un commentaire déjà vu.
+    # Renvoie aussi le curseur de tête (position du commentaire le plus récent).
+    results, cursor = [], None
+    for j in iter_comment_pages(media_id, limit=limit, client=client):
+        data = j.get("data", [])
+        if cursor is None:
+            cursor = j.get("paging", {}).get("cursors", {}).get("before")
+        if since:
+            fresh = [c for c in data if (c.get("timestamp") or "") > since]
+            results.extend(fresh)
+            if len(fresh) < len(data):
+                break
+        else:
+            results.extend(data)
+    return results, cursor
+
+def get_comments_for_media(media_id, limit=50, client=None, since=None):
+    return read_comments(media_id, limit=limit, client=client, since=since)[0]
+
+def fetch_comments(media, client, since=None):
+    # ne renvoie plus silencieusement une liste vide: l'échec est marqué sur le media
     try:
-        media = get_media_list(limit=limit_posts)
+        media["fetched_comments"], media["comments_cursor"] = read_comments(media.get("id"), client=client, since=since)
     except Exception as e:
-        raise
+        media["fetched_comments"] = []
+        media["fetch_error"] = str(e)
+        print(f"[extract] commentaires de {media.get('id')} non récupérés: {e}")
+    return media
 
-    posts = []
-    for m in media.get("data", []):
-        mid = m.get("id")
-        comments = []
-        try:
-            comments = get_comments_for_media(mid)
-        except Exception:
-            comments = []
-        m["fetched_comments"] = comments
+def merge_raw(existing, delta):
+    # fusionne les media extraits dans le fichier brut existant (par id, commentaires dédoublonnés)
+    by_id = {p.get("id"): p for p in existing}
+    for m in delta:
+        old = by_id.get(m.get("id"))
+        if old is None:
+            by_id[m.get("id")] = m
+            continue
+        raw_store.merge_media(old, m)
+    return sorted(by_id.values(), key=lambda p: p.get("timestamp") or "", reverse=True)
+
+def plan_media(media, watermarks):
+    # (posts, jobs, skipped): media à reprendre et, parmi eux, ceux dont il faut relire les commentaires
+    # (jobs = [(media, since)]); un media dont seuls les likes ont changé n'est pas relu
+    posts, jobs, skipped = [], [], 0
+    for m in media:
+        wm = watermarks.get(m.get("id"))
+        status = state.media_status(m, wm)
+        if status == "unchanged":
+            skipped += 1
+            continue
         posts.append(m)
+        if status == "counts":
+            m["fetched_comments"] = []
+        else:
+            jobs.append((m, (wm or {}).get("last_comment_ts")))
+    return posts, jobs, skipped
+
+def extract_all(limit_posts=20, save_path=None, workers=EXTRACT_WORKERS,
+                incremental=False, state_path=state.WATERMARKS_FILE, raw_format=RAW_FORMAT):
+    # récupère les posts puis les commentaires de chaque media en parallèle (pool de threads borné).
+    # En mode incrémental, seuls les media nouveaux ou modifiés (likes / nb de commentaires) sont
+    # repris, et seulement leurs commentaires postérieurs au watermark.
+    # Limite connue: une réponse ou un like sur un ancien commentaire n'est vu qu'au prochain run complet.
+    # En format ndjson, chaque media est écrit dès que ses commentaires sont récupérés (append-only).
+    with instrumentation.stage("extract") as st:
+        client = GraphClient(pool_size=max(workers, 1))
+        start = time.time()
+        media = get_media_list(limit=limit_posts, client=client)
+
+        watermarks = state.load_watermarks(state_path) if incremental else {}
+        posts, jobs, skipped = plan_media(media.get("data", []), watermarks)
+        st.rows_in = len(media.get("data", []))
+
+        writer = None
+        if raw_format == "ndjson":
+            writer = raw_store.RawWriter(path=save_path)
+            save_path = writer.path
+            for m in posts:
+                if "fetched_comments" in m:
+                    writer.write(m)
+        try:
+            if workers <= 1:
+                for m, since in jobs:
+                    fetch_comments(m, client, since)
+                    if writer:
+                        writer.write(m)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    for fut in as_completed([pool.submit(fetch_comments, m, client, since) for m, since in jobs]):
+                        if writer:
+                            writer.write(fut.result())
+        finally:
+            if writer:
+                writer.close()
+
+        if writer is None:
+            save_path = save_path or raw_store.LEGACY_RAW_FILE
+            if incremental and os.path.exists(save_path):
+                with open(save_path, "r", encoding="utf-8") as f:
+                    existing = json.load(f)
+                save_json(merge_raw(existing, posts), save_path)
+            else:
+                save_json(posts, save_path)
+        if incremental:
+            # un media en échec garde son ancien watermark et sera retenté au prochain run
+            for m in posts:
+                if not m.get("fetch_error"):
+                    state.update_watermark(watermarks, m, m["fetched_comments"], m.get("comments_cursor"))
+            state.save_watermarks(watermarks, state_path)
 
-    save_json(posts, save_path)
-    print(f"[extract] {len(posts)} posts saved to {save_path}")
+        elapsed = max(time.time() - start, 1e-9)
+        failed = sum(1 for p in posts if p.get("fetch_error"))
+        print(f"[extract] {len(posts)} posts saved to {save_path}" + (f" ({skipped} inchangés ignorés)" if incremental else ""))
+        print(f"[extract] {elapsed:.1f}s, {len(posts) / elapsed:.1f} posts/s, "
+              f"{client.requests / elapsed:.1f} req/s ({client.requests} requêtes, {client.retries} retries, {failed} échecs)")
+        st.rows_out = len(posts)
+        st.extra.update(comments=sum(len(p.get("fetched_comments") or []) for p in posts),
+                        skipped=skipped, retries=client.retries, failed=failed)
     return posts
 
 if __name__ == "__main__":
-    extract_all(limit_posts=10)
+    with instrumentation.run("extract"):
+        extract_all(limit_posts=10)
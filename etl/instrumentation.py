@@ -0,0 +1,372 @@
+# etl/instrumentation.py
+# Mesures par étape pour l'ETL et les scripts modèles: temps, lignes en entrée / sortie, requêtes HTTP
+# (nombre, erreurs, latences), allers-retours base de données, sous-chronos (ex. émojis dans transform)
+# et mémoire. Chaque run donne un enregistrement JSON dans logs/runs/ et une ligne de pipeline_runs.
+#
+#   with instrumentation.run("pipeline"):          # les points d'entrée (__main__) ouvrent leur run
+#       with instrumentation.stage("load") as st:
+#           ...
+#           st.rows_out = n
+#
+# Processus longs (etl/webhook.py): checkpoint(r) réécrit périodiquement l'enregistrement en cours.
+# Hors d'un run, une étape n'est enregistrée que si RUN_RECORDS_STANDALONE=1: un appel de bibliothèque
+# (ex. aggregates.refresh depuis un serveur) ne laisse pas un enregistrement par appel.
+# Allers-retours base: connexions ouvertes avec connection_factory=CountingConnection.
+# Les compteurs sont globaux au processus; une étape enregistre leur variation entre son début et sa fin
+# (exact quand les étapes se suivent; quand elles se chevauchent, orchestrateur, chacune voit aussi
+# l'activité des autres). Les workers d'un ProcessPoolExecutor ne sont pas comptés.
+# Profilage à la demande: PROFILE_STAGES="load,transform" (ou "all") et PROFILE_MODE="cprofile" (thread de
+# l'étape, fichier .prof) ou "sample" (échantillonnage de tous les threads, fonctions les plus vues).
+import os, sys, json, time, uuid, threading, traceback
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import psycopg2
+import psycopg2.extensions
+from config.settings import RUN_RECORDS_DIR, RUN_RECORDS_DB, RUN_RECORDS_STANDALONE, PROFILE_STAGES, PROFILE_MODE
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+INSERT_RUN_SQL = """
+    INSERT INTO pipeline_runs (run_id, name, status, started_at, finished_at, wall_time, stages, host)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SAMPLE_INTERVAL = 0.01
+SAMPLE_TOP = 25
+
+_lock = threading.Lock()
+_counters = Counter()       # http_requests, http_errors, http_time, db_roundtrips, timer.<nom>
+_http_latencies = []        # secondes, dans l'ordre des requêtes, tant qu'une étape est ouverte
+_open_stages = 0            # vidé quand la dernière étape ouverte se termine (processus longs)
+_run = None                 # run en cours (un seul par processus)
+
+# --- compteurs ---------------------------------------------------------------------------------------------
+
+def record_http(seconds, status=None):
+    with _lock:
+        _counters["http_requests"] += 1
+        _counters["http_time"] += seconds
+        if status is None or status >= 400:
+            _counters["http_errors"] += 1
+        if _open_stages:
+            _http_latencies.append(seconds)
+
+def count_db(n=1):
+    with _lock:
+        _counters["db_roundtrips"] += n
+
+@contextmanager
+def timed(name):
+    """Sous-chrono cumulé dans l'étape en cours (ex. timed("transform.emojis"))"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _counters["timer." + name] += time.perf_counter() - start
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Curseur qui compte les allers-retours serveur (execute, COPY, et chaque fetch d'un curseur nommé)"""
+
+    def execute(self, query, vars=None):
+        count_db()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        count_db(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        count_db()
+        return super().copy_expert(sql, file, size)
+
+    def fetchmany(self, size=None):
+        if self.name is not None:
+            count_db()
+        return super().fetchmany(size) if size is not None else super().fetchmany()
+
+    def fetchall(self):
+        if self.name is not None:
+            count_db()
+        return super().fetchall()
+
+    def __iter__(self):
+        # itération d'un curseur nommé: un aller-retour par paquet de itersize lignes
+        if self.name is None:
+            return super().__iter__()
+        return self._iter_named()
+
+    def _iter_named(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+class CountingConnection(psycopg2.extensions.connection):
+    """Connexion dont les curseurs comptent leurs allers-retours, commit et rollback compris
+    (psycopg2.connect(..., connection_factory=CountingConnection))"""
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        count_db()
+        return super().commit()
+
+    def rollback(self):
+        count_db()
+        return super().rollback()
+
+def _snapshot():
+    with _lock:
+        return Counter(_counters), len(_http_latencies)
+
+def _peak_rss_mb():
+    # plus haut niveau de mémoire résidente du processus depuis son démarrage
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+# --- profilage ---------------------------------------------------------------------------------------------
+
+def _profile_enabled(name):
+    wanted = {s.strip() for s in PROFILE_STAGES.split(",") if s.strip()}
+    return "all" in wanted or name in wanted
+
+class _Sampler(threading.Thread):
+    """Échantillonneur: pile de chaque thread toutes les SAMPLE_INTERVAL s. Par fonction, part des piles
+    où elle apparaît (inclusive) et où elle est en haut de pile (self)"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop = threading.Event()
+        self.inclusive = Counter()
+        self.self_counts = Counter()
+        self.stacks = 0
+
+    @staticmethod
+    def _key(code):
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stop.wait(SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self.stacks += 1
+                self.self_counts[self._key(frame.f_code)] += 1
+                seen = set()
+                while frame is not None:
+                    key = self._key(frame.f_code)
+                    if key not in seen:  # une fonction récursive compte une fois par pile
+                        seen.add(key)
+                        self.inclusive[key] += 1
+                    frame = frame.f_back
+
+    def result(self):
+        self.stop.set()
+        self.join()
+        total = max(self.stacks, 1)
+        return {
+            "stacks": self.stacks,
+            "self": [{"function": k, "share": round(n / total, 3)} for k, n in self.self_counts.most_common(SAMPLE_TOP)],
+            "inclusive": [{"function": k, "share": round(n / total, 3)} for k, n in self.inclusive.most_common(SAMPLE_TOP)],
+        }
+
+# --- runs et étapes ----------------------------------------------------------------------------------------
+
+class Stage:
+    def __init__(self, name, parent=None, rows_in=None):
+        self.name = name
+        self.parent = parent
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.extra = {}
+
+class Run:
+    def __init__(self, name):
+        self.name = name
+        self.run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stages = []
+        self.status = "ok"
+        self.path = None                # enregistrement JSON, une fois le run terminé
+        self.local = threading.local()  # pile des étapes ouvertes par thread (étape parente)
+
+    def record(self):
+        return {
+            "run_id": self.run_id, "name": self.name, "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "wall_time": round(time.perf_counter() - self.start, 3),
+            "host": os.uname().nodename if hasattr(os, "uname") else None,
+            "peak_rss_mb": _peak_rss_mb(),
+            "stages": self.stages,
+        }
+
+def current_run():
+    return _run
+
+def _write_json(record):
+    day = record["started_at"][:10]
+    path = os.path.join(RUN_RECORDS_DIR, day, f"{record['run_id']}-{record['name']}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # fichier temporaire puis rename: un point de contrôle interrompu ne laisse pas un JSON tronqué
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+def _save(record):
+    path = _write_json(record)
+    if RUN_RECORDS_DB:
+        # l'observabilité ne doit jamais faire échouer le run
+        from etl import db  # etl.db importe ce module
+        try:
+            with db.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(INSERT_RUN_SQL, (record["run_id"], record["name"], record["status"], record["started_at"],
+                                             record["finished_at"], record["wall_time"],
+                                             json.dumps(record["stages"], ensure_ascii=False), record["host"]))
+                conn.commit()
+        except psycopg2.Error as e:
+            print(f"[instrumentation] run {record['run_id']} non enregistré en base: {e}".strip())
+    return path
+
+@contextmanager
+def run(name):
+    """Run englobant: ses étapes (tous threads confondus) forment un seul enregistrement.
+    Sans effet dans un run déjà ouvert."""
+    global _run
+    with _lock:
+        outer = _run is not None
+        if not outer:
+            _run = Run(name)
+        current = _run
+    if outer:
+        yield current
+        return
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        with _lock:
+            _run = None
+        _finish(current)
+
+def _finish(r):
+    r.path = _save(r.record())
+    print(f"[instrumentation] run {r.name} ({r.status}): {r.path}")
+
+def checkpoint(r, **extra):
+    """Enregistrement JSON provisoire d'un run long (status "running", étapes terminées + extra), au chemin
+    que _finish écrasera: un processus tué garde une trace. Pas de ligne pipeline_runs."""
+    with _lock:
+        record = r.record()
+        record["stages"] = list(record["stages"])
+    record["status"] = "running"
+    record.update(extra)
+    r.path = _write_json(record)
+    return r.path
+
+def _start_profile(name):
+    if not _profile_enabled(name):
+        return None, None
+    if PROFILE_MODE == "sample":
+        sampler = _Sampler()
+        sampler.start()
+        return None, sampler
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:  # Python 3.12+: un seul cProfile actif à la fois (étapes simultanées)
+        print(f"[instrumentation] {name} non profilée: {e}")
+        return None, None
+    return profiler, None
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Étape mesurée; renseigner st.rows_out (et st.rows_in) dans le bloc, st.extra pour le reste.
+    Hors d'un run englobant, l'étape forme un run propre à l'appel, enregistré si RUN_RECORDS_STANDALONE."""
+    global _open_stages
+    with _lock:
+        r = _run
+        _open_stages += 1
+    own = r is None
+    if own:
+        r = Run(name)
+    stack = getattr(r.local, "stack", None)
+    if stack is None:
+        stack = r.local.stack = []
+    st = Stage(name, stack[-1].name if stack else None, rows_in)
+    stack.append(st)
+    profiler, sampler = _start_profile(name)
+    counters, n_http = _snapshot()
+    started_at = datetime.now(timezone.utc).isoformat()
+    start = time.perf_counter()
+    rss_before = _peak_rss_mb()
+    status, error = "ok", None
+    try:
+        yield st
+    except BaseException as e:
+        status, error = "error", "".join(traceback.format_exception_only(type(e), e)).strip()
+        raise
+    finally:
+        wall = time.perf_counter() - start
+        stack.pop()
+        after, _ = _snapshot()
+        with _lock:
+            latencies = _http_latencies[n_http:]
+            _open_stages -= 1
+            if not _open_stages:
+                _http_latencies.clear()
+        delta = after - counters
+        rec = {
+            "name": name, "parent": st.parent, "status": status, "started_at": started_at,
+            "wall_time": round(wall, 3), "rows_in": st.rows_in, "rows_out": st.rows_out,
+            "rows_per_s": round(st.rows_out / wall, 1) if st.rows_out and wall > 0 else None,
+            "http_requests": delta["http_requests"], "http_errors": delta["http_errors"],
+            "http_time": round(delta["http_time"], 3),
+            "http_p50_ms": round(_percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+            "http_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            "db_roundtrips": delta["db_roundtrips"],
+            "timers": {k[6:]: round(v, 3) for k, v in delta.items() if k.startswith("timer.")},
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        # le pic mémoire du processus a monté pendant cette étape
+        if rec["peak_rss_mb"] is not None and rss_before is not None:
+            rec["peak_rss_growth_mb"] = round(rec["peak_rss_mb"] - rss_before, 1)
+        if error:
+            rec["error"] = error
+        if profiler is not None:
+            profiler.disable()
+            rec["profile"] = os.path.join(RUN_RECORDS_DIR, started_at[:10], f"{r.run_id}-{name}.prof")
+            os.makedirs(os.path.dirname(rec["profile"]), exist_ok=True)
+            profiler.dump_stats(rec["profile"])
+        if sampler is not None:
+            rec["profile_samples"] = sampler.result()
+        rec.update(st.extra)
+        with _lock:
+            r.stages.append(rec)
+            if status == "error":
+                r.status = "error"
+        if own and RUN_RECORDS_STANDALONE:
+            _finish(r)
@@ -1,36 +1,243 @@
 # etl/load.py
-import os, json
+import os, json, time
+from datetime import timedelta
 import pandas as pd
 import psycopg2
-import psycopg2.extras
-from config.settings import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from config.settings import LOAD_BATCH_SIZE, PROCESSED_FORMAT, WEBHOOK_TIME_WINDOW_MINUTES
+from etl import db, instrumentation
+from etl.db import copy_rows
 
 SCHEMA_SQL = "sql/schema.sql"
 PROC_DIR = "data/processed"
 
+POST_COLUMNS = ["post_id", "caption", "media_type", "media_url", "permalink", "created_time", "like_count", "comments_count"]
+COMMENT_COLUMNS = ["comment_id", "post_id", "parent_comment_id", "username", "text", "like_count", "created_time"]
+FLAT_COLUMNS = ["source_type", "source_id", "post_id", "parent_comment_id", "username", "text", "like_count", "emoji_summary", "created_time"]
+ID_DTYPES = {"post_id": str, "comment_id": str, "parent_comment_id": str}
+
+# Tables de staging temporaires (une colonne seq pour garder la dernière version d'une même clé)
+STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS stage_posts (
+        seq BIGSERIAL, post_id TEXT, caption TEXT, media_type TEXT, media_url TEXT, permalink TEXT,
+        created_time TIMESTAMPTZ, like_count INT, comments_count INT
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE IF NOT EXISTS stage_comments (
+        seq BIGSERIAL, comment_id TEXT, post_id TEXT, parent_comment_id TEXT, username TEXT, text TEXT,
+        like_count INT, created_time TIMESTAMPTZ
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE IF NOT EXISTS stage_flat_texts (
+        seq BIGSERIAL, source_type TEXT, source_id TEXT, post_id TEXT, parent_comment_id TEXT, username TEXT,
+        text TEXT, like_count INT, emoji_summary JSONB, created_time TIMESTAMPTZ
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE IF NOT EXISTS stage_merged_flat (id UUID, emoji_summary JSONB) ON COMMIT DROP;
+"""
+
+MERGE_POSTS_SQL = """
+    INSERT INTO posts (post_id, caption, media_type, media_url, permalink, created_time, like_count, comments_count)
+    SELECT DISTINCT ON (post_id) post_id, caption, media_type, media_url, permalink, created_time, like_count, comments_count
+    FROM stage_posts
+    ORDER BY post_id, seq DESC
+    ON CONFLICT (post_id) DO UPDATE SET
+      caption=EXCLUDED.caption,
+      media_type=EXCLUDED.media_type,
+      media_url=EXCLUDED.media_url,
+      permalink=EXCLUDED.permalink,
+      created_time=EXCLUDED.created_time,
+      like_count=EXCLUDED.like_count,
+      comments_count=EXCLUDED.comments_count;
+"""
+
+# la FK parent_comment_id -> comments est vérifiée en fin d'instruction: un seul INSERT
+# peut donc contenir à la fois un commentaire et ses réponses
+# username complète un commentaire parent créé vide par etl/webhook.py; la date de l'API remplace celle
+# de la notification (etl/webhook.py ne l'écrit que si le commentaire n'en a pas)
+MERGE_COMMENTS_SQL = """
+    INSERT INTO comments (comment_id, post_id, parent_comment_id, username, text, like_count, created_time)
+    SELECT DISTINCT ON (comment_id) comment_id, post_id, parent_comment_id, username, text, like_count, created_time
+    FROM stage_comments
+    ORDER BY comment_id, seq DESC
+    ON CONFLICT (comment_id) DO UPDATE SET
+      text=EXCLUDED.text,
+      like_count=EXCLUDED.like_count,
+      username=COALESCE(comments.username, EXCLUDED.username),
+      created_time=COALESCE(EXCLUDED.created_time, comments.created_time);
+"""
+
+# Upsert sur la clé naturelle (source_type, source_id): une ligne n'est réécrite que si son texte, son nombre
+# de likes ou sa date a changé; un texte modifié repart sans label ni prédiction. La date de l'API remplace
+# l'heure de notification d'un texte reçu par webhook (une ligne sans date garde celle qu'elle a).
+# Contrainte nommée: la même instruction sert sur la table partitionnée par created_time (etl/partitions.py),
+# où la contrainte inclut created_time (fixe pour un texte Instagram donné)
+FLAT_UPSERT_SQL = """
+    ON CONFLICT ON CONSTRAINT uq_flat_texts_source DO UPDATE SET
+      text=EXCLUDED.text,
+      like_count=EXCLUDED.like_count,
+      emoji_summary=EXCLUDED.emoji_summary,
+      sentiment_label=CASE WHEN flat_texts.text IS DISTINCT FROM EXCLUDED.text THEN NULL ELSE flat_texts.sentiment_label END,
+      labeled_at=CASE WHEN flat_texts.text IS DISTINCT FROM EXCLUDED.text THEN NULL ELSE flat_texts.labeled_at END,
+      predicted_sentiment=CASE WHEN flat_texts.text IS DISTINCT FROM EXCLUDED.text THEN NULL ELSE flat_texts.predicted_sentiment END,
+      predicted_score=CASE WHEN flat_texts.text IS DISTINCT FROM EXCLUDED.text THEN NULL ELSE flat_texts.predicted_score END,
+      model_version=CASE WHEN flat_texts.text IS DISTINCT FROM EXCLUDED.text THEN NULL ELSE flat_texts.model_version END,
+      created_time=CASE WHEN EXCLUDED.created_time = '-infinity' THEN flat_texts.created_time ELSE EXCLUDED.created_time END
+    WHERE flat_texts.text IS DISTINCT FROM EXCLUDED.text
+       OR flat_texts.like_count IS DISTINCT FROM EXCLUDED.like_count
+       OR (EXCLUDED.created_time != '-infinity' AND flat_texts.created_time IS DISTINCT FROM EXCLUDED.created_time)
+"""
+
+# les lignes réellement insérées / réécrites sont gardées dans stage_merged_flat pour text_emojis.
+# Un texte sans date est rangé à '-infinity' (clé de partition non nulle, même jour que dans les agrégats)
+MERGE_FLAT_SQL = """
+    WITH merged AS (
+    INSERT INTO flat_texts (source_type, source_id, post_id, parent_comment_id, username, text, like_count, emoji_summary, created_time)
+    SELECT DISTINCT ON (source_type, source_id) source_type, source_id, post_id, parent_comment_id, username, text, like_count, emoji_summary,
+           COALESCE(created_time, '-infinity')
+    FROM stage_flat_texts
+    ORDER BY source_type, source_id, seq DESC
+""" + FLAT_UPSERT_SQL + """
+    RETURNING id, emoji_summary
+    )
+    INSERT INTO stage_merged_flat SELECT id, emoji_summary FROM merged;
+"""
+
+# Textes reçus d'abord par webhook (etl/webhook.py): leur created_time est l'heure de la notification, à
+# quelques secondes de l'horodatage de l'API. Sur la table partitionnée, la clé naturelle inclut created_time
+# et ON CONFLICT ne peut pas changer la partition d'une ligne: avant l'upsert du batch, la ligne existante
+# est supprimée puis réinsérée (même id, labels et prédictions) à la date de l'API. updated_at = now(): les
+# agrégats recalculent le nouveau jour, l'ancien est couvert par la fenêtre de DIRTY_SQL (etl/aggregates.py).
+# text_emojis n'a pas de clé étrangère vers la table partitionnée: les émojis suivent l'id.
+# Sonde par (source_type, source_id, created_time) dans une fenêtre: élagage des partitions à l'exécution
+RETIME_FLAT_SQL = """
+    WITH api AS (
+    SELECT DISTINCT ON (source_type, source_id) source_type, source_id, created_time
+    FROM stage_flat_texts
+    WHERE source_type != 'post' AND created_time IS NOT NULL
+    ORDER BY source_type, source_id, seq DESC
+    ), moved AS (
+    DELETE FROM flat_texts f USING api s
+    WHERE f.source_type = s.source_type AND f.source_id = s.source_id
+      AND f.created_time BETWEEN s.created_time - %(window)s AND s.created_time + %(window)s
+      AND f.created_time != s.created_time
+    RETURNING f.*, s.created_time AS api_time
+    )
+    INSERT INTO flat_texts (id, source_type, source_id, post_id, parent_comment_id, username, text, like_count,
+                            emoji_summary, created_time, sentiment_label, predicted_sentiment, predicted_score,
+                            model_version, labeled_at, created_at, updated_at)
+    SELECT id, source_type, source_id, post_id, parent_comment_id, username, text, like_count,
+           emoji_summary, api_time, sentiment_label, predicted_sentiment, predicted_score,
+           model_version, labeled_at, created_at, now()
+    FROM moved
+"""
+
+# Dans l'autre sens, un texte reçu par webhook après le batch reprend la date de la ligne existante (celle
+# de l'API) pour tomber sur la même clé
+ALIGN_CREATED_TIME_SQL = """
+    UPDATE stage_flat_texts s SET created_time = f.created_time
+    FROM flat_texts f
+    WHERE f.source_type = s.source_type AND f.source_id = s.source_id AND s.source_type != 'post'
+      AND f.created_time BETWEEN s.created_time - %(window)s AND s.created_time + %(window)s
+      AND f.created_time != s.created_time
+"""
+
+# text_emojis des lignes fusionnées: remplacées en bloc (un texte modifié peut perdre des émojis)
+MERGE_EMOJIS_SQL = """
+    DELETE FROM text_emojis t USING stage_merged_flat m WHERE t.flat_text_id = m.id;
+    INSERT INTO text_emojis (flat_text_id, emoji, count)
+    SELECT m.id, e.key, e.value::int
+    FROM stage_merged_flat m CROSS JOIN LATERAL jsonb_each_text(m.emoji_summary) e;
+"""
+
+# même chose pour une seule ligne (chemin load_rows)
+ROW_EMOJIS_SQL = """
+    DELETE FROM text_emojis WHERE flat_text_id = %(id)s;
+    INSERT INTO text_emojis (flat_text_id, emoji, count)
+    SELECT %(id)s::uuid, key, value::int FROM jsonb_each_text(%(emojis)s::jsonb);
+"""
+
 def connect():
-    return psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+    # connexion dédiée hors pool (bench, sessions modifiées); le reste du code passe par db.connection()
+    return db.connect()
 
 def ensure_schema(conn):
     with open(SCHEMA_SQL, "r", encoding="utf-8") as f:
         sql = f.read()
     cur = conn.cursor()
-    cur.execute(sql)
+    try:
+        cur.execute(sql)
+    except psycopg2.errors.UniqueViolation:
+        conn.rollback()
+        raise RuntimeError("flat_texts contient des doublons (source_type, source_id): exécute d'abord python -m etl.compact")
     conn.commit()
     cur.close()
     print("[load] Schema ensured")
 
-def load():
-    conn = connect()
-    ensure_schema(conn)
-    cur = conn.cursor()
+def df_rows(df, columns):
+    # tuples dans l'ordre de columns pour copy_rows (compteurs manquants à 0), partagé avec etl/webhook.py
+    df = df.reindex(columns=columns)
+    if "like_count" in df:
+        df["like_count"] = df["like_count"].fillna(0).astype(int)
+    if "comments_count" in df:
+        df["comments_count"] = df["comments_count"].fillna(0).astype(int)
+    return df.itertuples(index=False, name=None)
+
+def _flat_rows(flat_rows):
+    for r in flat_rows:
+        yield (
+            r.get("source_type"),
+            r.get("source_id"),
+            r.get("post_id"),
+            r.get("parent_comment_id"),
+            r.get("username"),
+            r.get("text"),
+            int(r.get("like_count") or 0),
+            r.get("emoji_summary") or {},
+            r.get("created_time"),
+        )
 
-    posts_csv = os.path.join(PROC_DIR, "posts.csv")
-    comments_csv = os.path.join(PROC_DIR, "comments.csv")
-    flat_json = os.path.join(PROC_DIR, "flat_texts.json")
+def read_processed(proc_dir=PROC_DIR, fmt=PROCESSED_FORMAT):
+    if fmt != "csv":
+        # datasets typés: pas de parsing, les ids sont déjà du texte et les dates des timestamps
+        from etl import columnar
+        return tuple(columnar.read_table(name, proc_dir) if columnar.exists(name, proc_dir) else None
+                     for name in ("posts", "comments", "flat_texts"))
+    # les identifiants Instagram sont lus en texte (sinon int64/float et perte de précision)
+    posts_csv = os.path.join(proc_dir, "posts.csv")
+    comments_csv = os.path.join(proc_dir, "comments.csv")
+    flat_json = os.path.join(proc_dir, "flat_texts.json")
+    posts_df = pd.read_csv(posts_csv, dtype=ID_DTYPES) if os.path.exists(posts_csv) else None
+    comments_df = pd.read_csv(comments_csv, dtype=ID_DTYPES) if os.path.exists(comments_csv) else None
+    flat_rows = None
+    if os.path.exists(flat_json):
+        with open(flat_json, "r", encoding="utf-8") as f:
+            flat_rows = json.load(f)
+    return posts_df, comments_df, flat_rows
+
+def bulk_load(conn, posts_df=None, comments_df=None, flat_rows=None, batch_size=LOAD_BATCH_SIZE):
+    # COPY dans des tables de staging puis un seul upsert ensembliste par table, dans une transaction
+    cur = conn.cursor()
+    cur.execute(STAGING_SQL)
+    counts = {"posts": 0, "comments": 0, "flat_texts": 0}
+    if posts_df is not None:
+        counts["posts"] = copy_rows(cur, "stage_posts", POST_COLUMNS, df_rows(posts_df, POST_COLUMNS), batch_size)
+    if comments_df is not None:
+        counts["comments"] = copy_rows(cur, "stage_comments", COMMENT_COLUMNS, df_rows(comments_df, COMMENT_COLUMNS), batch_size)
+    if flat_rows is not None:
+        rows = df_rows(flat_rows, FLAT_COLUMNS) if isinstance(flat_rows, pd.DataFrame) else _flat_rows(flat_rows)
+        counts["flat_texts"] = copy_rows(cur, "stage_flat_texts", FLAT_COLUMNS, rows, batch_size)
+        from etl import partitions  # etl.partitions importe ce module
+        if partitions.is_partitioned(conn):
+            cur.execute(RETIME_FLAT_SQL, {"window": timedelta(minutes=WEBHOOK_TIME_WINDOW_MINUTES)})
+    cur.execute(MERGE_POSTS_SQL)
+    cur.execute(MERGE_COMMENTS_SQL)
+    cur.execute(MERGE_FLAT_SQL)
+    cur.execute(MERGE_EMOJIS_SQL)
+    conn.commit()
+    cur.close()
+    return counts
 
-    if os.path.exists(posts_csv):
-        posts_df = pd.read_csv(posts_csv)
+def load_rows(conn, posts_df=None, comments_df=None, flat_rows=None):
+    # ancien chemin: un INSERT ... ON CONFLICT par ligne (gardé pour comparaison / benchmark)
+    cur = conn.cursor()
+    if posts_df is not None:
         for _, r in posts_df.iterrows():
             cur.execute("""
                 INSERT INTO posts (post_id, caption, media_type, media_url, permalink, created_time, like_count, comments_count)
@@ -44,8 +251,7 @@ def load():
                   like_count=EXCLUDED.like_count,
                   comments_count=EXCLUDED.comments_count;
             """, (r.post_id, r.caption, r.media_type, r.media_url, r.permalink, r.created_time, int(r.like_count or 0), int(r.comments_count or 0)))
-    if os.path.exists(comments_csv):
-        comments_df = pd.read_csv(comments_csv)
+    if comments_df is not None:
         for _, r in comments_df.iterrows():
             cur.execute("""
                 INSERT INTO comments (comment_id, post_id, parent_comment_id, username, text, like_count, created_time)
@@ -54,15 +260,15 @@ def load():
                   text=EXCLUDED.text,
                   like_count=EXCLUDED.like_count;
             """, (r.comment_id, r.post_id, r.parent_comment_id if 'parent_comment_id' in r and not pd.isna(r.parent_comment_id) else None, r.username, r.text, int(r.like_count or 0), r.created_time))
-    if os.path.exists(flat_json):
-        with open(flat_json, "r", encoding="utf-8") as f:
-            flat_rows = json.load(f)
+    if flat_rows is not None:
+        if isinstance(flat_rows, pd.DataFrame):
+            flat_rows = flat_rows.astype(object).where(flat_rows.notna(), None).to_dict("records")
         for r in flat_rows:
+            emojis = r["emoji_summary"] if isinstance(r.get("emoji_summary"), str) else json.dumps(r.get("emoji_summary") or {})
             cur.execute("""
                 INSERT INTO flat_texts (source_type, source_id, post_id, parent_comment_id, username, text, like_count, emoji_summary, created_time)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                ON CONFLICT DO NOTHING
-            """, (
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,COALESCE(%s::timestamptz, '-infinity'))
+            """ + FLAT_UPSERT_SQL + " RETURNING id", (
                 r.get("source_type"),
                 r.get("source_id"),
                 r.get("post_id"),
@@ -70,10 +276,28 @@ def load():
                 r.get("username"),
                 r.get("text"),
                 int(r.get("like_count") or 0),
-                json.dumps(r.get("emoji_summary") or {}),
+                emojis,
                 r.get("created_time")
             ))
+            merged = cur.fetchone()
+            if merged:
+                cur.execute(ROW_EMOJIS_SQL, {"id": merged[0], "emojis": emojis})
     conn.commit()
     cur.close()
-    conn.close()
-    print("[load] Data loaded into PostgreSQL")
+
+def load(method="copy", batch_size=LOAD_BATCH_SIZE):
+    with instrumentation.stage("load") as st:
+        posts_df, comments_df, flat_rows = read_processed(PROC_DIR)
+        with db.connection() as conn:
+            ensure_schema(conn)
+            start = time.time()
+            if method == "copy":
+                counts = bulk_load(conn, posts_df, comments_df, flat_rows, batch_size)
+                n = sum(counts.values())
+            else:
+                load_rows(conn, posts_df, comments_df, flat_rows)
+                n = sum(len(x) for x in (posts_df, comments_df, flat_rows) if x is not None)
+        elapsed = max(time.time() - start, 1e-9)
+        print(f"[load] Data loaded into PostgreSQL ({n} rows, {n / elapsed:.0f} rows/s, method={method})")
+        st.rows_in = st.rows_out = n
+        st.extra["method"] = method
@@ -0,0 +1,334 @@
+# etl/orchestrator.py
+# Pipeline en flux: extract -> transform -> load -> apply_model par lots de media, toutes les étapes en même
+# temps (un thread par étape, reliées par des files bornées: une étape lente bloque l'amont au lieu de laisser
+# les lots s'accumuler en mémoire).
+#   python -m etl.orchestrator [--full] [--limit 20] [--batch 10]
+# Reprise: chaque lot extrait est écrit comme une part NDJSON de la couche brute et son avancement
+# (extrait / chargé / prédit) est noté dans data/state/orchestrator.json. Un run interrompu recharge les
+# lots extraits depuis leur part sans rappeler l'API, et n'extrait que les media qui restaient.
+# Métrique principale: latence de bout en bout, de la publication d'un texte (created_time) à son sentiment
+# visible dans les agrégats du dashboard (fin du rafraîchissement qui suit la prédiction de son lot).
+import os, sys, json, time, queue, threading, uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from config.settings import EXTRACT_WORKERS, ORCH_BATCH_MEDIA, ORCH_QUEUE_SIZE
+from etl import extract, transform, load, aggregates, partitions, raw_store, state, db, instrumentation
+
+CHECKPOINT_FILE = os.path.join(state.STATE_DIR, "orchestrator.json")
+STOP = None  # fin de flux, propagée d'étape en étape
+
+class Checkpoint:
+    """Plan du run (media à traiter) et étape atteinte par chaque lot, réécrit atomiquement à chaque changement"""
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def start(self, todo):
+        # todo: [{"media": m, "since": ts ou None, "fetch": bool}]
+        with self.lock:
+            self.data = {"run_id": uuid.uuid4().hex[:8], "started_at": datetime.now(timezone.utc).isoformat(),
+                         "todo": todo, "batches": []}
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def add_batch(self, part, media_ids):
+        with self.lock:
+            n = len(self.data["batches"])
+            self.data["batches"].append({"n": n, "part": part, "media": media_ids, "stage": "extracted"})
+            self._save()
+        return n
+
+    def mark(self, numbers, stage):
+        with self.lock:
+            for n in numbers:
+                self.data["batches"][n]["stage"] = stage
+            self._save()
+
+    def batches(self, stage):
+        return [b for b in self.data["batches"] if b["stage"] == stage]
+
+    def remaining(self):
+        # media du plan pas encore dans un lot extrait
+        done = {mid for b in self.data["batches"] for mid in b["media"]}
+        return [t for t in self.data["todo"] if t["media"].get("id") not in done]
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.data = None
+
+class Batch:
+    def __init__(self, n, media, extracted_at):
+        self.n = n
+        self.media = media
+        self.extracted_at = extracted_at
+        self.frames = None      # (posts_df, comments_df, flat_df) après transform
+        self.created = None     # created_time des textes du lot (latence de bout en bout)
+
+class Orchestrator:
+    def __init__(self, batch_media=ORCH_BATCH_MEDIA, queue_size=ORCH_QUEUE_SIZE, workers=EXTRACT_WORKERS,
+                 checkpoint_path=CHECKPOINT_FILE, state_path=state.WATERMARKS_FILE):
+        self.batch_media = batch_media
+        self.workers = max(workers, 1)
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.state_path = state_path
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in ("transform", "load", "score")}
+        self.abort = threading.Event()
+        self.errors = []
+        self.busy = {name: 0.0 for name in ("extract", "transform", "load", "score")}
+        self.counts = {name: 0 for name in self.busy}
+        self.rows = {"texts": 0, "predicted": 0}
+        self.pipeline_latency = []   # lot: lecture API -> visible dans le dashboard (s)
+        self.text_latency = []       # texte: publication -> visible dans le dashboard (s)
+
+    def _put(self, name, item):
+        # put bloquant (contre-pression) mais interrompu si une autre étape a échoué
+        while not self.abort.is_set():
+            try:
+                self.queues[name].put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, name):
+        while not self.abort.is_set():
+            try:
+                return self.queues[name].get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return STOP
+
+    def _run_stage(self, name, fn):
+        # étapes simultanées: compteurs HTTP / base de chaque étape mêlés à ceux des autres (cf. instrumentation)
+        try:
+            with instrumentation.stage(name) as st:
+                try:
+                    fn()
+                finally:
+                    st.rows_out = {"load": self.rows["texts"], "score": self.rows["predicted"]}.get(name)
+                    st.extra.update(batches=self.counts[name], busy_time=round(self.busy[name], 3))
+        except Exception as e:
+            self.errors.append((name, e))
+            self.abort.set()
+            print(f"[orchestrator] échec de l'étape {name}: {e!r}")
+
+    # --- extract ---------------------------------------------------------------------------------------
+
+    def plan(self, limit_posts, incremental):
+        if self.checkpoint.data is not None:
+            cp = self.checkpoint.data
+            print(f"[orchestrator] reprise du run {cp['run_id']}: {len(self.checkpoint.batches('extracted'))} lots "
+                  f"à charger, {len(self.checkpoint.batches('loaded'))} à prédire, "
+                  f"{len(self.checkpoint.remaining())} media à extraire")
+            return
+        client = extract.GraphClient(pool_size=self.workers)
+        media = extract.get_media_list(limit=limit_posts, client=client).get("data", [])
+        watermarks = state.load_watermarks(self.state_path) if incremental else {}
+        posts, jobs, skipped = extract.plan_media(media, watermarks)
+        since = {id(m): s for m, s in jobs}
+        todo = [{"media": {k: v for k, v in m.items() if k != "fetched_comments"},
+                 "since": since.get(id(m)), "fetch": id(m) in since} for m in posts]
+        self.checkpoint.start(todo)
+        print(f"[orchestrator] {len(todo)} media à traiter ({skipped} inchangés ignorés)")
+
+    def _emit(self, media):
+        # un lot = une part NDJSON complète de la couche brute, puis point de reprise
+        with raw_store.RawWriter() as w:
+            for m in media:
+                w.write(m)
+        n = self.checkpoint.add_batch(w.path, [m.get("id") for m in media])
+        self.counts["extract"] += 1
+        return self._put("transform", Batch(n, media, time.time()))
+
+    def extract_stage(self):
+        start = time.time()
+        # lots extraits lors d'un run précédent: relus depuis la couche brute
+        for b in self.checkpoint.batches("extracted"):
+            if not self._put("transform", Batch(b["n"], list(raw_store.iter_part(b["part"])), time.time())):
+                return
+        pending = deque(self.checkpoint.remaining())
+        client = extract.GraphClient(pool_size=self.workers)
+        current, inflight = [], set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while (pending or inflight) and not self.abort.is_set():
+                # fenêtre bornée de requêtes en vol: si l'aval est saturé, l'extraction s'arrête aussi
+                while pending and len(inflight) < 2 * self.workers:
+                    t = pending.popleft()
+                    m = dict(t["media"])
+                    if t["fetch"]:
+                        inflight.add(pool.submit(extract.fetch_comments, m, client, t["since"]))
+                    else:
+                        m["fetched_comments"] = []
+                        current.append(m)
+                if inflight:
+                    finished, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    current.extend(f.result() for f in finished)
+                while len(current) >= self.batch_media:
+                    self.busy["extract"] += time.time() - start
+                    ok = self._emit(current[:self.batch_media])
+                    start = time.time()
+                    current = current[self.batch_media:]
+                    if not ok:
+                        return
+            if current and not self.abort.is_set():
+                self.busy["extract"] += time.time() - start
+                self._emit(current)
+        self._put("transform", STOP)
+
+    # --- transform / load / score ------------------------------------------------------------------------
+
+    def transform_stage(self):
+        while True:
+            batch = self._get("transform")
+            if batch is STOP:
+                break
+            start = time.time()
+            batch.frames = transform.transform_frames(batch.media)
+            batch.created = batch.frames[2]["created_time"]
+            self.busy["transform"] += time.time() - start
+            self.counts["transform"] += 1
+            if not self._put("load", batch):
+                return
+        self._put("load", STOP)
+
+    def load_stage(self):
+        conn = db.getconn()
+        try:
+            load.ensure_schema(conn)
+            partitions.ensure_partitions(conn)
+            watermarks = state.load_watermarks(self.state_path)
+            # lots chargés mais pas encore prédits lors du run précédent
+            for b in self.checkpoint.batches("loaded"):
+                if not self._put("score", Batch(b["n"], [], None)):
+                    return
+            while True:
+                batch = self._get("load")
+                if batch is STOP:
+                    break
+                start = time.time()
+                posts_df, comments_df, flat_df = batch.frames
+                counts = load.bulk_load(conn, posts_df, comments_df, flat_df)
+                # un media en échec garde son ancien watermark et sera retenté au prochain run
+                for m in batch.media:
+                    if not m.get("fetch_error"):
+                        state.update_watermark(watermarks, m, m.get("fetched_comments", []), m.get("comments_cursor"))
+                state.save_watermarks(watermarks, self.state_path)
+                self.checkpoint.mark([batch.n], "loaded")
+                batch.frames = None
+                self.busy["load"] += time.time() - start
+                self.counts["load"] += 1
+                self.rows["texts"] += counts["flat_texts"]
+                if not self._put("score", batch):
+                    return
+            self._put("score", STOP)
+        finally:
+            db.putconn(conn)
+
+    def score_stage(self):
+        from scripts_models import apply_model, predict
+        try:
+            model, vect, version = predict.load_artifacts(apply_model.MODEL_DIR)
+        except FileNotFoundError as e:
+            print(f"[orchestrator] pas de prédiction ({e}): seuls les agrégats seront rafraîchis")
+            model = vect = version = None
+        # lectures sur le primaire: les textes que load_stage vient de commiter doivent être visibles
+        read_conn, write_conn = db.getconn(), db.getconn()
+        cache = apply_model.get_cache(write_conn, version) if model is not None else None
+        try:
+            finished = False
+            while not finished:
+                batch = self._get("score")
+                if batch is STOP:
+                    break
+                # lots arrivés pendant la prédiction précédente: une seule passe et un seul rafraîchissement
+                batches = [batch]
+                while True:
+                    try:
+                        nxt = self.queues["score"].get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is STOP:
+                        finished = True
+                        break
+                    batches.append(nxt)
+                start = time.time()
+                if model is not None:
+                    # la file des textes non prédits couvre ces lots (et ce qu'un run précédent a laissé)
+                    self.rows["predicted"] += apply_model.score_stream(model, vect, read_conn, write_conn,
+                                                                       cache=cache, version=version)
+                    read_conn.rollback()
+                aggregates.refresh(write_conn)
+                visible = time.time()
+                self.checkpoint.mark([b.n for b in batches], "scored")
+                self.busy["score"] += visible - start
+                self.counts["score"] += len(batches)
+                for b in batches:
+                    if b.extracted_at is not None:
+                        self.pipeline_latency.append(visible - b.extracted_at)
+                    if b.created is not None and len(b.created):
+                        created = pd.to_datetime(b.created, utc=True).dropna()
+                        epoch = (created - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy()
+                        self.text_latency.append(visible - epoch)
+        finally:
+            db.putconn(read_conn)
+            db.putconn(write_conn)
+
+    # --- run ---------------------------------------------------------------------------------------------
+
+    def run(self, limit_posts=20, incremental=True):
+        with instrumentation.run("orchestrator"):
+            start = time.time()
+            self.plan(limit_posts, incremental)
+            stages = [("extract", self.extract_stage), ("transform", self.transform_stage),
+                      ("load", self.load_stage), ("score", self.score_stage)]
+            threads = [threading.Thread(target=self._run_stage, args=s, name=f"orch-{s[0]}", daemon=True)
+                       for s in stages]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.time() - start
+            self.report(elapsed)
+            if self.errors:
+                name, e = self.errors[0]
+                raise RuntimeError(f"étape {name} en échec, relancer pour reprendre au dernier lot terminé") from e
+            self.checkpoint.clear()
+        return self.rows
+
+    def report(self, elapsed):
+        for name in self.busy:
+            print(f"[orchestrator] {name:9s}: {self.counts[name]} lots, {self.busy[name]:.1f}s actif "
+                  f"({self.busy[name] / max(elapsed, 1e-9):.0%} du run)")
+        print(f"[orchestrator] {self.rows['texts']} textes chargés, {self.rows['predicted']} prédits en {elapsed:.1f}s")
+        if self.pipeline_latency:
+            lat = np.array(self.pipeline_latency)
+            print(f"[orchestrator] latence lecture API -> dashboard: p50 {np.percentile(lat, 50):.1f}s, "
+                  f"max {lat.max():.1f}s")
+        if self.text_latency:
+            lat = np.concatenate(self.text_latency)
+            print(f"[orchestrator] latence publication -> dashboard: p50 {np.percentile(lat, 50):.0f}s, "
+                  f"p95 {np.percentile(lat, 95):.0f}s")
+
+def run(limit_posts=20, incremental=True, batch_media=ORCH_BATCH_MEDIA):
+    return Orchestrator(batch_media=batch_media).run(limit_posts, incremental)
+
+if __name__ == "__main__":
+    args = sys.argv
+    run(limit_posts=int(args[args.index("--limit") + 1]) if "--limit" in args else 20,
+        incremental="--full" not in args,
+        batch_media=int(args[args.index("--batch") + 1]) if "--batch" in args else ORCH_BATCH_MEDIA)
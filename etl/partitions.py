@@ -0,0 +1,187 @@
+# etl/partitions.py
+# flat_texts partitionnée par mois de created_time (PARTITION BY RANGE).
+#   python -m etl.partitions --migrate           conversion de la table existante (une fois, verrou exclusif)
+#   python -m etl.partitions                     crée les partitions des prochains mois (appelé par le pipeline)
+#   python -m etl.partitions --archive 2024-01   détache les mois antérieurs vers le schéma flat_texts_archive
+#   python -m etl.partitions --archive 2024-01 --drop   ... ou les supprime
+# Partitions: flat_texts_undated (textes sans date, rangés à '-infinity', et avant 2010), une par mois
+# (flat_texts_yYYYYmMM) et flat_texts_default pour les dates hors des mois créés.
+# Sur la table partitionnée, la clé primaire et la contrainte uq_flat_texts_source incluent created_time;
+# text_emojis n'a plus de clé étrangère vers flat_texts (les émojis des partitions archivées sont supprimés ici).
+import re, sys, time
+from datetime import date
+from config.settings import PARTITION_MONTHS_AHEAD
+from etl import aggregates, db
+from etl.load import SCHEMA_SQL
+
+ARCHIVE_SCHEMA = "flat_texts_archive"
+UNDATED_UPPER = "2010-01-01"  # Instagram n'existait pas avant: tout ce qui précède est "sans date"
+MONTH_RE = re.compile(r"^flat_texts_y(\d{4})m(\d{2})$")
+
+IS_PARTITIONED_SQL = "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('flat_texts')"
+PARTITIONS_SQL = """
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'flat_texts'::regclass ORDER BY c.relname
+"""
+
+# Ancienne table renommée, nouvelle table de même structure (colonnes, défauts, CHECK) partitionnée.
+# La vue vw_emoji_sentiment et la clé étrangère de text_emojis suivraient l'ancienne table: recréées après.
+MIGRATE_PREPARE_SQL = """
+    LOCK TABLE flat_texts IN ACCESS EXCLUSIVE MODE;
+    DROP VIEW IF EXISTS vw_emoji_sentiment;
+    ALTER TABLE text_emojis DROP CONSTRAINT IF EXISTS text_emojis_flat_text_id_fkey;
+    ALTER TABLE flat_texts RENAME TO flat_texts_unpartitioned;
+    UPDATE flat_texts_unpartitioned SET created_time = '-infinity' WHERE created_time IS NULL;
+    CREATE TABLE flat_texts (LIKE flat_texts_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (created_time);
+    ALTER TABLE flat_texts ALTER COLUMN created_time SET NOT NULL;
+""" + f"""
+    CREATE TABLE flat_texts_undated PARTITION OF flat_texts FOR VALUES FROM (MINVALUE) TO ('{UNDATED_UPPER}');
+    CREATE TABLE flat_texts_default PARTITION OF flat_texts DEFAULT;
+"""
+
+# copie puis index construits une seule fois sur les données (le reste vient de sql/schema.sql)
+MIGRATE_COPY_SQL = """
+    INSERT INTO flat_texts SELECT * FROM flat_texts_unpartitioned;
+    DROP TABLE flat_texts_unpartitioned;
+    ALTER TABLE flat_texts ADD PRIMARY KEY (id, created_time);
+    ALTER TABLE flat_texts ADD CONSTRAINT uq_flat_texts_source UNIQUE (source_type, source_id, created_time);
+"""
+
+MONTHS_SQL = f"""
+    SELECT date_trunc('month', MIN(created_time))::date, date_trunc('month', MAX(created_time))::date
+    FROM {{table}} WHERE created_time >= '{UNDATED_UPPER}'
+"""
+
+# un mois dont des lignes sont déjà dans la partition par défaut: table créée à part, lignes déplacées,
+# puis rattachée (CREATE ... PARTITION OF échouerait sur ces lignes)
+CREATE_MONTH_SQL = """
+    CREATE TABLE {name} (LIKE flat_texts INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+    WITH moved AS (
+        DELETE FROM flat_texts_default WHERE created_time >= %(lo)s AND created_time < %(hi)s RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved;
+    ALTER TABLE flat_texts ATTACH PARTITION {name} FOR VALUES FROM (%(lo)s) TO (%(hi)s);
+"""
+
+ARCHIVE_SQL = f"""
+    DELETE FROM text_emojis e USING {{name}} p WHERE e.flat_text_id = p.id;
+    ALTER TABLE flat_texts DETACH PARTITION {{name}};
+    CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};
+    ALTER TABLE {{name}} SET SCHEMA {ARCHIVE_SCHEMA};
+"""
+
+def month_name(d):
+    return f"flat_texts_y{d.year:04d}m{d.month:02d}"
+
+def add_months(d, n):
+    m = d.year * 12 + d.month - 1 + n
+    return date(m // 12, m % 12 + 1, 1)
+
+def is_partitioned(conn):
+    cur = conn.cursor()
+    cur.execute(IS_PARTITIONED_SQL)
+    row = cur.fetchone()
+    cur.close()
+    return bool(row and row[0])
+
+def month_partitions(cur):
+    cur.execute(PARTITIONS_SQL)
+    out = {}
+    for (name,) in cur.fetchall():
+        m = MONTH_RE.match(name)
+        if m:
+            out[name] = date(int(m.group(1)), int(m.group(2)), 1)
+    return out
+
+def _create_months(cur, first, last):
+    # partitions mensuelles manquantes de first à last inclus
+    existing = month_partitions(cur)
+    created = 0
+    d = first
+    while d <= last:
+        name = month_name(d)
+        if name not in existing:
+            cur.execute(CREATE_MONTH_SQL.format(name=name), {"lo": d, "hi": add_months(d, 1)})
+            created += 1
+        d = add_months(d, 1)
+    return created
+
+def ensure_partitions(conn=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Partitions du mois courant et des months_ahead suivants (sans effet si flat_texts n'est pas partitionnée)"""
+    if conn is None:
+        with db.connection() as conn:
+            return ensure_partitions(conn, months_ahead)
+    created = 0
+    if is_partitioned(conn):
+        cur = conn.cursor()
+        this_month = date.today().replace(day=1)
+        created = _create_months(cur, this_month, add_months(this_month, months_ahead))
+        # dates hors de l'horizon arrivées dans la partition par défaut (vieux posts, dates futures)
+        cur.execute(MONTHS_SQL.format(table="flat_texts_default"))
+        lo, hi = cur.fetchone()
+        if lo:
+            created += _create_months(cur, lo, hi)
+        conn.commit()
+        cur.close()
+        if created:
+            print(f"[partitions] {created} partitions mensuelles créées")
+    return created
+
+def migrate(conn=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    if conn is None:
+        with db.connection() as conn:
+            return migrate(conn, months_ahead)
+    if is_partitioned(conn):
+        print("[partitions] flat_texts est déjà partitionnée")
+        return False
+    start = time.time()
+    cur = conn.cursor()
+    # une seule transaction: en cas d'erreur la table d'origine reste en place
+    cur.execute(MIGRATE_PREPARE_SQL)
+    cur.execute(MONTHS_SQL.format(table="flat_texts_unpartitioned"))
+    lo, hi = cur.fetchone()
+    this_month = date.today().replace(day=1)
+    n = _create_months(cur, min(lo or this_month, this_month),
+                       max(hi or this_month, add_months(this_month, months_ahead)))
+    cur.execute(MIGRATE_COPY_SQL)
+    for path in (SCHEMA_SQL, aggregates.AGGREGATES_SQL, aggregates.VIEWS_SQL):
+        with open(path, "r", encoding="utf-8") as f:
+            cur.execute(f.read())
+    conn.commit()
+    cur.execute("ANALYZE flat_texts")
+    conn.commit()
+    cur.close()
+    print(f"[partitions] flat_texts partitionnée ({n} mois) en {time.time() - start:.1f}s")
+    aggregates.refresh(conn, full=True)
+    return True
+
+def archive(before, drop=False, conn=None):
+    """Détache les partitions mensuelles entièrement antérieures à before (date): déplacées dans le schéma
+    flat_texts_archive (rattachables avec ATTACH PARTITION) ou supprimées si drop"""
+    if conn is None:
+        with db.connection() as conn:
+            return archive(before, drop, conn)
+    cur = conn.cursor()
+    names = sorted(n for n, d in month_partitions(cur).items() if add_months(d, 1) <= before)
+    for name in names:
+        cur.execute(ARCHIVE_SQL.format(name=name))
+        if drop:
+            cur.execute(f"DROP TABLE {ARCHIVE_SCHEMA}.{name}")
+    conn.commit()
+    cur.close()
+    action = "supprimées" if drop else f"archivées dans {ARCHIVE_SCHEMA}"
+    print(f"[partitions] {len(names)} partitions antérieures à {before} {action}")
+    if names:
+        # les agrégats ne voient que les lignes encore attachées
+        aggregates.refresh(conn, full=True)
+    return names
+
+if __name__ == "__main__":
+    if "--migrate" in sys.argv:
+        migrate()
+    elif "--archive" in sys.argv:
+        y, m = sys.argv[sys.argv.index("--archive") + 1].split("-")[:2]
+        archive(date(int(y), int(m), 1), drop="--drop" in sys.argv)
+    else:
+        ensure_partitions()
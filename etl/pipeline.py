@@ -1,12 +1,24 @@
 # etl/pipeline.py
-from etl import extract, transform, load
+from etl import extract, transform, load, aggregates, partitions, instrumentation
 
-def run_all():
+def run_all(incremental=True, streaming=False):
+    # incrémental par défaut: le premier run (sans watermarks) fait le backfill complet.
+    # streaming: étapes en flux par lots, prédiction comprise, avec reprise (etl/orchestrator.py)
+    # un seul enregistrement de run (logs/runs/, pipeline_runs) pour toutes les étapes
     print("=== ETL pipeline start ===")
-    extract.extract_all(limit_posts=20)
-    transform.transform()
-    load.load()
+    if streaming:
+        from etl import orchestrator
+        orchestrator.run(limit_posts=20, incremental=incremental)
+        print("=== ETL pipeline finished ===")
+        return
+    with instrumentation.run("pipeline"):
+        extract.extract_all(limit_posts=20, incremental=incremental)
+        transform.transform()
+        partitions.ensure_partitions()
+        load.load()
+        aggregates.refresh()
     print("=== ETL pipeline finished ===")
 
 if __name__ == "__main__":
-    run_all()
+    import sys
+    run_all(streaming="--stream" in sys.argv)
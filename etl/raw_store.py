@@ -0,0 +1,145 @@
+# etl/raw_store.py
+# Couche brute append-only: un fichier NDJSON (une ligne = un media + ses commentaires)
+# par run d'extraction, partitionné par date d'extraction:
+#   data/raw/ndjson/dt=2025-09-09/part-20250909T171906123456789-4242.ndjson[.gz|.zst]
+# (horodatage à la nanoseconde puis pid: l'ordre des noms est l'ordre d'écriture)
+import os, json, glob, gzip, threading, time
+from collections import Counter
+from datetime import datetime, timezone
+from config.settings import RAW_COMPRESSION
+
+RAW_NDJSON_DIR = "data/raw/ndjson"
+LEGACY_RAW_FILE = "data/raw/instagram_raw_posts.json"
+EXTENSIONS = {None: ".ndjson", "": ".ndjson", "none": ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Compression zstd demandée mais le paquet 'zstandard' n'est pas installé")
+    return zstandard
+
+def _open(path, mode, name=None):
+    # mode 'r' ou 'w', toujours en texte utf-8; la compression est déduite de l'extension de name
+    name = name or path
+    if name.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if name.endswith(".zst"):
+        return _zstd().open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+_last_ns = 0
+_ns_lock = threading.Lock()
+
+def _next_ns():
+    # strictement croissant dans le processus, même si l'horloge recule ou se répète
+    global _last_ns
+    with _ns_lock:
+        _last_ns = max(_last_ns + 1, time.time_ns())
+        return _last_ns
+
+def new_part_path(base=RAW_NDJSON_DIR, compression=RAW_COMPRESSION, now=None):
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Compression inconnue: {compression}")
+    ns = int(now.timestamp()) * 10**9 + now.microsecond * 1000 if now else _next_ns()
+    now = datetime.fromtimestamp(ns // 10**9, timezone.utc)
+    run_id = f"{now:%Y%m%dT%H%M%S}{ns % 10**9:09d}-{os.getpid()}"
+    return os.path.join(base, f"dt={now:%Y-%m-%d}", f"part-{run_id}{EXTENSIONS[compression]}")
+
+class RawWriter:
+    """Écrit les media au fil de l'extraction; chaque ligne est flushée pour être lisible tout de suite"""
+
+    def __init__(self, path=None, base=RAW_NDJSON_DIR, compression=RAW_COMPRESSION):
+        self.path = path or new_part_path(base, compression)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # on écrit dans un .inprogress puis on renomme: les lecteurs ne voient que des parts complètes
+        self.tmp_path = self.path + ".inprogress"
+        self.f = _open(self.tmp_path, "w", name=self.path)
+        self.count = 0
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def list_parts(base=RAW_NDJSON_DIR):
+    # ordre chronologique: les versions les plus récentes d'un media arrivent en dernier
+    parts = []
+    for ext in set(EXTENSIONS.values()):
+        parts.extend(glob.glob(os.path.join(base, "dt=*", f"part-*{ext}")))
+    return sorted(parts, key=os.path.basename)
+
+def iter_part(path):
+    with _open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def merge_media(old, new):
+    # version plus récente d'un media: ses champs remplacent les anciens, commentaires fusionnés par id (la
+    # plus récente gagne). Une extraction incrémentale n'écrit que le delta: commentaires postérieurs au
+    # watermark, ou aucun quand seuls les likes ont changé
+    comments = {c.get("id"): c for c in old.get("fetched_comments") or []}
+    comments.update({c.get("id"): c for c in new.get("fetched_comments") or []})
+    old.pop("fetch_error", None)
+    old.update({k: v for k, v in new.items() if k != "fetched_comments"})
+    old["fetched_comments"] = sorted(comments.values(), key=lambda c: c.get("timestamp") or "", reverse=True)
+    return old
+
+def iter_raw_posts(base=RAW_NDJSON_DIR, parts=None, legacy_file=LEGACY_RAW_FILE, latest=True):
+    # générateur. latest: chaque media n'est rendu qu'une fois, toutes ses versions fusionnées (merge_media),
+    # dès sa dernière version lue; un premier passage compte les versions de chaque id, seuls les media
+    # dont une version reste à lire sont gardés en mémoire. Sinon toutes les versions dans l'ordre chronologique
+    parts = list_parts(base) if parts is None else parts
+    if not parts and legacy_file and os.path.exists(legacy_file):
+        with open(legacy_file, "r", encoding="utf-8") as f:
+            posts = json.load(f)
+        yield from _merged(posts, Counter(p.get("id") for p in posts)) if latest else posts
+        return
+    if not latest:
+        for path in parts:
+            yield from iter_part(path)
+        return
+    remaining = Counter(p.get("id") for path in parts for p in iter_part(path))
+    yield from _merged((p for path in parts for p in iter_part(path)), remaining)
+
+def _merged(posts, remaining):
+    # posts dans l'ordre chronologique, remaining: nombre de versions de chaque id
+    pending = {}
+    for p in posts:
+        pid = p.get("id")
+        if pid is None:
+            yield p
+            continue
+        if pid in pending:
+            p = merge_media(pending.pop(pid), p)
+        remaining[pid] -= 1
+        if remaining[pid] > 0:
+            pending[pid] = p
+        else:
+            yield p
+
+def import_legacy(legacy_file=LEGACY_RAW_FILE, base=RAW_NDJSON_DIR, compression=RAW_COMPRESSION):
+    # convertit l'ancien instagram_raw_posts.json en une part NDJSON
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        posts = json.load(f)
+    with RawWriter(base=base, compression=compression) as w:
+        for p in posts:
+            w.write(p)
+    print(f"[raw_store] {w.count} posts importés dans {w.path}")
+    return w.path
+
+if __name__ == "__main__":
+    import_legacy()
@@ -0,0 +1,46 @@
+# etl/state.py
+# Store persistant des watermarks par media pour l'extraction incrémentale
+import os, json
+from datetime import datetime, timezone
+
+STATE_DIR = "data/state"
+WATERMARKS_FILE = os.path.join(STATE_DIR, "watermarks.json")
+
+def load_watermarks(path=WATERMARKS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_watermarks(watermarks, path=WATERMARKS_FILE):
+    # écriture atomique: un run interrompu ne laisse jamais un fichier à moitié écrit
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(watermarks, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def media_status(media, watermark):
+    # 'new', 'comments' (nouveaux commentaires), 'counts' (likes seulement) ou 'unchanged'
+    if not watermark:
+        return "new"
+    if int(media.get("comments_count") or 0) != watermark.get("comments_count"):
+        return "comments"
+    if int(media.get("like_count") or 0) != watermark.get("like_count"):
+        return "counts"
+    return "unchanged"
+
+def update_watermark(watermarks, media, comments, cursor=None):
+    mid = media.get("id")
+    wm = watermarks.get(mid, {})
+    stamps = [c.get("timestamp") for c in comments if c.get("timestamp")]
+    if stamps:
+        wm["last_comment_ts"] = max(stamps + [wm.get("last_comment_ts") or ""])
+    wm["timestamp"] = media.get("timestamp")
+    wm["like_count"] = int(media.get("like_count") or 0)
+    wm["comments_count"] = int(media.get("comments_count") or 0)
+    if cursor is not None:
+        wm["comments_cursor"] = cursor
+    wm["updated_at"] = datetime.now(timezone.utc).isoformat()
+    watermarks[mid] = wm
+    return wm
@@ -0,0 +1,470 @@
+# etl/webhook.py
+# Ingestion quasi temps réel: récepteur des webhooks Instagram (champ "comments" de l'objet instagram).
+#   python -m etl.webhook [--port 8710]
+#   GET  /webhook   vérification de l'abonnement (hub.mode=subscribe, hub.verify_token, renvoie hub.challenge)
+#   POST /webhook   notifications, signées par X-Hub-Signature-256 (HMAC-SHA256 du corps, secret de l'app;
+#                   sans WEBHOOK_APP_SECRET le serveur ne démarre pas, sauf --insecure: signatures non vérifiées)
+#   GET  /metrics   événements reçus / chargés / prédits, latence réception -> prédiction p50/p95/p99
+#   GET  /health
+# Une notification est acquittée dès qu'elle est en file (Meta attend une réponse rapide); un thread la
+# normalise avec le même code que transform (clean_text / émojis par graphème), charge le micro-lot dans
+# comments et flat_texts (staging + upsert, une transaction) et le score aussitôt avec le modèle servi.
+# Les agrégats (donc vw_negative_alerts) sont rafraîchis au plus toutes les WEBHOOK_AGG_REFRESH_SECONDS.
+# La notification ne donne ni date ni likes: created_time = heure de la notification, like_count = 0.
+# Le prochain run batch les remplace par les valeurs de l'API (etl/load.py: date réécrite dans comments et
+# flat_texts, ligne déplacée de partition si besoin); un commentaire déjà chargé par le batch garde sa date et
+# ses likes. Un post ou un commentaire parent encore inconnu est créé vide (clés étrangères) et rempli par
+# le prochain run.
+# Un lot qui échoue encore après les retries est écrit dans data/raw/webhook_failed.ndjson, au format des
+# notifications: python -m bench.replay_webhooks --file data/raw/webhook_failed.ndjson --url ... le rejoue.
+# Une vie du serveur = un run "webhook" (etl/instrumentation.py), réécrit toutes les WEBHOOK_CHECKPOINT_SECONDS
+# avec les compteurs courants (status "running") pour qu'un arrêt brutal laisse une trace.
+import argparse, hashlib, hmac, json, os, queue, threading, time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import psycopg2
+from dateutil import parser
+from config.settings import (WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_VERIFY_TOKEN, WEBHOOK_APP_SECRET,
+                             WEBHOOK_MAX_BATCH, WEBHOOK_MAX_WAIT_MS, WEBHOOK_QUEUE_SIZE,
+                             WEBHOOK_AGG_REFRESH_SECONDS, WEBHOOK_TIME_WINDOW_MINUTES, WEBHOOK_CHECKPOINT_SECONDS,
+                             SERVE_RELOAD_SECONDS)
+from etl import transform, load, aggregates, partitions, db, instrumentation
+from etl.load import (COMMENT_COLUMNS, FLAT_COLUMNS, STAGING_SQL, ALIGN_CREATED_TIME_SQL, MERGE_EMOJIS_SQL, copy_rows,
+                      df_rows)
+
+FAILED_FILE = os.path.join("data", "raw", "webhook_failed.ndjson")
+COMMENT_FIELDS = {"comments", "live_comments"}
+MAX_ATTEMPTS = 3
+
+# post et commentaire parent créés vides s'ils ne sont pas encore en base; un commentaire déjà chargé par
+# le batch ne perd ni ses likes ni sa date
+MERGE_COMMENTS_SQL = """
+    INSERT INTO posts (post_id) SELECT DISTINCT post_id FROM stage_comments ON CONFLICT (post_id) DO NOTHING;
+    INSERT INTO comments (comment_id, post_id)
+    SELECT DISTINCT ON (parent_comment_id) parent_comment_id, post_id FROM stage_comments
+    WHERE parent_comment_id IS NOT NULL
+    ORDER BY parent_comment_id
+    ON CONFLICT (comment_id) DO NOTHING;
+    INSERT INTO comments (comment_id, post_id, parent_comment_id, username, text, like_count, created_time)
+    SELECT DISTINCT ON (comment_id) comment_id, post_id, parent_comment_id, username, text, like_count, created_time
+    FROM stage_comments
+    ORDER BY comment_id, seq DESC
+    ON CONFLICT (comment_id) DO UPDATE SET
+      text=EXCLUDED.text,
+      username=COALESCE(comments.username, EXCLUDED.username),
+      created_time=COALESCE(comments.created_time, EXCLUDED.created_time);
+"""
+
+# même clé naturelle que load.MERGE_FLAT_SQL; seul un texte nouveau ou modifié est réécrit (et renvoyé
+# pour être scoré), les likes restent ceux du batch. Notifications rejouées par Meta: aucune ligne
+MERGE_FLAT_SQL = """
+    WITH merged AS (
+    INSERT INTO flat_texts (source_type, source_id, post_id, parent_comment_id, username, text, like_count, emoji_summary, created_time)
+    SELECT DISTINCT ON (source_type, source_id) source_type, source_id, post_id, parent_comment_id, username, text, like_count, emoji_summary,
+           COALESCE(created_time, '-infinity')
+    FROM stage_flat_texts
+    ORDER BY source_type, source_id, seq DESC
+    ON CONFLICT ON CONSTRAINT uq_flat_texts_source DO UPDATE SET
+      text=EXCLUDED.text,
+      emoji_summary=EXCLUDED.emoji_summary,
+      sentiment_label=NULL,
+      labeled_at=NULL,
+      predicted_sentiment=NULL,
+      predicted_score=NULL,
+      model_version=NULL
+    WHERE flat_texts.text IS DISTINCT FROM EXCLUDED.text
+    RETURNING id, text, created_time, emoji_summary
+    ), kept AS (
+    INSERT INTO stage_merged_flat SELECT id, emoji_summary FROM merged
+    )
+    SELECT id, text, created_time FROM merged;
+"""
+
+# --- notifications -------------------------------------------------------------------------------------
+
+def sign(body, secret):
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+def verify_signature(body, header, secret=WEBHOOK_APP_SECRET):
+    # sans secret, aucune notification n'est authentifiable: refusée (le mode --insecure ne l'appelle pas)
+    if not secret:
+        return False
+    return bool(header) and hmac.compare_digest(sign(body, secret), header)
+
+def _event_time(value, entry):
+    # timestamp du commentaire s'il est fourni, sinon heure de la notification (secondes ou millisecondes)
+    t = value.get("timestamp", entry.get("time"))
+    if t is None:
+        return None
+    if isinstance(t, (int, float)) or str(t).isdigit():
+        t = float(t)
+        return datetime.fromtimestamp(t / 1000 if t > 1e11 else t, timezone.utc)
+    try:
+        return parser.isoparse(t)
+    except (ValueError, OverflowError):
+        return None
+
+def parse_notification(payload):
+    """Commentaires d'une notification {"object": "instagram", "entry": [{"time", "changes": [...]}]}"""
+    events = []
+    if not isinstance(payload, dict) or payload.get("object") != "instagram":
+        return events
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            if change.get("field") not in COMMENT_FIELDS or not value.get("id") or not (value.get("media") or {}).get("id"):
+                continue
+            events.append({
+                "comment_id": str(value["id"]),
+                "post_id": str(value["media"]["id"]),
+                "parent_comment_id": str(value["parent_id"]) if value.get("parent_id") else None,
+                "username": (value.get("from") or {}).get("username"),
+                "text": value.get("text"),
+                "created_time": _event_time(value, entry),
+            })
+    return events
+
+def build_payload(events):
+    # notification Instagram portant ces commentaires (dead letters, bench/replay_webhooks.py)
+    changes = []
+    for e in events:
+        value = {"id": e["comment_id"], "text": e.get("text"), "media": {"id": e["post_id"]},
+                 "from": {"username": e.get("username")}}
+        if e.get("parent_comment_id"):
+            value["parent_id"] = e["parent_comment_id"]
+        if e.get("created_time") is not None:
+            value["timestamp"] = int(e["created_time"].timestamp())
+        changes.append({"field": "comments", "value": value})
+    return {"object": "instagram", "entry": [{"id": "0", "time": int(time.time()), "changes": changes}]}
+
+def events_frames(events):
+    # (comments_df, flat_df) aux colonnes de load, texte et émojis calculés comme dans transform
+    ev = pd.DataFrame(events, columns=["comment_id", "post_id", "parent_comment_id", "username", "text", "created_time"])
+    text = transform.clean_text_series(ev["text"])
+    created = pd.to_datetime(ev["created_time"], utc=True)
+    parent = ev["parent_comment_id"].astype(object).where(ev["parent_comment_id"].notna(), None)
+    comments_df = pd.DataFrame({
+        "comment_id": ev["comment_id"],
+        "post_id": ev["post_id"],
+        "parent_comment_id": parent,
+        "username": ev["username"],
+        "text": text,
+        "like_count": 0,
+        "created_time": created,
+    })[COMMENT_COLUMNS]
+    flat_df = pd.DataFrame({
+        "source_type": np.where(parent.notna(), "reply", "comment"),
+        "source_id": ev["comment_id"],
+        "post_id": ev["post_id"],
+        "parent_comment_id": parent,
+        "username": ev["username"],
+        "text": text,
+        "like_count": 0,
+        "emoji_summary": transform.emoji_summary_series(text),
+        "created_time": created,
+    })[FLAT_COLUMNS]
+    return comments_df, flat_df
+
+def ingest(conn, events):
+    """Charge un micro-lot dans comments / flat_texts / text_emojis (commit); renvoie [(id, texte, created_time)] à scorer"""
+    comments_df, flat_df = events_frames(events)
+    cur = conn.cursor()
+    cur.execute(STAGING_SQL)
+    copy_rows(cur, "stage_comments", COMMENT_COLUMNS, df_rows(comments_df, COMMENT_COLUMNS))
+    copy_rows(cur, "stage_flat_texts", FLAT_COLUMNS, df_rows(flat_df, FLAT_COLUMNS))
+    # ligne déjà chargée par le batch: sa date fait foi (clé de la table partitionnée)
+    cur.execute(ALIGN_CREATED_TIME_SQL, {"window": timedelta(minutes=WEBHOOK_TIME_WINDOW_MINUTES)})
+    cur.execute(MERGE_COMMENTS_SQL)
+    cur.execute(MERGE_FLAT_SQL)
+    merged = cur.fetchall()
+    cur.execute(MERGE_EMOJIS_SQL)
+    conn.commit()
+    cur.close()
+    return merged
+
+# --- micro-lots ----------------------------------------------------------------------------------------
+
+class Ingestor:
+    """File des commentaires reçus, micro-lots chargés puis scorés par un seul thread"""
+
+    def __init__(self, model_dir=None, max_batch=WEBHOOK_MAX_BATCH, max_wait_ms=WEBHOOK_MAX_WAIT_MS,
+                 queue_size=WEBHOOK_QUEUE_SIZE, refresh_seconds=WEBHOOK_AGG_REFRESH_SECONDS,
+                 reload_seconds=SERVE_RELOAD_SECONDS, failed_path=FAILED_FILE):
+        from scripts_models import apply_model
+        self.model_dir = model_dir or apply_model.MODEL_DIR
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.refresh_seconds = refresh_seconds
+        self.reload_seconds = reload_seconds
+        self.failed_path = failed_path
+        self.events = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.conn = None
+        self.partitioned = None  # flat_texts partitionnée (clé de l'UPDATE des prédictions), lu au démarrage
+        self.artifacts = None   # (model, vect, version, cache), remplacé d'un bloc au rechargement
+        self.checked_at = 0.0
+        self.dirty = False      # lignes écrites depuis le dernier rafraîchissement des agrégats
+        self.latencies = deque(maxlen=100000)
+        self.counts = {"received": 0, "rejected": 0, "batches": 0, "ingested": 0, "predicted": 0,
+                       "failed": 0, "refreshes": 0}
+        self.first_at = self.last_at = None
+
+    def start(self):
+        with db.connection() as conn:
+            load.ensure_schema(conn)
+            partitions.ensure_partitions(conn)
+            self.partitioned = partitions.is_partitioned(conn)
+        self._check_model()
+        threading.Thread(target=self._batch_loop, name="webhook-batch", daemon=True).start()
+        if self.refresh_seconds:
+            threading.Thread(target=self._refresh_loop, name="webhook-aggregates", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def submit(self, events):
+        """Met en file les commentaires d'une notification, tous ou aucun: False si la file n'a pas la place
+        (réponse 503, Meta renvoie la notification entière)"""
+        now = time.perf_counter()
+        # seul le thread des lots retire de la file: la place vérifiée sous le verrou ne peut que grandir
+        with self.lock:
+            if self.events.maxsize and self.events.maxsize - self.events.qsize() < len(events):
+                self.counts["rejected"] += 1
+                return False
+            for e in events:
+                self.events.put_nowait((now, e))
+            self.counts["received"] += len(events)
+        return True
+
+    def _check_model(self):
+        # modèle servi chargé au démarrage puis rechargé à chaud quand une nouvelle version est publiée
+        from scripts_models import apply_model, predict
+        self.checked_at = time.time()
+        try:
+            version = predict.artifacts_version(self.model_dir)
+            if self.artifacts is None or version != self.artifacts[2]:
+                model, vect, version = predict.load_artifacts(self.model_dir)
+                self.artifacts = (model, vect, version, apply_model.get_cache(self._conn(), version))
+                print(f"[webhook] modèle {version}")
+        except FileNotFoundError as e:
+            if self.artifacts is None:
+                print(f"[webhook] pas de prédiction ({e}): textes chargés, scorés par le prochain apply_model")
+        except (OSError, EOFError) as e:
+            # artefacts en cours d'écriture: on réessaie au prochain tour
+            print(f"[webhook] rechargement reporté: {e}")
+
+    def _conn(self):
+        if self.conn is None or self.conn.closed:
+            if self.conn is not None:
+                db.putconn(self.conn)
+            self.conn = db.getconn()
+        return self.conn
+
+    def _collect(self):
+        # attend un premier commentaire puis complète le lot jusqu'à max_batch ou max_wait
+        try:
+            batch = [self.events.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.events.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while not self.stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            if self.reload_seconds and time.time() - self.checked_at >= self.reload_seconds:
+                self._check_model()
+            error = None
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    self._process(batch)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if self.conn is not None and not self.conn.closed:
+                        self.conn.rollback()
+                    print(f"[webhook] lot de {len(batch)} en échec (essai {attempt + 1}/{MAX_ATTEMPTS}): {e}".strip())
+                    if not isinstance(e, psycopg2.Error):
+                        break  # erreur de données: un nouvel essai donnerait la même chose
+                    time.sleep(2 ** attempt)
+            if error is not None:
+                self._dead_letter([e for _, e in batch])
+
+    def _process(self, batch):
+        from scripts_models import apply_model, predict
+        conn = self._conn()
+        with instrumentation.timed("webhook.ingest"):
+            merged = ingest(conn, [e for _, e in batch])
+        predicted = 0
+        if merged and self.artifacts is not None:
+            model, vect, version, cache = self.artifacts
+            with instrumentation.timed("webhook.predict"):
+                values = predict.predict_cached([t for _, t, _ in merged], cache, model, vect)
+            predicted = apply_model.update_predictions(conn, [(i, label, score, version, created_time)
+                                                              for (i, _, created_time), (label, score)
+                                                              in zip(merged, values)], self.partitioned)
+        done = time.perf_counter()
+        with self.lock:
+            self.latencies.extend(done - received for received, _ in batch)
+            self.counts["batches"] += 1
+            self.counts["ingested"] += len(batch)
+            self.counts["predicted"] += predicted
+            self.first_at = self.first_at or batch[0][0]
+            self.last_at = done
+            self.dirty = self.dirty or bool(merged)
+
+    def _dead_letter(self, events):
+        os.makedirs(os.path.dirname(self.failed_path), exist_ok=True)
+        with open(self.failed_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(build_payload(events), ensure_ascii=False) + "\n")
+        with self.lock:
+            self.counts["failed"] += len(events)
+        print(f"[webhook] {len(events)} commentaires écrits dans {self.failed_path}")
+
+    def _refresh_loop(self):
+        # connexion du pool séparée: le rafraîchissement ne retarde pas le lot suivant
+        while not self.stopped.wait(self.refresh_seconds):
+            with self.lock:
+                dirty, self.dirty = self.dirty, False
+            if not dirty:
+                continue
+            try:
+                # hors instrumentation: le run du serveur ne garde pas une étape par rafraîchissement
+                aggregates.refresh(instrumented=False)
+                with self.lock:
+                    self.counts["refreshes"] += 1
+            except psycopg2.Error as e:
+                with self.lock:
+                    self.dirty = True
+                print(f"[webhook] rafraîchissement des agrégats reporté: {e}".strip())
+
+    def metrics(self):
+        with self.lock:
+            lat = np.array(self.latencies) * 1000
+            out = dict(self.counts)
+            out["queue_size"] = self.events.qsize()
+            out["avg_batch_size"] = round(self.counts["ingested"] / self.counts["batches"], 2) if self.counts["batches"] else 0
+            out["model"] = self.artifacts[2] if self.artifacts else None
+            if self.first_at is not None and self.last_at > self.first_at:
+                out["events_per_s"] = round(self.counts["ingested"] / (self.last_at - self.first_at), 1)
+        if len(lat):
+            for p in (50, 95, 99):
+                out[f"p{p}_ms"] = round(float(np.percentile(lat, p)), 3)
+        return out
+
+# --- HTTP ----------------------------------------------------------------------------------------------
+
+class Handler(BaseHTTPRequestHandler):
+    ingestor = None
+    verify_token = WEBHOOK_VERIFY_TOKEN
+    app_secret = WEBHOOK_APP_SECRET
+    insecure = False  # signatures non vérifiées quand il n'y a pas de secret (local uniquement)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/webhook":
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if q.get("hub.mode") == "subscribe" and self.verify_token and q.get("hub.verify_token") == self.verify_token:
+                self._send(200, q.get("hub.challenge", ""), "text/plain")
+            else:
+                self._send(403, {"error": "jeton de vérification invalide"})
+        elif url.path == "/metrics":
+            self._send(200, self.ingestor.metrics())
+        elif url.path == "/health":
+            self._send(200, {"status": "ok", "queue_size": self.ingestor.events.qsize()})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/webhook":
+            self._send(404, {"error": "not found"})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not (self.insecure and not self.app_secret) and \
+                not verify_signature(body, self.headers.get("X-Hub-Signature-256"), self.app_secret):
+            self._send(403, {"error": "signature invalide"})
+            return
+        try:
+            events = parse_notification(json.loads(body or b"{}"))
+        except (ValueError, AttributeError, TypeError):
+            self._send(400, {"error": "notification invalide"})
+            return
+        if not self.ingestor.submit(events):
+            self._send(503, {"error": "file pleine"})
+            return
+        self._send(200, {"received": len(events)})
+
+def _checkpoint_loop(r, ingestor, seconds):
+    while not ingestor.stopped.wait(seconds):
+        instrumentation.checkpoint(r, metrics=ingestor.metrics())
+
+def serve(host=WEBHOOK_HOST, port=WEBHOOK_PORT, background=False, verify_token=WEBHOOK_VERIFY_TOKEN,
+          app_secret=WEBHOOK_APP_SECRET, insecure=False, checkpoint_seconds=WEBHOOK_CHECKPOINT_SECONDS, **kwargs):
+    if not app_secret and not insecure:
+        raise RuntimeError("WEBHOOK_APP_SECRET vide: signatures invérifiables, démarrage refusé "
+                           "(--insecure / insecure=True pour un essai local)")
+    ingestor = Ingestor(**kwargs).start()
+    handler = type("BoundHandler", (Handler,), {"ingestor": ingestor, "verify_token": verify_token,
+                                                "app_secret": app_secret, "insecure": insecure})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if not app_secret:
+        print("[webhook] mode insecure: signatures non vérifiées (local uniquement)")
+    print(f"[webhook] http://{host}:{server.server_port}/webhook")
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, ingestor
+    # un enregistrement pour toute la vie du serveur, erreur comprise
+    with instrumentation.run("webhook") as r, instrumentation.stage("webhook") as st:
+        if checkpoint_seconds:
+            threading.Thread(target=_checkpoint_loop, args=(r, ingestor, checkpoint_seconds),
+                             name="webhook-checkpoint", daemon=True).start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ingestor.stop()
+            server.server_close()
+            m = ingestor.metrics()
+            st.rows_in, st.rows_out = m["received"], m["predicted"]
+            st.extra.update({k: m[k] for k in ("batches", "failed", "refreshes", "avg_batch_size") if k in m})
+            print(f"[webhook] {m['received']} commentaires reçus, {m['ingested']} chargés, {m['predicted']} prédits")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=WEBHOOK_HOST)
+    ap.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    ap.add_argument("--insecure", action="store_true", help="accepte les notifications non signées sans WEBHOOK_APP_SECRET")
+    a = ap.parse_args()
+    serve(a.host, a.port, insecure=a.insecure)
@@ -1,59 +1,158 @@
 # scripts_models/apply_model.py
-import os, joblib
-import pandas as pd
-import psycopg2
-from config.settings import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+import os, time
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import PREDICTION_CACHE_PERSIST
+from etl import aggregates, db, instrumentation, partitions
+from scripts_models import predict
+from scripts_models.cache import PredictionCache
 
 MODEL_DIR = "models"
 
-def get_model_and_vectorizer():
-    vect_path = os.path.join(MODEL_DIR, "vectorizer.joblib")
-    model_path = None
-    for f in os.listdir(MODEL_DIR):
-        if f.startswith("best_model_"):
-            model_path = os.path.join(MODEL_DIR, f)
-            break
-    if not model_path or not os.path.exists(vect_path):
-        raise FileNotFoundError("Modèle ou vectorizer introuvable. Entraîne d'abord.")
-    vect = joblib.load(vect_path)
-    model = joblib.load(model_path)
+# text est NOT NULL et la contrainte CHECK exclut '': le prédicat est exactement celui de l'index
+# partiel idx_flat_texts_unpredicted (sql/schema.sql)
+UNPREDICTED_SQL = "SELECT id, text, created_time FROM flat_texts WHERE predicted_sentiment IS NULL"
+# partition k sur n de l'espace des ids (hashtext décalé en positif pour éviter abs(-2^31))
+PARTITION_SQL = " AND mod(hashtext(id::text)::bigint + 2147483648, %s) = %s"
+
+# une seule instruction ensembliste par lot au lieu d'un UPDATE par ligne
+UPDATE_PREDICTIONS_SQL = """
+    UPDATE flat_texts AS f
+    SET predicted_sentiment = v.pred, predicted_score = v.score, model_version = v.version
+    FROM (VALUES %s) AS v(id, pred, score, version, created_time)
+    WHERE f.id = v.id::uuid
+"""
+# Table partitionnée (created_time NOT NULL): la date entre dans la clé et chaque ligne de VALUES ne sonde
+# que l'index de sa partition (élagage à l'exécution). Le planificateur ne compte pas cet élagage et, dès
+# quelques centaines de lignes, choisirait un hash join qui parcourt toutes les partitions: boucle imbriquée
+# imposée pour la transaction (3x à 8x plus rapide par lot, cf. bench/check_plans.py --partitioned)
+NESTED_LOOP_SQL = "SET LOCAL enable_hashjoin = off; SET LOCAL enable_mergejoin = off;"
+UPDATE_PREDICTIONS_PARTITIONED_SQL = NESTED_LOOP_SQL + UPDATE_PREDICTIONS_SQL + "    AND f.created_time = v.created_time\n"
+
+def get_model_and_vectorizer(mmap=False):
+    # version servie du registre (ou ancien format); mmap: tableaux partagés entre processus
+    model, vect, _ = predict.load_artifacts(MODEL_DIR, mmap=mmap)
     return model, vect
 
 def fetch_unpredicted():
-    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
-    df = pd.read_sql_query("SELECT id, text FROM flat_texts WHERE text IS NOT NULL AND (predicted_sentiment IS NULL OR predicted_sentiment = '')", conn)
-    conn.close()
-    return df
-
-def update_predictions(df_ids_preds):
-    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
-    cur = conn.cursor()
-    for idx, pred in df_ids_preds.items():
-        cur.execute("UPDATE flat_texts SET predicted_sentiment = %s WHERE id = %s", (pred[0], pred[1]))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def apply_model(batch_size=500):
-    model, vect = get_model_and_vectorizer()
-    df = fetch_unpredicted()
-    if df.empty:
-        print("Rien à prédire.")
-        return
-    X = vect.transform(df['text'].fillna(''))
-    preds = model.predict(X)
-    # Build dict to update
-    updates = {i: (preds[idx], df.loc[idx, 'id']) for idx, i in enumerate(df.index)}
-    # Update DB
-    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
-    cur = conn.cursor()
-    for idx in updates:
-        pred_label, uid = updates[idx]
-        cur.execute("UPDATE flat_texts SET predicted_sentiment = %s WHERE id = %s", (pred_label, uid))
-    conn.commit()
-    cur.close()
-    conn.close()
-    print(f"[apply_model] {len(preds)} rows updated.")
+    return db.read_frame(UNPREDICTED_SQL)
+
+def iter_unpredicted(conn, batch_size=5000, partition=None):
+    # curseur côté serveur: seules batch_size lignes sont en mémoire à la fois.
+    # partition: (k, n) pour ne lire que la k-ième des n tranches de l'espace des ids
+    if partition:
+        return db.iter_chunks(conn, UNPREDICTED_SQL + PARTITION_SQL, (partition[1], partition[0]), batch_size,
+                              name="unpredicted_texts")
+    return db.iter_chunks(conn, UNPREDICTED_SQL, None, batch_size, name="unpredicted_texts")
+
+def score_texts(model, vect, texts):
+    # labels prédits et probabilité de la classe retenue (None si le modèle n'a pas predict_proba)
+    X = vect.transform(texts)
+    if hasattr(model, "predict_proba"):
+        proba = model.predict_proba(X)
+        best = proba.argmax(axis=1)
+        return model.classes_[best], proba[range(len(best)), best]
+    return model.predict(X), [None] * len(texts)
+
+def get_cache(write_conn, version):
+    # table prediction_cache partagée entre runs et workers si PREDICTION_CACHE_PERSIST
+    return PredictionCache(version, conn=write_conn if PREDICTION_CACHE_PERSIST else None)
+
+def _score_values(model, vect, texts):
+    with instrumentation.timed("model.predict"):
+        labels, scores = score_texts(model, vect, texts)
+    return [(str(label), None if score is None else float(score)) for label, score in zip(labels, scores)]
+
+def update_predictions(conn, rows, partitioned=None):
+    # rows: liste de (id, predicted_sentiment, predicted_score, model_version, created_time), une instruction
+    # et un commit. partitioned: flat_texts partitionnée (lu en base si None)
+    if partitioned is None:
+        partitioned = partitions.is_partitioned(conn)
+    sql = UPDATE_PREDICTIONS_PARTITIONED_SQL if partitioned else UPDATE_PREDICTIONS_SQL
+    return db.write_values(conn, sql, rows, template="(%s, %s, %s::float8, %s, %s::timestamptz)",
+                           chunk_size=max(len(rows), 1))
+
+def score_stream(model, vect, read_conn, write_conn, batch_size=5000, partition=None, cache=None, version=None):
+    total = 0
+    partitioned = partitions.is_partitioned(write_conn)
+    for rows in iter_unpredicted(read_conn, batch_size, partition):
+        texts = [r[1] or '' for r in rows]
+        if cache is None:
+            values = _score_values(model, vect, texts)
+        else:
+            values = cache.lookup(texts, lambda missing: _score_values(model, vect, missing))
+        total += update_predictions(write_conn, [(r[0], label, score, version, r[2])
+                                                 for r, (label, score) in zip(rows, values)], partitioned)
+    return total
+
+def apply_model(batch_size=5000):
+    with instrumentation.stage("apply_model") as st:
+        model, vect, version = predict.load_artifacts(MODEL_DIR)
+        # file des textes non prédits lue sur la réplique si configurée, prédictions écrites sur le primaire
+        with db.connection(readonly=True) as read_conn, db.connection() as write_conn:
+            cache = get_cache(write_conn, version)
+            start = time.time()
+            total = score_stream(model, vect, read_conn, write_conn, batch_size, cache=cache, version=version)
+        cache.report("apply_model")
+        st.rows_out = total
+        st.extra.update(model_version=version, cache=cache.stats())
+        if not total:
+            print("Rien à prédire.")
+            return 0
+        elapsed = max(time.time() - start, 1e-9)
+        print(f"[apply_model] {total} rows updated ({total / elapsed:.0f} rows/s), modèle {version}.")
+        aggregates.refresh()
+    return total
+
+# état par processus worker: artefacts et connexions (pool propre au worker) pris une fois, réutilisés
+# pour chaque tranche
+_worker = {}
+
+def _init_worker():
+    _worker["model"], _worker["vect"], _worker["version"] = predict.load_artifacts(MODEL_DIR, mmap=True)
+    _worker["read"], _worker["write"] = db.getconn(readonly=True), db.getconn()
+    _worker["cache"] = get_cache(_worker["write"], _worker["version"])
+
+def _score_partition(args):
+    k, n, batch_size = args
+    start = time.time()
+    # une transaction de lecture par tranche: le curseur nommé peut être réutilisé
+    total = score_stream(_worker["model"], _worker["vect"], _worker["read"], _worker["write"], batch_size, (k, n),
+                         _worker["cache"], _worker["version"])
+    _worker["read"].rollback()
+    return os.getpid(), total, time.time() - start, _worker["cache"].stats()
+
+def apply_model_parallel(workers=None, batch_size=5000, partitions_per_worker=4):
+    # allers-retours base, timers et mémoire des workers (autres processus) non comptés dans l'étape
+    with instrumentation.stage("apply_model") as st:
+        # tranches plus nombreuses que les workers pour équilibrer la charge
+        workers = workers or os.cpu_count()
+        n = workers * partitions_per_worker
+        start = time.time()
+        per_worker = {}
+        cache_stats = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for pid, total, elapsed, stats in pool.map(_score_partition, [(k, n, batch_size) for k in range(n)]):
+                done, busy = per_worker.get(pid, (0, 0.0))
+                per_worker[pid] = (done + total, busy + elapsed)
+                cache_stats[pid] = stats  # compteurs cumulés par worker, le dernier fait foi
+        elapsed = max(time.time() - start, 1e-9)
+        total = sum(done for done, _ in per_worker.values())
+        for pid, (done, busy) in sorted(per_worker.items()):
+            print(f"[apply_model] worker {pid}: {done} textes, {done / max(busy, 1e-9):.0f} textes/s")
+        hits = sum(s["hits"] + s["store_hits"] for s in cache_stats.values())
+        misses = sum(s["misses"] for s in cache_stats.values())
+        print(f"[apply_model] cache: {hits} hits, {misses} calculs ({hits / max(hits + misses, 1):.1%} évités)")
+        print(f"[apply_model] {workers} workers: {total} rows updated ({total / elapsed:.0f} textes/s)")
+        st.rows_out = total
+        st.extra.update(workers=workers, cache={"hits": hits, "misses": misses})
+        if total:
+            aggregates.refresh()
+    return total
 
 if __name__ == "__main__":
-    apply_model()
+    import sys
+    with instrumentation.run("apply_model"):
+        if "--workers" in sys.argv:
+            apply_model_parallel(workers=int(sys.argv[sys.argv.index("--workers") + 1]))
+        else:
+            apply_model()
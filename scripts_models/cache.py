@@ -0,0 +1,95 @@
+# scripts_models/cache.py
+# Cache des prédictions / labels adressé par contenu: clé = sha1(clean_text(texte) + version du modèle).
+# Les commentaires Instagram se répètent énormément ("🔥🔥🔥", "Super !", "❤️"): chaque texte distinct
+# n'est vectorisé et scoré qu'une fois par version de modèle.
+#   - LRU en mémoire (par processus)
+#   - table prediction_cache optionnelle (persistante, partagée entre runs et workers)
+import hashlib
+from collections import OrderedDict
+import psycopg2.extras
+from config.settings import PREDICTION_CACHE_SIZE
+from etl.transform import clean_text
+
+# pseudo-version pour les labels faibles TextBlob (indépendants du modèle entraîné)
+TEXTBLOB_VERSION = "textblob"
+
+SELECT_SQL = "SELECT key, label, score FROM prediction_cache WHERE key = ANY(%s)"
+INSERT_SQL = "INSERT INTO prediction_cache (key, model_version, label, score) VALUES %s ON CONFLICT (key) DO NOTHING"
+
+def text_key(text, version):
+    return hashlib.sha1(f"{version}\x00{clean_text(text or '')}".encode("utf-8")).hexdigest()
+
+class PredictionCache:
+    """LRU (clé -> (label, score)) + table prediction_cache si une connexion est fournie"""
+
+    def __init__(self, version, maxsize=PREDICTION_CACHE_SIZE, conn=None):
+        self.version = version
+        self.maxsize = maxsize
+        self.conn = conn
+        self.lru = OrderedDict()
+        self.hits = 0          # occurrences servies par le LRU (ou doublons dans le même lot)
+        self.store_hits = 0    # occurrences servies par la table prediction_cache
+        self.misses = 0        # textes distincts réellement calculés
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.maxsize:
+            self.lru.popitem(last=False)
+
+    def _from_store(self, keys):
+        if self.conn is None or not keys:
+            return {}
+        cur = self.conn.cursor()
+        cur.execute(SELECT_SQL, (list(keys),))
+        found = {k: (label, score) for k, label, score in cur.fetchall()}
+        cur.close()
+        return found
+
+    def _to_store(self, values):
+        if self.conn is None or not values:
+            return
+        cur = self.conn.cursor()
+        psycopg2.extras.execute_values(cur, INSERT_SQL, [(k, self.version, l, s) for k, (l, s) in values.items()])
+        self.conn.commit()
+        cur.close()
+
+    def lookup(self, texts, compute):
+        """Valeurs (label, score) pour chaque texte; compute(textes distincts manquants) -> [(label, score)]"""
+        keys = [text_key(t, self.version) for t in texts]
+        values = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in values or key in missing:
+                continue
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                values[key] = self.lru[key]
+            else:
+                missing[key] = text
+        stored = self._from_store(missing.keys())
+        for key, value in stored.items():
+            values[key] = value
+            self._remember(key, value)
+            del missing[key]
+        if missing:
+            computed = dict(zip(missing.keys(), compute(list(missing.values()))))
+            values.update(computed)
+            for key, value in computed.items():
+                self._remember(key, value)
+            self._to_store(computed)
+        stored_keys = set(stored)
+        self.store_hits += sum(1 for k in keys if k in stored_keys)
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing) - sum(1 for k in keys if k in stored_keys)
+        return [values[k] for k in keys]
+
+    def stats(self):
+        total = self.hits + self.store_hits + self.misses
+        return {"hits": self.hits, "store_hits": self.store_hits, "misses": self.misses,
+                "hit_rate": round((self.hits + self.store_hits) / total, 4) if total else 0.0}
+
+    def report(self, stage):
+        s = self.stats()
+        print(f"[{stage}] cache {self.version}: {s['hits']} hits, {s['store_hits']} hits table, "
+              f"{s['misses']} calculs ({s['hit_rate']:.1%} évités)")
@@ -1,15 +1,63 @@
 # models/predict.py
 import joblib, os
-vect = joblib.load("models/vectorizer.joblib")
-# charger best model automatiquement
-for f in os.listdir("models"):
-    if f.startswith("best_model_"):
-        model = joblib.load(os.path.join("models", f))
-        break
+from scripts_models import registry
+from scripts_models.cache import PredictionCache
+
+MODEL_DIR = "models"
+_loaded = {}
+
+def find_artifacts(model_dir=MODEL_DIR):
+    # ancien format (hors registre): vectorizer + best model le plus récent de models/
+    vect_path = os.path.join(model_dir, "vectorizer.joblib")
+    models = [os.path.join(model_dir, f) for f in os.listdir(model_dir) if f.startswith("best_model_")]
+    if not models or not os.path.exists(vect_path):
+        raise FileNotFoundError("Modèle ou vectorizer introuvable. Entraîne d'abord.")
+    return max(models, key=lambda m: (os.path.getmtime(m), m)), vect_path
+
+def artifacts_version(model_dir=MODEL_DIR):
+    # version servie par le registre (ex. "v0003-rf"), sinon empreinte des fichiers de l'ancien format;
+    # change dès qu'un nouveau modèle est publié (rechargement à chaud, espace de clés du cache)
+    version = registry.latest(os.path.join(model_dir, "registry"))
+    if version:
+        return version
+    model_path, vect_path = find_artifacts(model_dir)
+    return f"{os.path.basename(model_path)}@{int(os.path.getmtime(model_path))}-{int(os.path.getmtime(vect_path))}"
+
+def load_artifacts(model_dir=MODEL_DIR, mmap=False):
+    # (model, vect, version); mmap: tableaux numpy partagés entre processus via le cache de pages
+    version = registry.latest(os.path.join(model_dir, "registry"))
+    if version:
+        model, vect, _ = registry.load(version, os.path.join(model_dir, "registry"), mmap=mmap)
+        return model, vect, version
+    model_path, vect_path = find_artifacts(model_dir)
+    version = artifacts_version(model_dir)
+    mmap_mode = "r" if mmap else None
+    return joblib.load(model_path, mmap_mode=mmap_mode), joblib.load(vect_path, mmap_mode=mmap_mode), version
+
+def _default():
+    if not _loaded:
+        _loaded["model"], _loaded["vect"], version = load_artifacts()
+        _loaded["version"] = version
+        _loaded["cache"] = PredictionCache(version)
+    return _loaded
+
+def predict_batch(texts, model=None, vect=None):
+    # un seul vect.transform pour tout le lot; renvoie [(label, score)] (score None sans predict_proba)
+    if model is None:
+        model, vect = _default()["model"], _default()["vect"]
+    X = vect.transform(texts)
+    if hasattr(model, "predict_proba"):
+        proba = model.predict_proba(X)
+        best = proba.argmax(axis=1)
+        return [(str(model.classes_[b]), float(proba[i, b])) for i, b in enumerate(best)]
+    return [(str(label), None) for label in model.predict(X)]
+
+def predict_cached(texts, cache, model=None, vect=None):
+    # les textes déjà vus (même texte nettoyé, même version) ne sont pas revectorisés
+    return cache.lookup(texts, lambda missing: predict_batch(missing, model, vect))
 
 def predict(text):
-    X = vect.transform([text])
-    return model.predict(X)[0]
+    return predict_cached([text], _default()["cache"])[0][0]
 
 if __name__ == "__main__":
     sample = "J'adore ce produit, très pratique et bon service !"
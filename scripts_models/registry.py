@@ -0,0 +1,146 @@
+# scripts_models/registry.py
+# Registre des modèles: une version par entraînement, artefacts compacts et chargement déterministe.
+#   models/registry/v0003-rf/manifest.json   version, nom, métriques, snapshot des données
+#   models/registry/v0003-rf/...             artefacts (cf. ci-dessous)
+#   models/registry/LATEST                   version servie par apply_model / predict / serve
+# Format compact (chargement en quelques ms, tableaux memory-mappables):
+#   - TfidfVectorizer: paramètres JSON + vocabulaire (termes dans l'ordre des colonnes) + idf en .npy
+#   - HashingVectorizer: paramètres JSON seulement (sans état)
+#   - modèles linéaires (LogisticRegression, SGDClassifier): paramètres JSON + coef/intercept/classes en .npy
+#   - autres modèles (RandomForest...): joblib non compressé, relu avec mmap_mode="r"
+#   python -m scripts_models.registry            liste les versions
+import os, json, shutil, joblib
+from datetime import datetime, timezone
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+REGISTRY_DIR = os.path.join("models", "registry")
+LINEAR_MODELS = {"LogisticRegression": LogisticRegression, "SGDClassifier": SGDClassifier}
+VECTORIZERS = {"TfidfVectorizer": TfidfVectorizer, "HashingVectorizer": HashingVectorizer}
+
+def _json_params(est):
+    # seuls les paramètres simples sont sérialisables (dtype, tokenizer... gardent leur défaut)
+    return {k: v for k, v in est.get_params().items() if isinstance(v, (str, int, float, bool, list, tuple, type(None)))}
+
+def _from_params(cls, params):
+    params = dict(params)
+    if "ngram_range" in params:
+        params["ngram_range"] = tuple(params["ngram_range"])
+    return cls(**params)
+
+def _save_vectorizer(vect, path):
+    kind = type(vect).__name__
+    if kind not in VECTORIZERS:
+        joblib.dump(vect, os.path.join(path, "vectorizer.joblib"))
+        return {"kind": kind, "format": "joblib"}
+    if kind == "TfidfVectorizer":
+        np.save(os.path.join(path, "vocabulary.npy"), vect.get_feature_names_out().astype(str))
+        np.save(os.path.join(path, "idf.npy"), vect.idf_)
+    return {"kind": kind, "format": "compact", "params": _json_params(vect)}
+
+def _load_vectorizer(spec, path, mmap):
+    if spec["format"] == "joblib":
+        return joblib.load(os.path.join(path, "vectorizer.joblib"), mmap_mode="r" if mmap else None)
+    vect = _from_params(VECTORIZERS[spec["kind"]], spec["params"])
+    if spec["kind"] == "TfidfVectorizer":
+        terms = np.load(os.path.join(path, "vocabulary.npy"))
+        vect.vocabulary_ = dict(zip(terms.tolist(), range(len(terms))))
+        vect.idf_ = np.load(os.path.join(path, "idf.npy"))
+    return vect
+
+def _save_model(model, path):
+    kind = type(model).__name__
+    if kind not in LINEAR_MODELS:
+        joblib.dump(model, os.path.join(path, "model.joblib"))
+        return {"kind": kind, "format": "joblib"}
+    np.save(os.path.join(path, "coef.npy"), np.ascontiguousarray(model.coef_))
+    np.save(os.path.join(path, "intercept.npy"), model.intercept_)
+    np.save(os.path.join(path, "classes.npy"), model.classes_.astype(str))
+    return {"kind": kind, "format": "compact", "params": _json_params(model)}
+
+def _load_model(spec, path, mmap):
+    mmap_mode = "r" if mmap else None
+    if spec["format"] == "joblib":
+        return joblib.load(os.path.join(path, "model.joblib"), mmap_mode=mmap_mode)
+    model = _from_params(LINEAR_MODELS[spec["kind"]], spec["params"])
+    model.coef_ = np.load(os.path.join(path, "coef.npy"), mmap_mode=mmap_mode)
+    model.intercept_ = np.load(os.path.join(path, "intercept.npy"))
+    model.classes_ = np.load(os.path.join(path, "classes.npy"))
+    model.n_features_in_ = model.coef_.shape[1]
+    return model
+
+def versions(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(d for d in os.listdir(registry_dir)
+                  if d.startswith("v") and os.path.exists(os.path.join(registry_dir, d, "manifest.json")))
+
+def latest(registry_dir=REGISTRY_DIR):
+    """Version servie: celle de LATEST, sinon la plus récente; None si le registre est vide"""
+    pointer = os.path.join(registry_dir, "LATEST")
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+        if os.path.isdir(os.path.join(registry_dir, version)):
+            return version
+    found = versions(registry_dir)
+    return found[-1] if found else None
+
+def manifest(version, registry_dir=REGISTRY_DIR):
+    with open(os.path.join(registry_dir, version, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def register(model, vect, name, metrics=None, snapshot=None, registry_dir=REGISTRY_DIR, promote=True):
+    """Enregistre une nouvelle version (et la rend servie si promote); renvoie son identifiant"""
+    os.makedirs(registry_dir, exist_ok=True)
+    found = versions(registry_dir)
+    number = int(found[-1][1:5]) + 1 if found else 1
+    version = f"v{number:04d}-{name}"
+    tmp = os.path.join(registry_dir, f".tmp-{version}-{os.getpid()}")
+    os.makedirs(tmp)
+    info = {
+        "version": version,
+        "name": name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "metrics": metrics or {},
+        "snapshot": snapshot,
+        "vectorizer": _save_vectorizer(vect, tmp),
+        "model": _save_model(model, tmp),
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(registry_dir, version))
+    if promote:
+        promote_version(version, registry_dir)
+    print(f"[registry] version {version} enregistrée")
+    return version
+
+def promote_version(version, registry_dir=REGISTRY_DIR):
+    # LATEST réécrit atomiquement: les scorers voient l'ancienne ou la nouvelle version, jamais un mélange
+    tmp = os.path.join(registry_dir, f".LATEST-{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(registry_dir, "LATEST"))
+
+def load(version=None, registry_dir=REGISTRY_DIR, mmap=False):
+    """(model, vect, manifest) de la version demandée ou servie"""
+    version = version or latest(registry_dir)
+    if version is None:
+        raise FileNotFoundError("Registre de modèles vide. Entraîne d'abord.")
+    path = os.path.join(registry_dir, version)
+    info = manifest(version, registry_dir)
+    return _load_model(info["model"], path, mmap), _load_vectorizer(info["vectorizer"], path, mmap), info
+
+def remove(version, registry_dir=REGISTRY_DIR):
+    if version == latest(registry_dir):
+        raise ValueError(f"{version} est la version servie")
+    shutil.rmtree(os.path.join(registry_dir, version))
+
+if __name__ == "__main__":
+    current = latest()
+    for v in versions():
+        info = manifest(v)
+        metrics = ", ".join(f"{k}={val:.4f}" if isinstance(val, float) else f"{k}={val}"
+                            for k, val in info["metrics"].items())
+        print(f"{'*' if v == current else ' '} {v}  {info['created_at'][:19]}  {metrics}")
@@ -0,0 +1,208 @@
+# scripts_models/serve.py
+# Service local de prédiction de sentiment (artefacts chargés une fois, process long):
+#   python -m scripts_models.serve [--port 8700]
+#   POST /predict  {"text": "..."} ou {"texts": ["...", ...]}  -> {"predictions": [{"label", "score"}], "model": ...}
+#   GET  /metrics  latences p50/p90/p99, taille moyenne des lots, version du modèle
+#   GET  /health
+# Les requêtes concurrentes sont regroupées en micro-lots (un seul vect.transform par lot, textes
+# déjà vus servis par le cache de prédictions)
+# et le modèle est rechargé à chaud quand un nouveau best model est sauvegardé dans models/.
+import argparse, json, queue, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from config.settings import SERVE_HOST, SERVE_PORT, SERVE_MAX_BATCH, SERVE_MAX_WAIT_MS, SERVE_RELOAD_SECONDS
+from scripts_models import predict
+from scripts_models.cache import PredictionCache
+
+class Job:
+    def __init__(self, texts):
+        self.texts = texts
+        self.result = None
+        self.version = None
+        self.error = None
+        self.done = threading.Event()
+
+class Predictor:
+    """Artefacts + file d'attente de micro-batching + rechargement à chaud"""
+
+    def __init__(self, model_dir=predict.MODEL_DIR, max_batch=SERVE_MAX_BATCH, max_wait_ms=SERVE_MAX_WAIT_MS,
+                 reload_seconds=SERVE_RELOAD_SECONDS):
+        self.model_dir = model_dir
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.reload_seconds = reload_seconds
+        # (model, vect, version, cache) remplacé d'un bloc: un lot en cours garde ses artefacts
+        self.artifacts = self._load()
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=10000)
+        self.requests = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.reloads = 0
+        self.stopped = threading.Event()
+
+    def _load(self):
+        # un cache par version: un nouveau modèle repart d'un cache vide
+        model, vect, version = predict.load_artifacts(self.model_dir)
+        return model, vect, version, PredictionCache(version)
+
+    def start(self):
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        if self.reload_seconds:
+            threading.Thread(target=self._reload_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def submit(self, texts, timeout=30):
+        start = time.perf_counter()
+        job = Job(texts)
+        self.jobs.put(job)
+        if not job.done.wait(timeout):
+            raise TimeoutError("prédiction trop lente")
+        if job.error:
+            raise job.error
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(time.perf_counter() - start)
+        return job.result, job.version
+
+    def _collect(self):
+        # attend une première requête puis complète le lot jusqu'à max_batch textes ou max_wait
+        jobs = [self.jobs.get()]
+        n = len(jobs[0].texts)
+        deadline = time.perf_counter() + self.max_wait
+        while n < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            n += len(job.texts)
+        return jobs
+
+    def _batch_loop(self):
+        while not self.stopped.is_set():
+            jobs = self._collect()
+            model, vect, version, cache = self.artifacts
+            texts = [t for job in jobs for t in job.texts]
+            try:
+                preds = predict.predict_cached(texts, cache, model, vect)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+                    job.done.set()
+                continue
+            i = 0
+            for job in jobs:
+                job.result = preds[i:i + len(job.texts)]
+                job.version = version
+                i += len(job.texts)
+                job.done.set()
+            with self.lock:
+                self.batches += 1
+                self.batched_texts += len(texts)
+
+    def _reload_loop(self):
+        while not self.stopped.wait(self.reload_seconds):
+            try:
+                if predict.artifacts_version(self.model_dir) != self.artifacts[2]:
+                    self.artifacts = self._load()
+                    self.reloads += 1
+                    print(f"[serve] modèle rechargé: {self.artifacts[2]}")
+            except (OSError, EOFError) as e:
+                # artefacts en cours d'écriture: on réessaie au prochain tour
+                print(f"[serve] rechargement reporté: {e}")
+
+    def metrics(self):
+        with self.lock:
+            lat = np.array(self.latencies) * 1000
+            out = {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else 0,
+                "queue_size": self.jobs.qsize(),
+                "reloads": self.reloads,
+                "model": self.artifacts[2],
+                "cache": self.artifacts[3].stats(),
+            }
+        if len(lat):
+            for p in (50, 90, 99):
+                out[f"p{p}_ms"] = round(float(np.percentile(lat, p)), 3)
+        return out
+
+class Handler(BaseHTTPRequestHandler):
+    predictor = None
+    protocol_version = "HTTP/1.1"
+    # en-têtes et corps partent en deux écritures: sans TCP_NODELAY, ~40ms d'ACK retardé par réponse
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send(200, self.predictor.metrics())
+        elif self.path == "/health":
+            self._send(200, {"status": "ok", "model": self.predictor.artifacts[2]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            texts = body["texts"] if "texts" in body else [body["text"]]
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {"error": "attendu: {\"text\": str} ou {\"texts\": [str]}"})
+            return
+        try:
+            preds, version = self.predictor.submit(texts) if texts else ([], self.predictor.artifacts[2])
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+        # version du modèle qui a réellement produit ces prédictions (même pendant un rechargement)
+        self._send(200, {"predictions": [{"label": l, "score": s} for l, s in preds], "model": version})
+
+def serve(host=SERVE_HOST, port=SERVE_PORT, model_dir=predict.MODEL_DIR, background=False, **kwargs):
+    predictor = Predictor(model_dir, **kwargs).start()
+    handler = type("BoundHandler", (Handler,), {"predictor": predictor})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"[serve] http://{host}:{server.server_port} (modèle {predictor.artifacts[2]})")
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, predictor
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        predictor.stop()
+        server.server_close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    ap.add_argument("--model-dir", default=predict.MODEL_DIR)
+    a = ap.parse_args()
+    serve(a.host, a.port, a.model_dir)
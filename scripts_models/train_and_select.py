@@ -1,80 +1,140 @@
 # scripts_models/train_and_select.py
-import os, joblib
-import pandas as pd
+import os, json, time, shutil, hashlib, joblib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.base import clone
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import f1_score, classification_report
-import psycopg2
-from sqlalchemy import create_engine
+from sklearn.model_selection import train_test_split, StratifiedKFold
+from sklearn.metrics import f1_score, accuracy_score, classification_report
 from textblob import TextBlob
-from config.settings import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from config.settings import PREDICTION_CACHE_PERSIST
+from etl import columnar, db, instrumentation, partitions
+from scripts_models import registry
+from scripts_models.apply_model import NESTED_LOOP_SQL
+from scripts_models.cache import PredictionCache, TEXTBLOB_VERSION
 
 MODEL_DIR = "models"
-os.makedirs(MODEL_DIR, exist_ok=True)
+PROC_DIR = "data/processed"
+FEATURES_DIR = os.path.join(MODEL_DIR, "features")  # créé à la première écriture (get_features)
 
-def create_engine_connection():
-    """Créer une connexion SQLAlchemy pour pandas"""
-    connection_string = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    return create_engine(connection_string)
+def get_sentiment_label(text):
+    """Label faible TextBlob: positif / negatif / neutre"""
+    try:
+        blob = TextBlob(text)
+        polarity = blob.sentiment.polarity
+        if polarity > 0.1:
+            return 'positif'
+        elif polarity < -0.1:
+            return 'negatif'
+        else:
+            return 'neutre'
+    except:
+        return 'neutre'
 
-def generate_sentiment_labels():
-    """Générer des labels de sentiment automatiquement avec TextBlob"""
-    engine = create_engine_connection()
-    
-    # Récupérer tous les textes sans labels
-    query = """
-    SELECT id, text 
-    FROM flat_texts 
-    WHERE text IS NOT NULL 
-    AND text != '' 
-    AND (sentiment_label IS NULL OR sentiment_label = '')
-    """
-    
-    df = pd.read_sql_query(query, engine)
-    print(f"Génération de labels pour {len(df)} textes...")
-    
-    # Générer les labels avec TextBlob
-    def get_sentiment_label(text):
+# même prédicat que l'index partiel idx_flat_texts_unlabeled (sentiment_label = '' exclu par le CHECK)
+UNLABELED_SQL = """
+    SELECT id, text, created_time
+    FROM flat_texts
+    WHERE sentiment_label IS NULL
+    AND text != ''
+"""
+
+UPDATE_LABELS_SQL = """
+    UPDATE flat_texts AS f
+    SET sentiment_label = v.label, labeled_at = now()
+    FROM (VALUES %s) AS v(id, label, created_time)
+    WHERE f.id = v.id::uuid
+"""
+# table partitionnée: date dans la clé, une seule partition sondée par ligne (cf. apply_model)
+UPDATE_LABELS_PARTITIONED_SQL = NESTED_LOOP_SQL + UPDATE_LABELS_SQL + "    AND f.created_time = v.created_time\n"
+
+def _label_chunk(texts):
+    """Worker: labels TextBlob d'un morceau de textes distincts"""
+    return [(get_sentiment_label(t), None) for t in texts]
+
+def _label_parallel(pool, texts, workers):
+    # textes distincts manquants répartis en morceaux, un par worker (ou plus pour équilibrer)
+    with instrumentation.timed("labels.textblob"):
+        if pool is None or len(texts) < 2 * workers:
+            return _label_chunk(texts)
+        size = -(-len(texts) // (workers * 4))
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        return [v for part in pool.map(_label_chunk, chunks) for v in part]
+
+def label_texts(texts, cache=None, pool=None, workers=1):
+    """Labels TextBlob, une seule fois par texte distinct (cache par contenu)"""
+    report = cache is None
+    cache = cache or PredictionCache(TEXTBLOB_VERSION)
+    values = cache.lookup(list(texts), lambda missing: _label_parallel(pool, missing, workers))
+    if report:
+        cache.report("labels")
+    return [label for label, _ in values]
+
+def generate_sentiment_labels(chunk_size=20000, workers=None):
+    """Générer des labels de sentiment automatiquement avec TextBlob.
+    Lecture en streaming (curseur serveur), labels calculés en parallèle par morceaux, écrits par UPDATE
+    ensembliste et commités à chaque morceau: un run interrompu reprend là où il s'était arrêté."""
+    with instrumentation.stage("labels") as st:
+        workers = workers or os.cpu_count()
+        # textes à labelliser lus sur la réplique si configurée, labels écrits sur le primaire
+        with db.connection(readonly=True) as read_conn, db.connection() as write_conn:
+            cur = read_conn.cursor()
+            cur.execute(f"SELECT COUNT(*) FROM ({UNLABELED_SQL}) t")
+            todo = cur.fetchone()[0]
+            cur.close()
+            print(f"Génération de labels pour {todo} textes ({workers} workers)...")
+            st.rows_in = todo
+
+            # textes déjà labellisés (ce run, un run précédent ou une autre ligne identique) servis par le cache
+            cache = PredictionCache(TEXTBLOB_VERSION, conn=write_conn if PREDICTION_CACHE_PERSIST else None)
+            counts = {}
+            done = 0
+            start = time.time()
+            update_sql = UPDATE_LABELS_PARTITIONED_SQL if partitions.is_partitioned(write_conn) else UPDATE_LABELS_SQL
+            pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            try:
+                for rows in db.iter_chunks(read_conn, UNLABELED_SQL, chunk_size=chunk_size, name="unlabeled_texts"):
+                    labels = label_texts([r[1] for r in rows], cache, pool, workers)
+                    db.write_values(write_conn, update_sql, [(r[0], label, r[2]) for r, label in zip(rows, labels)],
+                                    template="(%s, %s, %s::timestamptz)", chunk_size=len(rows))
+                    for label in labels:
+                        counts[label] = counts.get(label, 0) + 1
+                    done += len(rows)
+                    elapsed = max(time.time() - start, 1e-9)
+                    eta = (todo - done) / (done / elapsed) if done < todo else 0
+                    print(f"[labels] {done}/{todo} textes ({done / elapsed:.0f} textes/s, reste ~{eta:.0f}s)")
+            finally:
+                if pool:
+                    pool.shutdown()
+
+        cache.report("labels")
+        print(f"Labels générés: {counts}")
+        st.rows_out = done
+        st.extra.update(workers=workers, labels=counts, cache=cache.stats())
+        return counts
+
+def fetch_labeled_texts(limit=None, source="db", readonly=True):
+    """Récupérer les textes avec labels (source="parquet": dataset flat_texts local, labels TextBlob;
+    readonly=False: lecture sur le primaire, pour voir des labels qui viennent d'être écrits)"""
+    if source != "db":
+        # seule la colonne text est lue; les labels faibles sont recalculés sans passer par la base
+        df = columnar.read_table("flat_texts", PROC_DIR, columns=["source_id", "text"])
+        df = df[df['text'].notna() & (df['text'] != '')].rename(columns={'source_id': 'id'})
+        if limit:
+            df = df.head(limit)
+        workers = os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
         try:
-            blob = TextBlob(text)
-            polarity = blob.sentiment.polarity
-            if polarity > 0.1:
-                return 'positif'
-            elif polarity < -0.1:
-                return 'negatif'
-            else:
-                return 'neutre'
-        except:
-            return 'neutre'
-    
-    df['sentiment_label'] = df['text'].apply(get_sentiment_label)
-    
-    # Mettre à jour la base de données
-    conn = psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, 
-        user=DB_USER, password=DB_PASS
-    )
-    cur = conn.cursor()
-    
-    for _, row in df.iterrows():
-        cur.execute(
-            "UPDATE flat_texts SET sentiment_label = %s WHERE id = %s",
-            (row['sentiment_label'], row['id'])
-        )
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
-    print(f"Labels générés: {df['sentiment_label'].value_counts().to_dict()}")
-    return df
+            df['sentiment_label'] = label_texts(df['text'], pool=pool, workers=workers)
+        finally:
+            if pool:
+                pool.shutdown()
+        return df.reset_index(drop=True)
 
-def fetch_labeled_texts(limit=None):
-    """Récupérer les textes avec labels"""
-    engine = create_engine_connection()
-    
     query = """
     SELECT id, text, sentiment_label 
     FROM flat_texts 
@@ -87,116 +147,197 @@ def fetch_labeled_texts(limit=None):
     if limit:
         query += f" LIMIT {limit}"
     
-    df = pd.read_sql_query(query, engine)
-    return df
+    return db.read_frame(query, readonly=readonly)
 
-def train_and_select():
-    """Entraîner et sélectionner le meilleur modèle"""
-    # D'abord, générer les labels si nécessaire
-    df_check = fetch_labeled_texts()
-    
-    if df_check.empty or df_check['sentiment_label'].nunique() < 2:
-        print("Pas assez de labels existants. Génération automatique...")
-        generate_sentiment_labels()
-        df = fetch_labeled_texts()
-    else:
-        df = df_check
-    
-    if df.empty or df['sentiment_label'].nunique() < 2:
-        print("Impossible de créer des labels de sentiment.")
-        return
-    
-    print(f"Entraînement avec {len(df)} textes")
-    print(f"Distribution: {df['sentiment_label'].value_counts().to_dict()}")
-    
-    X = df['text'].fillna('')
-    y = df['sentiment_label']
-    
-    # Vérifier qu'on a assez d'exemples par classe
-    min_class_size = y.value_counts().min()
-    if min_class_size < 2:
-        print(f"Pas assez d'exemples par classe (min: {min_class_size})")
-        return
-    
-    # Split stratifié
-    test_size = min(0.3, max(0.1, min_class_size * 0.3 / len(df)))
+# Paramètres du vectorizer et du split: font partie de la clé du cache de features
+VECT_PARAMS = {"ngram_range": (1, 2), "max_features": 5000, "stop_words": "english"}  # 5000: petits datasets
+SPLIT_SEED = 42
+FEATURES_KEEP = 3  # snapshots de features conservés sur disque
+
+def make_candidates():
+    """Modèles candidats (rf mono-thread: le parallélisme se fait entre candidats et plis)"""
+    return {
+        'logreg': LogisticRegression(max_iter=1000, random_state=42),
+        'rf': RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=1)
+    }
+
+def snapshot_key(df, test_size):
+    """Empreinte du corpus labellisé (ids, labels, textes) et des paramètres de vectorisation"""
+    h = hashlib.sha1(json.dumps({"vect": VECT_PARAMS, "test_size": test_size, "seed": SPLIT_SEED},
+                                sort_keys=True).encode())
+    for i, t, l in zip(df['id'].astype(str), df['text'], df['sentiment_label']):
+        h.update(f"{i}\x00{l}\x00{t}\x01".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def _prune_features(keep=FEATURES_KEEP):
+    snapshots = sorted((os.path.join(FEATURES_DIR, d) for d in os.listdir(FEATURES_DIR)), key=os.path.getmtime)
+    for path in snapshots[:-keep]:
+        shutil.rmtree(path, ignore_errors=True)
+
+def get_features(df, test_size):
+    """Split + TF-IDF, mis en cache sur disque (matrices creuses .npz) par snapshot du corpus labellisé"""
+    key = snapshot_key(df, test_size)
+    path = os.path.join(FEATURES_DIR, key)
+    if os.path.isdir(path):
+        print(f"Features en cache: {path}")
+        os.utime(path)
+        return (joblib.load(os.path.join(path, "vectorizer.joblib")),
+                sparse.load_npz(os.path.join(path, "X_train.npz")), sparse.load_npz(os.path.join(path, "X_test.npz")),
+                np.load(os.path.join(path, "y_train.npy")), np.load(os.path.join(path, "y_test.npy")))
+
+    start = time.time()
     X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=test_size, stratify=y, random_state=42
-    )
-    
-    # Vectorisation
-    vect = TfidfVectorizer(
-        ngram_range=(1,2), 
-        max_features=5000,  # Réduit pour les petits datasets
-        stop_words='english'
+        df['text'], df['sentiment_label'], test_size=test_size, stratify=df['sentiment_label'], random_state=SPLIT_SEED
     )
+    vect = TfidfVectorizer(**VECT_PARAMS)
     X_train_t = vect.fit_transform(X_train)
     X_test_t = vect.transform(X_test)
-    
-    # Modèles candidats
-    candidates = {
-        'logreg': LogisticRegression(max_iter=1000, random_state=42),
-        'rf': RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
-    }
-    
-    best_name, best_score, best_model = None, -1, None
-    
-    for name, model in candidates.items():
-        print(f"\nEntraînement {name}...")
-        model.fit(X_train_t, y_train)
-        preds = model.predict(X_test_t)
-        
-        # Calculer les métriques
-        score = f1_score(y_test, preds, average='macro')
-        print(f"{name} f1_macro={score:.4f}")
-        print(classification_report(y_test, preds))
-        
-        if score > best_score:
-            best_score = score
-            best_model = model
-            best_name = name
-    
-    print(f"\nMeilleur modèle: {best_name} (f1_macro={best_score:.4f})")
-    
-    # Sauvegarder le meilleur modèle
-    model_path = os.path.join(MODEL_DIR, f"best_model_{best_name}.joblib")
-    vect_path = os.path.join(MODEL_DIR, "vectorizer.joblib")
-    
-    joblib.dump(best_model, model_path)
-    joblib.dump(vect, vect_path)
-    
-    print(f"Modèle sauvé: {model_path}")
-    print(f"Vectorizer sauvé: {vect_path}")
-    
-    # Enregistrer les performances
-    save_model_performance(best_name, best_score, y_test, model.predict(X_test_t))
-    
-    return best_model, vect
+    y_train, y_test = y_train.to_numpy(dtype=str), y_test.to_numpy(dtype=str)
+
+    # écrit dans un dossier temporaire puis renommé: un snapshot présent est toujours complet
+    tmp = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)  # FEATURES_DIR compris
+    joblib.dump(vect, os.path.join(tmp, "vectorizer.joblib"))
+    sparse.save_npz(os.path.join(tmp, "X_train.npz"), X_train_t)
+    sparse.save_npz(os.path.join(tmp, "X_test.npz"), X_test_t)
+    np.save(os.path.join(tmp, "y_train.npy"), y_train)
+    np.save(os.path.join(tmp, "y_test.npy"), y_test)
+    os.replace(tmp, path)
+    _prune_features()
+    print(f"Vectorisation: {time.time() - start:.1f}s (features sauvées: {path})")
+    return vect, X_train_t, X_test_t, y_train, y_test
+
+def _fit_candidate(name, model, X_train, y_train, X_test):
+    start = time.time()
+    model.fit(X_train, y_train)
+    return name, model, model.predict(X_test), time.time() - start
+
+def _cv_fold(name, model, X, y, train_idx, val_idx):
+    model = clone(model).fit(X[train_idx], y[train_idx])
+    return name, f1_score(y[val_idx], model.predict(X[val_idx]), average='macro')
+
+def train_and_select(source="db", cv=0, n_jobs=-1):
+    """Entraîner et sélectionner le meilleur modèle (cv>1: sélection par validation croisée à cv plis)"""
+    with instrumentation.stage("train") as st:
+        # D'abord, générer les labels si nécessaire
+        df_check = fetch_labeled_texts(source=source)
+
+        if df_check.empty or df_check['sentiment_label'].nunique() < 2:
+            print("Pas assez de labels existants. Génération automatique...")
+            generate_sentiment_labels()
+            # labels tout juste écrits: la réplique peut ne pas les avoir encore
+            df = fetch_labeled_texts(readonly=False)
+        else:
+            df = df_check
+
+        if df.empty or df['sentiment_label'].nunique() < 2:
+            print("Impossible de créer des labels de sentiment.")
+            return
 
-def save_model_performance(model_name, f1_score, y_true, y_pred):
+        print(f"Entraînement avec {len(df)} textes")
+        st.rows_in = len(df)
+        print(f"Distribution: {df['sentiment_label'].value_counts().to_dict()}")
+
+        # ordre stable (la requête ne l'est pas): même corpus -> même split -> même clé de cache
+        df = df.assign(text=df['text'].fillna(''), id=df['id'].astype(str)).sort_values('id').reset_index(drop=True)
+        y = df['sentiment_label']
+
+        # Vérifier qu'on a assez d'exemples par classe
+        min_class_size = y.value_counts().min()
+        if min_class_size < 2:
+            print(f"Pas assez d'exemples par classe (min: {min_class_size})")
+            return
+
+        # Split stratifié + vectorisation (ou relecture du cache)
+        test_size = min(0.3, max(0.1, min_class_size * 0.3 / len(df)))
+        with instrumentation.timed("train.features"):
+            vect, X_train_t, X_test_t, y_train, y_test = get_features(df, test_size)
+
+        # Modèles candidats, entraînés en parallèle
+        candidates = make_candidates()
+        parallel = Parallel(n_jobs=n_jobs)
+
+        cv_scores = {}
+        if cv and cv > 1:
+            # plis de tous les candidats dans le même pool
+            folds = StratifiedKFold(n_splits=min(cv, int(np.unique(y_train, return_counts=True)[1].min())),
+                                    shuffle=True, random_state=SPLIT_SEED).split(X_train_t, y_train)
+            folds = list(folds)
+            print(f"\nValidation croisée ({len(folds)} plis x {len(candidates)} candidats)...")
+            with instrumentation.timed("train.cv"):
+                for name, score in parallel(delayed(_cv_fold)(name, model, X_train_t, y_train, tr, va)
+                                            for name, model in candidates.items() for tr, va in folds):
+                    cv_scores.setdefault(name, []).append(score)
+            cv_scores = {name: float(np.mean(scores)) for name, scores in cv_scores.items()}
+
+        print(f"\nEntraînement {', '.join(candidates)}...")
+        with instrumentation.timed("train.fit"):
+            results = parallel(delayed(_fit_candidate)(name, model, X_train_t, y_train, X_test_t)
+                               for name, model in candidates.items())
+
+        best_name, best_score, best_model, best_metrics = None, -1, None, None
+
+        for name, model, preds, training_time in results:
+            # Calculer les métriques
+            score = f1_score(y_test, preds, average='macro')
+            selection = cv_scores.get(name, score)
+            cv_info = f" cv_f1={selection:.4f}" if cv_scores else ""
+            print(f"\n{name} f1_macro={score:.4f}{cv_info} ({training_time:.1f}s)")
+            print(classification_report(y_test, preds))
+
+            # Enregistrer les performances de chaque candidat
+            save_model_performance(name, score, y_test, preds, training_samples=X_train_t.shape[0],
+                                   training_time=training_time)
+
+            if selection > best_score:
+                best_score = selection
+                best_model = model
+                best_name = name
+                best_metrics = {
+                    "f1_macro": float(score),
+                    "accuracy": float(accuracy_score(y_test, preds)),
+                    "training_samples": int(X_train_t.shape[0]),
+                    "training_time": round(training_time, 3),
+                }
+                if cv_scores:
+                    best_metrics["cv_f1"] = selection
+
+        print(f"\nMeilleur modèle: {best_name} ({'cv_f1' if cv_scores else 'f1_macro'}={best_score:.4f})")
+
+        # Enregistrer le meilleur modèle dans le registre (nouvelle version servie)
+        version = registry.register(best_model, vect, best_name, best_metrics,
+                                    snapshot={"key": snapshot_key(df, test_size), "rows": len(df)},
+                                    registry_dir=os.path.join(MODEL_DIR, "registry"))
+        print(f"Modèle sauvé: {os.path.join(MODEL_DIR, 'registry', version)}")
+        st.rows_out = int(X_train_t.shape[0])
+        st.extra.update(model=best_name, model_version=version, f1_macro=best_metrics["f1_macro"])
+
+        return best_model, vect
+
+def save_model_performance(model_name, f1_score, y_true, y_pred, training_samples=None, training_time=None):
     """Sauvegarder les performances du modèle"""
     from sklearn.metrics import accuracy_score, precision_score, recall_score
     
-    conn = psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, 
-        user=DB_USER, password=DB_PASS
-    )
-    cur = conn.cursor()
-    
     accuracy = accuracy_score(y_true, y_pred)
-    precision = precision_score(y_true, y_pred, average='macro')
-    recall = recall_score(y_true, y_pred, average='macro')
-    
-    cur.execute("""
-        INSERT INTO model_performance (model_name, accuracy, f1_macro, precision, recall)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (model_name, accuracy, f1_score, precision, recall))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
+    recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
+    
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO model_performance (model_name, accuracy, f1_macro, precision, recall, training_samples, training_time)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (model_name, accuracy, f1_score, precision, recall, training_samples, training_time))
+        conn.commit()
+        cur.close()
     
     print(f"Performances sauvées: acc={accuracy:.4f}, f1={f1_score:.4f}")
 
 if __name__ == "__main__":
-    train_and_select()
\ No newline at end of file
+    import sys
+    with instrumentation.run("train_and_select"):
+        train_and_select(
+            source="parquet" if "--parquet" in sys.argv else "db",
+            cv=int(sys.argv[sys.argv.index("--cv") + 1]) if "--cv" in sys.argv else 0,
+            n_jobs=int(sys.argv[sys.argv.index("--jobs") + 1]) if "--jobs" in sys.argv else -1,
+        )
\ No newline at end of file
@@ -0,0 +1,141 @@
+# scripts_models/train_online.py
+# Entraînement incrémental: HashingVectorizer (sans état, pas de vocabulaire à réapprendre) +
+# SGDClassifier.partial_fit, sur les seules lignes labellisées depuis le dernier run (flat_texts.labeled_at,
+# que seul le labelling écrit: une prédiction ou des likes modifiés ne font pas réapprendre une ligne).
+#   python -m scripts_models.train_online [--full] [--publish]
+# --full: repart de zéro (modèle et watermark), --publish: enregistre le modèle comme nouvelle version
+# du registre (scripts_models/registry.py), reprise à chaud par serve.py.
+# Chaque morceau est d'abord évalué puis appris (validation progressive): les métriques portent
+# toujours sur des textes que le modèle n'a pas encore vus.
+import os, json, time, joblib
+from datetime import datetime, timezone
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import accuracy_score, f1_score
+from etl import db, instrumentation
+from etl.aggregates import OPEN_XACT_WATERMARK
+from scripts_models import registry
+from scripts_models.train_and_select import save_model_performance
+
+MODEL_DIR = "models"
+ONLINE_DIR = os.path.join(MODEL_DIR, "online")
+STATE_FILE = os.path.join(ONLINE_DIR, "state.json")
+CLASSES = np.array(["negatif", "neutre", "positif"])
+CHUNK_SIZE = 20000
+EPOCH = "1970-01-01T00:00:00+00:00"
+
+# labeled_at vaut le début de la transaction de labelling: comme pour les agrégats, la borne haute est le
+# début de la plus ancienne transaction encore ouverte, une transaction qui committe plus tard est vue au
+# run suivant. Intervalle [labeled_at précédent, borne): chaque labelling appris une seule fois
+LABELED_UNTIL_SQL = f"SELECT {OPEN_XACT_WATERMARK}"
+LABELED_SINCE_SQL = """
+    SELECT id::text, text, sentiment_label
+    FROM flat_texts
+    WHERE text IS NOT NULL AND text != ''
+    AND sentiment_label IN ('positif', 'negatif', 'neutre')
+    AND labeled_at >= %s AND labeled_at < %s
+    ORDER BY labeled_at, id
+"""
+
+def make_vectorizer():
+    # 2^20 colonnes: collisions négligeables pour des commentaires courts, matrice creuse
+    return HashingVectorizer(ngram_range=(1, 2), n_features=2 ** 20, alternate_sign=False, norm="l2")
+
+def make_model():
+    # log_loss: predict_proba disponible pour apply_model / serve (predicted_score)
+    return SGDClassifier(loss="log_loss", alpha=1e-6, random_state=42)
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {"labeled_at": EPOCH, "samples": 0}
+    with open(STATE_FILE, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    # ancien watermark (updated_at, id): labeled_at a été repris de updated_at à la migration
+    if "labeled_at" not in state:
+        state["labeled_at"] = state.pop("updated_at", EPOCH)
+        state.pop("last_id", None)
+    return state
+
+def _dump(obj, path):
+    # écriture atomique: un run interrompu laisse la version précédente intacte
+    tmp = f"{path}.tmp"
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
+
+def save(model, vect, state):
+    os.makedirs(ONLINE_DIR, exist_ok=True)
+    _dump(model, os.path.join(ONLINE_DIR, "sgd.joblib"))
+    _dump(vect, os.path.join(ONLINE_DIR, "vectorizer.joblib"))
+    tmp = f"{STATE_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_FILE)
+
+def load_model():
+    path = os.path.join(ONLINE_DIR, "sgd.joblib")
+    if os.path.exists(path):
+        return joblib.load(path)
+    return make_model()
+
+def partial_train(model, vect, chunks):
+    """Validation progressive puis partial_fit sur chaque morceau (textes, labels).
+    Renvoie (vrais labels, prédictions avant apprentissage, nombre de textes appris)."""
+    y_true, y_pred, n = [], [], 0
+    for texts, labels in chunks:
+        X = vect.transform(texts)
+        if hasattr(model, "classes_"):
+            y_true.extend(labels)
+            y_pred.extend(model.predict(X))
+        model.partial_fit(X, labels, classes=CLASSES)
+        n += len(texts)
+    return y_true, y_pred, n
+
+def iter_labeled_since(conn, state, chunk_size=CHUNK_SIZE):
+    # curseur serveur sur [state["labeled_at"], borne); state["labeled_at"] passe à la borne une fois tout lu
+    cur = conn.cursor()
+    cur.execute(LABELED_UNTIL_SQL)
+    until = cur.fetchone()[0]
+    cur.close()
+    for rows in db.iter_chunks(conn, LABELED_SINCE_SQL, (state["labeled_at"], until), chunk_size,
+                               name="labeled_since"):
+        yield [r[1] for r in rows], [r[2] for r in rows]
+    state["labeled_at"] = until.isoformat()
+
+def train_online(full=False, publish=False, chunk_size=CHUNK_SIZE):
+    with instrumentation.stage("train_online") as st:
+        state = {"labeled_at": EPOCH, "samples": 0} if full else load_state()
+        model = make_model() if full else load_model()
+        vect = make_vectorizer()
+        start = time.time()
+        # primaire: pg_stat_activity d'une réplique ne montre pas les transactions de labelling en cours
+        with db.connection() as conn:
+            y_true, y_pred, n = partial_train(model, vect, iter_labeled_since(conn, state, chunk_size))
+        elapsed = time.time() - start
+        st.rows_in = st.rows_out = n
+        if not n:
+            print("[train_online] Rien de nouveau depuis le dernier entraînement.")
+            return model, vect
+
+        state["samples"] += n
+        state["trained_at"] = datetime.now(timezone.utc).isoformat()
+        save(model, vect, state)
+        print(f"[train_online] {n} nouveaux textes appris en {elapsed:.1f}s ({state['samples']} au total)")
+        if y_true:
+            acc = accuracy_score(y_true, y_pred)
+            f1 = f1_score(y_true, y_pred, average="macro")
+            print(f"[train_online] validation progressive: acc={acc:.4f}, f1_macro={f1:.4f}")
+            save_model_performance("sgd_online", f1, y_true, y_pred, training_samples=state["samples"],
+                                   training_time=elapsed)
+        if publish:
+            metrics = {"training_samples": state["samples"], "training_time": round(elapsed, 3)}
+            if y_true:
+                metrics.update({"accuracy": float(acc), "f1_macro": float(f1)})
+            registry.register(model, vect, "online", metrics, snapshot={"labeled_at": state["labeled_at"]},
+                              registry_dir=os.path.join(MODEL_DIR, "registry"))
+        return model, vect
+
+if __name__ == "__main__":
+    import sys
+    with instrumentation.run("train_online"):
+        train_online(full="--full" in sys.argv, publish="--publish" in sys.argv)
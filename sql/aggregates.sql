@@ -0,0 +1,48 @@
+-- sql/aggregates.sql - Agrégats matérialisés lus par les vues Power BI (sql/vue.sql)
+-- Maintenus incrémentalement par etl/aggregates.py après load / apply_model: seules les clés
+-- (post, jour) et (utilisateur, jour) touchées depuis le dernier rafraîchissement sont recalculées.
+-- Le sentiment est une dimension ('non_analysé' si pas encore prédit): toutes les vues restent exactes.
+-- Les textes sans date sont rangés au jour '-infinity'.
+
+-- Par post, jour et sentiment
+CREATE TABLE IF NOT EXISTS agg_post_daily (
+    post_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    sentiment TEXT NOT NULL,
+    n_total INT NOT NULL,          -- lignes flat_texts (post + commentaires + réponses)
+    n_text INT NOT NULL,           -- dont texte non vide
+    n_post INT NOT NULL,           -- dont légende du post (source_type = 'post')
+    n_comments INT NOT NULL,       -- dont commentaires et réponses
+    like_sum BIGINT NOT NULL,
+    PRIMARY KEY (post_id, day, sentiment)
+);
+CREATE INDEX IF NOT EXISTS idx_agg_post_daily_day ON agg_post_daily(day);
+
+-- Par utilisateur, jour et sentiment (commentaires et réponses seulement)
+CREATE TABLE IF NOT EXISTS agg_user_daily (
+    username TEXT NOT NULL,
+    day DATE NOT NULL,
+    sentiment TEXT NOT NULL,
+    n_total INT NOT NULL,
+    like_sum BIGINT NOT NULL,
+    PRIMARY KEY (username, day, sentiment)
+);
+
+-- Émojis par post et jour (mêmes clés à recalculer que agg_post_daily)
+CREATE TABLE IF NOT EXISTS agg_emoji_daily (
+    post_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    emoji TEXT NOT NULL,
+    usage_count BIGINT NOT NULL,
+    PRIMARY KEY (post_id, day, emoji)
+);
+
+-- Watermark du dernier rafraîchissement (une seule ligne)
+CREATE TABLE IF NOT EXISTS agg_refresh_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    refreshed_at TIMESTAMPTZ NOT NULL
+);
+
+-- Détection des lignes modifiées et recalcul par clé
+CREATE INDEX IF NOT EXISTS idx_flat_texts_updated_at ON flat_texts(updated_at);
+CREATE INDEX IF NOT EXISTS idx_flat_texts_username ON flat_texts(username);
@@ -46,6 +46,40 @@ CREATE TABLE IF NOT EXISTS flat_texts (
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- version du registre de modèles (scripts_models/registry.py) qui a produit predicted_sentiment
+ALTER TABLE flat_texts ADD COLUMN IF NOT EXISTS model_version TEXT;
+
+-- moment du labelling (début de la transaction qui a écrit sentiment_label), remis à NULL avec le label:
+-- curseur de l'entraînement incrémental (scripts_models/train_online.py), que les autres écritures
+-- (prédictions, likes) ne déplacent pas. Base existante: repris une fois de updated_at
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = 'flat_texts'::regclass AND attname = 'labeled_at' AND NOT attisdropped) THEN
+        ALTER TABLE flat_texts ADD COLUMN labeled_at TIMESTAMPTZ;
+        UPDATE flat_texts SET labeled_at = updated_at WHERE sentiment_label IS NOT NULL;
+    END IF;
+END $$;
+
+-- Émojis par texte, forme normalisée de flat_texts.emoji_summary (remplie au chargement par etl/load.py,
+-- reconstruite par python -m etl.emojis): les analyses par émoji lisent un index au lieu de déplier le JSONB
+CREATE TABLE IF NOT EXISTS text_emojis (
+    flat_text_id UUID NOT NULL REFERENCES flat_texts(id) ON DELETE CASCADE,
+    emoji TEXT NOT NULL,
+    count INT NOT NULL,
+    PRIMARY KEY (flat_text_id, emoji)
+);
+CREATE INDEX IF NOT EXISTS idx_text_emojis_emoji ON text_emojis(emoji) INCLUDE (count);
+
+-- Cache des prédictions / labels par contenu (clé = sha1(version + texte nettoyé), cf. scripts_models/cache.py)
+CREATE TABLE IF NOT EXISTS prediction_cache (
+    key TEXT PRIMARY KEY,
+    model_version TEXT NOT NULL,
+    label TEXT NOT NULL,
+    score FLOAT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 -- Table pour stocker les performances des modèles
 CREATE TABLE IF NOT EXISTS model_performance (
     id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
@@ -57,6 +91,24 @@ CREATE TABLE IF NOT EXISTS model_performance (
     training_samples INT,
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
+-- durée d'entraînement par candidat (secondes), ajoutée après coup
+ALTER TABLE model_performance ADD COLUMN IF NOT EXISTS training_time FLOAT;
+
+-- Runs du pipeline et des scripts modèles (etl/instrumentation.py): une entrée par étape dans stages
+-- (temps, lignes, requêtes HTTP, allers-retours base, mémoire)
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+    run_id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    status TEXT CHECK (status IN ('ok', 'error')),
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ,
+    wall_time FLOAT,
+    stages JSONB NOT NULL DEFAULT '[]',
+    host TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_name_started ON pipeline_runs(name, started_at);
 
 -- Table pour les rapports générés (pour l'envoi par email)
 CREATE TABLE IF NOT EXISTS reports (
@@ -71,9 +123,31 @@ CREATE TABLE IF NOT EXISTS reports (
 );
 
 -- Index pour améliorer les performances
+-- Un texte source (post / commentaire / réponse) = une seule ligne: clé naturelle pour l'upsert.
+-- Sur une base existante contenant des doublons, exécuter d'abord: python -m etl.compact
+-- contrainte nommée pour l'upsert (ON CONFLICT ON CONSTRAINT): même nom sur la table partitionnée
+-- (python -m etl.partitions --migrate), où elle porte aussi sur created_time. L'index n'est créé que s'il
+-- manque: sur la table partitionnée, CREATE UNIQUE INDEX IF NOT EXISTS sans created_time est refusé
+-- avant même le test d'existence
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE i.indrelid = 'flat_texts'::regclass AND c.relname = 'uq_flat_texts_source') THEN
+        CREATE UNIQUE INDEX uq_flat_texts_source ON flat_texts(source_type, source_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conname = 'uq_flat_texts_source' AND conrelid = 'flat_texts'::regclass) THEN
+        ALTER TABLE flat_texts ADD CONSTRAINT uq_flat_texts_source UNIQUE USING INDEX uq_flat_texts_source;
+    END IF;
+END $$;
 CREATE INDEX IF NOT EXISTS idx_flat_texts_post_id ON flat_texts(post_id);
 CREATE INDEX IF NOT EXISTS idx_flat_texts_created_time ON flat_texts(created_time);
 CREATE INDEX IF NOT EXISTS idx_flat_texts_sentiment ON flat_texts(predicted_sentiment);
+-- Files de travail: index partiels ne contenant que les lignes encore à prédire / à labelliser,
+-- leur taille suit la file et non la table (cf. bench/check_plans.py)
+CREATE INDEX IF NOT EXISTS idx_flat_texts_unpredicted ON flat_texts(id) WHERE predicted_sentiment IS NULL;
+CREATE INDEX IF NOT EXISTS idx_flat_texts_unlabeled ON flat_texts(id) WHERE sentiment_label IS NULL AND text != '';
+CREATE INDEX IF NOT EXISTS idx_flat_texts_labeled_at ON flat_texts(labeled_at) WHERE labeled_at IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_posts_created_time ON posts(created_time);
 CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments(post_id);
 
@@ -86,9 +160,13 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
--- Triggers pour updated_at
+-- Triggers pour updated_at (recréés pour que le script reste rejouable)
+DROP TRIGGER IF EXISTS update_posts_updated_at ON posts;
 CREATE TRIGGER update_posts_updated_at BEFORE UPDATE ON posts
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- flat_texts: seulement si la ligne change vraiment (updated_at sert de watermark aux agrégats,
+-- une mise à jour sans effet ne doit pas le déplacer)
+DROP TRIGGER IF EXISTS update_flat_texts_updated_at ON flat_texts;
 CREATE TRIGGER update_flat_texts_updated_at BEFORE UPDATE ON flat_texts
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
\ No newline at end of file
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION update_updated_at_column();
\ No newline at end of file
@@ -1,135 +1,153 @@
 -- sql/views_powerbi.sql - Vues optimisées pour Power BI
+-- Les vues lisent les agrégats matérialisés de sql/aggregates.sql (à créer avant ce fichier,
+-- rafraîchis par etl/aggregates.py): un rafraîchissement du dashboard ne relit plus flat_texts.
 
 -- 1) Vue principale pour le dashboard - Métriques globales
 CREATE OR REPLACE VIEW vw_dashboard_overview AS
-SELECT 
-    COUNT(DISTINCT p.post_id) as total_posts,
-    COUNT(DISTINCT c.comment_id) as total_comments,
-    COALESCE(AVG(p.like_count), 0) as avg_likes_per_post,
-    COALESCE(AVG(p.comments_count), 0) as avg_comments_per_post,
-    COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END) as positive_count,
-    COUNT(CASE WHEN f.predicted_sentiment = 'negatif' THEN 1 END) as negative_count,
-    COUNT(CASE WHEN f.predicted_sentiment = 'neutre' THEN 1 END) as neutral_count,
+WITH s AS (
+    SELECT
+        COALESCE(SUM(n_comments), 0)::bigint AS total_comments,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0)::bigint AS positive_count,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'negatif'), 0)::bigint AS negative_count,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'neutre'), 0)::bigint AS neutral_count
+    FROM agg_post_daily
+)
+SELECT
+    (SELECT COUNT(*) FROM posts) as total_posts,
+    s.total_comments,
+    (SELECT COALESCE(AVG(like_count), 0) FROM posts) as avg_likes_per_post,
+    (SELECT COALESCE(AVG(comments_count), 0) FROM posts) as avg_comments_per_post,
+    s.positive_count,
+    s.negative_count,
+    s.neutral_count,
     ROUND(
-        COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END) * 100.0 / 
-        NULLIF(COUNT(f.predicted_sentiment), 0), 2
+        s.positive_count * 100.0 /
+        NULLIF(s.positive_count + s.negative_count + s.neutral_count, 0), 2
     ) as positive_percentage
-FROM posts p
-LEFT JOIN comments c ON p.post_id = c.post_id
-LEFT JOIN flat_texts f ON f.post_id = p.post_id;
+FROM s;
 
 -- 2) Distribution des sentiments (pour graphique en secteurs)
 CREATE OR REPLACE VIEW vw_sentiment_distribution AS
-SELECT 
-    COALESCE(predicted_sentiment, 'non_analysé') AS sentiment,
-    COUNT(*) AS count,
-    ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER(), 2) AS percentage
-FROM flat_texts
-WHERE text IS NOT NULL AND text != ''
-GROUP BY COALESCE(predicted_sentiment, 'non_analysé')
+SELECT
+    sentiment,
+    SUM(n_text)::bigint AS count,
+    ROUND(SUM(n_text) * 100.0 / SUM(SUM(n_text)) OVER(), 2) AS percentage
+FROM agg_post_daily
+GROUP BY sentiment
+HAVING SUM(n_text) > 0
 ORDER BY count DESC;
 
 -- 3) Performance des posts avec sentiment
 CREATE OR REPLACE VIEW vw_post_performance AS
-SELECT 
+WITH s AS (
+    SELECT
+        post_id,
+        SUM(n_total)::bigint AS total_interactions,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0)::bigint AS sentiment_positif,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'negatif'), 0)::bigint AS sentiment_negatif,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'neutre'), 0)::bigint AS sentiment_neutre
+    FROM agg_post_daily
+    GROUP BY post_id
+)
+SELECT
     p.post_id,
     p.caption,
     p.created_time,
     p.like_count,
     p.comments_count,
     (p.like_count + p.comments_count) AS engagement_total,
-    COUNT(f.id) as total_interactions,
-    COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END) as sentiment_positif,
-    COUNT(CASE WHEN f.predicted_sentiment = 'negatif' THEN 1 END) as sentiment_negatif,
-    COUNT(CASE WHEN f.predicted_sentiment = 'neutre' THEN 1 END) as sentiment_neutre,
-    CASE 
-        WHEN COUNT(f.id) > 0 THEN
-            ROUND(COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END) * 100.0 / COUNT(f.id), 2)
-        ELSE 0 
+    COALESCE(s.total_interactions, 0) as total_interactions,
+    COALESCE(s.sentiment_positif, 0) as sentiment_positif,
+    COALESCE(s.sentiment_negatif, 0) as sentiment_negatif,
+    COALESCE(s.sentiment_neutre, 0) as sentiment_neutre,
+    CASE
+        WHEN s.total_interactions > 0 THEN
+            ROUND(s.sentiment_positif * 100.0 / s.total_interactions, 2)
+        ELSE 0
     END as pourcentage_positif,
     p.permalink
 FROM posts p
-LEFT JOIN flat_texts f ON p.post_id = f.post_id
-GROUP BY p.post_id, p.caption, p.created_time, p.like_count, p.comments_count, p.permalink
+LEFT JOIN s ON s.post_id = p.post_id
 ORDER BY engagement_total DESC;
 
 -- 4) Timeline des sentiments par jour
 CREATE OR REPLACE VIEW vw_sentiment_timeline_daily AS
-SELECT 
-    DATE_TRUNC('day', created_time)::date AS date_jour,
-    COUNT(CASE WHEN predicted_sentiment = 'positif' THEN 1 END) AS positif,
-    COUNT(CASE WHEN predicted_sentiment = 'negatif' THEN 1 END) AS negatif,
-    COUNT(CASE WHEN predicted_sentiment = 'neutre' THEN 1 END) AS neutre,
-    COUNT(*) AS total_interactions
-FROM flat_texts
-WHERE created_time IS NOT NULL
-GROUP BY DATE_TRUNC('day', created_time)
+SELECT
+    day AS date_jour,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0)::bigint AS positif,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'negatif'), 0)::bigint AS negatif,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'neutre'), 0)::bigint AS neutre,
+    SUM(n_total)::bigint AS total_interactions
+FROM agg_post_daily
+WHERE day > '-infinity'
+GROUP BY day
 ORDER BY date_jour;
 
 -- 5) Timeline des sentiments par semaine (pour tendances)
 CREATE OR REPLACE VIEW vw_sentiment_timeline_weekly AS
-SELECT 
-    DATE_TRUNC('week', created_time)::date AS semaine,
-    COUNT(CASE WHEN predicted_sentiment = 'positif' THEN 1 END) AS positif,
-    COUNT(CASE WHEN predicted_sentiment = 'negatif' THEN 1 END) AS negatif,
-    COUNT(CASE WHEN predicted_sentiment = 'neutre' THEN 1 END) AS neutre,
-    COUNT(*) AS total,
-    ROUND(AVG(CASE WHEN predicted_sentiment = 'positif' THEN 100.0 ELSE 0 END), 2) AS pct_positif
-FROM flat_texts
-WHERE created_time IS NOT NULL
-GROUP BY DATE_TRUNC('week', created_time)
+SELECT
+    DATE_TRUNC('week', day)::date AS semaine,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0)::bigint AS positif,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'negatif'), 0)::bigint AS negatif,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'neutre'), 0)::bigint AS neutre,
+    SUM(n_total)::bigint AS total,
+    ROUND(COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0) * 100.0 / SUM(n_total), 2) AS pct_positif
+FROM agg_post_daily
+WHERE day > '-infinity'
+GROUP BY DATE_TRUNC('week', day)
 ORDER BY semaine;
 
 -- 6) Top utilisateurs par engagement
 CREATE OR REPLACE VIEW vw_top_users AS
-SELECT 
-    f.username,
-    COUNT(*) AS total_interactions,
-    SUM(f.like_count) AS total_likes,
-    COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END) AS interactions_positives,
-    COUNT(CASE WHEN f.predicted_sentiment = 'negatif' THEN 1 END) AS interactions_negatives,
+SELECT
+    username,
+    SUM(n_total)::bigint AS total_interactions,
+    SUM(like_sum)::bigint AS total_likes,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0)::bigint AS interactions_positives,
+    COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'negatif'), 0)::bigint AS interactions_negatives,
     ROUND(
-        COUNT(CASE WHEN f.predicted_sentiment = 'positif' THEN 1 END) * 100.0 / 
-        NULLIF(COUNT(f.predicted_sentiment), 0), 2
+        SUM(n_total) FILTER (WHERE sentiment = 'positif') * 100.0 /
+        NULLIF(SUM(n_total) FILTER (WHERE sentiment != 'non_analysé'), 0), 2
     ) AS pourcentage_positif
-FROM flat_texts f
-WHERE f.username IS NOT NULL AND f.source_type != 'post'
-GROUP BY f.username
-HAVING COUNT(*) > 1
+FROM agg_user_daily
+GROUP BY username
+HAVING SUM(n_total) > 1
 ORDER BY total_interactions DESC
 LIMIT 20;
 
 -- 7) Posts avec le plus d'engagement négatif (alertes)
 CREATE OR REPLACE VIEW vw_negative_alerts AS
-SELECT 
+WITH s AS (
+    SELECT
+        post_id,
+        SUM(n_total) FILTER (WHERE sentiment = 'negatif')::bigint AS reactions_negatives,
+        SUM(n_total)::bigint AS total_reactions
+    FROM agg_post_daily
+    GROUP BY post_id
+    HAVING SUM(n_total) FILTER (WHERE sentiment = 'negatif') > 0
+)
+SELECT
     p.post_id,
     p.caption,
     p.created_time,
     p.permalink,
-    COUNT(CASE WHEN f.predicted_sentiment = 'negatif' THEN 1 END) AS reactions_negatives,
-    COUNT(f.id) AS total_reactions,
-    ROUND(
-        COUNT(CASE WHEN f.predicted_sentiment = 'negatif' THEN 1 END) * 100.0 / 
-        NULLIF(COUNT(f.id), 0), 2
-    ) AS pourcentage_negatif
+    s.reactions_negatives,
+    s.total_reactions,
+    ROUND(s.reactions_negatives * 100.0 / NULLIF(s.total_reactions, 0), 2) AS pourcentage_negatif
 FROM posts p
-LEFT JOIN flat_texts f ON p.post_id = f.post_id
-GROUP BY p.post_id, p.caption, p.created_time, p.permalink
-HAVING COUNT(CASE WHEN f.predicted_sentiment = 'negatif' THEN 1 END) > 0
+JOIN s ON s.post_id = p.post_id
 ORDER BY pourcentage_negatif DESC, reactions_negatives DESC;
 
 -- 8) Analyse des émojis les plus utilisés
 CREATE OR REPLACE VIEW vw_emoji_analysis AS
 WITH emoji_counts AS (
-    SELECT 
-        key as emoji,
-        SUM(value::int) as usage_count
-    FROM flat_texts f,
-    LATERAL jsonb_each_text(f.emoji_summary) 
-    WHERE emoji_summary != '{}'
-    GROUP BY key
+    SELECT
+        emoji,
+        SUM(usage_count)::bigint as usage_count
+    FROM agg_emoji_daily
+    GROUP BY emoji
 )
-SELECT 
+SELECT
     emoji,
     usage_count,
     ROUND(usage_count * 100.0 / SUM(usage_count) OVER(), 2) as percentage
@@ -137,22 +155,34 @@ FROM emoji_counts
 ORDER BY usage_count DESC
 LIMIT 20;
 
+-- 8 bis) Émojis par sentiment (text_emojis indexé par émoji, sans dépliage du JSONB emoji_summary)
+CREATE OR REPLACE VIEW vw_emoji_sentiment AS
+SELECT
+    e.emoji,
+    COALESCE(f.predicted_sentiment, 'non_analysé') AS sentiment,
+    COUNT(*) AS textes,
+    SUM(e.count)::bigint AS usage_count,
+    ROUND(SUM(e.count) * 100.0 / SUM(SUM(e.count)) OVER (PARTITION BY e.emoji), 2) AS percentage
+FROM text_emojis e
+JOIN flat_texts f ON f.id = e.flat_text_id
+GROUP BY e.emoji, COALESCE(f.predicted_sentiment, 'non_analysé');
+
 -- 9) Rapport mensuel pour l'email
 CREATE OR REPLACE VIEW vw_monthly_report AS
 WITH monthly_stats AS (
-    SELECT 
-        DATE_TRUNC('month', created_time)::date AS mois,
+    SELECT
+        DATE_TRUNC('month', day)::date AS mois,
         COUNT(DISTINCT post_id) as posts_count,
-        COUNT(*) as total_interactions,
-        COUNT(CASE WHEN predicted_sentiment = 'positif' THEN 1 END) as positif,
-        COUNT(CASE WHEN predicted_sentiment = 'negatif' THEN 1 END) as negatif,
-        COUNT(CASE WHEN predicted_sentiment = 'neutre' THEN 1 END) as neutre,
-        AVG(like_count) as avg_likes
-    FROM flat_texts
-    WHERE created_time >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '3 months')
-    GROUP BY DATE_TRUNC('month', created_time)
+        SUM(n_total)::bigint as total_interactions,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'positif'), 0)::bigint as positif,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'negatif'), 0)::bigint as negatif,
+        COALESCE(SUM(n_total) FILTER (WHERE sentiment = 'neutre'), 0)::bigint as neutre,
+        SUM(like_sum) * 1.0 / NULLIF(SUM(n_total), 0) as avg_likes
+    FROM agg_post_daily
+    WHERE day >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '3 months')
+    GROUP BY DATE_TRUNC('month', day)
 )
-SELECT 
+SELECT
     mois,
     posts_count,
     total_interactions,
@@ -167,29 +197,54 @@ ORDER BY mois DESC;
 
 -- 10) Vue pour les KPIs Power BI
 CREATE OR REPLACE VIEW vw_kpi_summary AS
-SELECT 
+SELECT
     'total_posts' as metric_name,
     COUNT(DISTINCT post_id)::text as metric_value,
     'Posts publiés' as metric_label
-FROM flat_texts WHERE source_type = 'post'
+FROM agg_post_daily WHERE n_post > 0
 UNION ALL
-SELECT 
+SELECT
     'total_interactions' as metric_name,
-    COUNT(*)::text as metric_value,
+    COALESCE(SUM(n_total), 0)::bigint::text as metric_value,
     'Interactions totales' as metric_label
-FROM flat_texts
+FROM agg_post_daily
 UNION ALL
-SELECT 
+SELECT
     'sentiment_score' as metric_name,
     ROUND(
-        COUNT(CASE WHEN predicted_sentiment = 'positif' THEN 1 END) * 100.0 / 
-        NULLIF(COUNT(predicted_sentiment), 0), 1
+        SUM(n_total) FILTER (WHERE sentiment = 'positif') * 100.0 /
+        NULLIF(SUM(n_total) FILTER (WHERE sentiment != 'non_analysé'), 0), 1
     )::text || '%' as metric_value,
     'Score sentiment positif' as metric_label
-FROM flat_texts
+FROM agg_post_daily
 UNION ALL
-SELECT 
+SELECT
     'avg_engagement' as metric_name,
     ROUND(AVG(like_count + comments_count), 0)::text as metric_value,
     'Engagement moyen par post' as metric_label
-FROM posts;
\ No newline at end of file
+FROM posts;
+
+-- 11) Historique par étape des runs du pipeline (régressions de temps, de débit, d'appels)
+CREATE OR REPLACE VIEW vw_pipeline_stage_history AS
+SELECT
+    r.run_id,
+    r.name as run_name,
+    r.started_at as run_started_at,
+    r.status as run_status,
+    s.name as stage,
+    s.parent,
+    s.status,
+    s.wall_time,
+    s.rows_in,
+    s.rows_out,
+    s.rows_per_s,
+    s.http_requests,
+    s.http_errors,
+    s.http_p95_ms,
+    s.db_roundtrips,
+    s.peak_rss_mb
+FROM pipeline_runs r
+CROSS JOIN LATERAL jsonb_to_recordset(r.stages) AS s(
+    name text, parent text, status text, wall_time float, rows_in bigint, rows_out bigint, rows_per_s float,
+    http_requests int, http_errors int, http_p95_ms float, db_roundtrips int, peak_rss_mb float
+);
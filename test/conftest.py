@@ -0,0 +1,6 @@
+# test/conftest.py
+# tests lancés depuis la racine du dépôt (python -m pytest -q test) ou depuis test/: paquets etl, config,
+# scripts_models importables dans les deux cas
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,32 @@
+# test/test_cache.py
+from scripts_models.cache import PredictionCache, text_key
+
+class Scorer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [(t.upper(), 0.5) for t in texts]
+
+def test_key_uses_clean_text_and_version():
+    assert text_key("  Super   !  https://x.y/z", "v1") == text_key("Super !", "v1")
+    assert text_key("Super !", "v1") != text_key("Super !", "v2")
+    assert text_key(None, "v1") == text_key("", "v1")
+
+def test_lookup_computes_each_text_once():
+    cache, score = PredictionCache("v1", maxsize=10), Scorer()
+    assert cache.lookup(["a", "b", "a", " a "], score) == [("A", 0.5), ("B", 0.5), ("A", 0.5), ("A", 0.5)]
+    assert score.calls == [["a", "b"]]
+    assert cache.lookup(["b", "c"], score) == [("B", 0.5), ("C", 0.5)]
+    assert score.calls[-1] == ["c"]
+    assert cache.stats() == {"hits": 3, "store_hits": 0, "misses": 3, "hit_rate": 0.5}
+
+def test_lru_eviction():
+    cache, score = PredictionCache("v1", maxsize=2), Scorer()
+    cache.lookup(["a", "b"], score)
+    cache.lookup(["a"], score)        # a devient le plus récent
+    cache.lookup(["c"], score)        # b sort du LRU
+    cache.lookup(["a", "b"], score)
+    assert score.calls == [["a", "b"], ["c"], ["b"]]
+    assert len(cache.lru) == 2
@@ -0,0 +1,37 @@
+# test/test_extract.py
+from etl import state
+from etl.extract import plan_media, merge_raw
+
+def media(mid, likes=1, comments=1):
+    return {"id": mid, "timestamp": "2025-09-01T10:00:00+0000", "like_count": likes, "comments_count": comments}
+
+def test_plan_media():
+    watermarks = {}
+    for m in (media("same"), media("likes"), media("comments")):
+        state.update_watermark(watermarks, m, [{"id": "c0", "timestamp": "2025-09-01T11:00:00+0000"}])
+    posts, jobs, skipped = plan_media(
+        [media("same"), media("likes", likes=5), media("comments", comments=2), media("new")], watermarks)
+    assert skipped == 1
+    assert [p["id"] for p in posts] == ["likes", "comments", "new"]
+    # likes seuls: pas de relecture, aucun commentaire dans la nouvelle version
+    assert posts[0]["fetched_comments"] == []
+    # relecture des commentaires postérieurs au watermark; media nouveau relu entièrement
+    assert [(m["id"], since) for m, since in jobs] == [("comments", "2025-09-01T11:00:00+0000"), ("new", None)]
+
+def test_merge_raw():
+    old = [{**media("m1"), "fetch_error": "timeout", "fetched_comments": [
+               {"id": "c1", "text": "a", "timestamp": "2025-09-01T11:00:00+0000"},
+               {"id": "c2", "text": "b", "timestamp": "2025-09-01T12:00:00+0000"}]},
+           {**media("m0"), "timestamp": "2025-08-01T10:00:00+0000", "fetched_comments": []}]
+    delta = [{**media("m1", likes=9), "fetched_comments": [
+                 {"id": "c2", "text": "b modifié", "timestamp": "2025-09-01T12:00:00+0000"},
+                 {"id": "c3", "text": "c", "timestamp": "2025-09-01T13:00:00+0000"}]},
+             {**media("m2"), "timestamp": "2025-09-05T10:00:00+0000", "fetched_comments": []}]
+    merged = merge_raw(old, delta)
+    assert [p["id"] for p in merged] == ["m2", "m1", "m0"]
+    m1 = merged[1]
+    assert m1["like_count"] == 9 and "fetch_error" not in m1
+    assert [(c["id"], c["text"]) for c in m1["fetched_comments"]] == [("c3", "c"), ("c2", "b modifié"), ("c1", "a")]
+    # version de likes seuls: les commentaires déjà connus restent
+    again = merge_raw(merged, [{**media("m1", likes=10), "fetched_comments": []}])
+    assert len(again[1]["fetched_comments"]) == 3
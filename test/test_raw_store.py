@@ -0,0 +1,80 @@
+# test/test_raw_store.py
+import pytest
+from etl import raw_store, state, transform
+from etl.extract import plan_media
+
+def media(like_count=10, comments_count=2):
+    return {"id": "m1", "caption": "Légende", "media_type": "IMAGE", "timestamp": "2025-09-01T10:00:00+0000",
+            "like_count": like_count, "comments_count": comments_count}
+
+def comment(cid, ts):
+    return {"id": cid, "text": f"texte {cid}", "username": "u", "timestamp": ts, "like_count": 1}
+
+# commentaires du media côté API, du plus ancien au plus récent
+COMMENTS = [comment("c1", "2025-09-01T11:00:00+0000"), comment("c2", "2025-09-01T12:00:00+0000"),
+            comment("c3", "2025-09-02T09:00:00+0000")]
+
+def extract_run(base, m, watermarks):
+    # ce qu'écrit extract_all en incrémental: plan_media puis, pour les media à relire, les commentaires
+    # postérieurs au watermark seulement
+    posts, jobs, _ = plan_media([m], watermarks)
+    for p, since in jobs:
+        p["fetched_comments"] = [c for c in COMMENTS[:p["comments_count"]] if since is None or c["timestamp"] > since]
+    with raw_store.RawWriter(base=str(base), compression=None) as w:
+        for p in posts:
+            w.write(p)
+            state.update_watermark(watermarks, p, p["fetched_comments"])
+    return posts
+
+@pytest.fixture
+def parts(tmp_path):
+    # run complet, puis likes seuls ("counts"), puis un nouveau commentaire ("comments")
+    watermarks = {}
+    extract_run(tmp_path, media(), watermarks)
+    posts, _, _ = plan_media([media(like_count=12)], dict(watermarks))
+    assert posts[0]["fetched_comments"] == []
+    extract_run(tmp_path, media(like_count=12), watermarks)
+    return tmp_path, watermarks
+
+def test_counts_part_keeps_comments(parts):
+    base, _ = parts
+    assert len(raw_store.list_parts(str(base))) == 2
+    merged = list(raw_store.iter_raw_posts(base=str(base), legacy_file=None))
+    assert len(merged) == 1
+    assert merged[0]["like_count"] == 12
+    assert {c["id"] for c in merged[0]["fetched_comments"]} == {"c1", "c2"}
+
+def test_comments_delta_merged(parts):
+    base, watermarks = parts
+    posts = extract_run(base, media(like_count=12, comments_count=3), watermarks)
+    assert [c["id"] for c in posts[0]["fetched_comments"]] == ["c3"]
+    merged = list(raw_store.iter_raw_posts(base=str(base), legacy_file=None))
+    assert [c["id"] for c in merged[0]["fetched_comments"]] == ["c3", "c2", "c1"]
+    # toutes les versions restent lisibles telles qu'écrites
+    assert len(list(raw_store.iter_raw_posts(base=str(base), legacy_file=None, latest=False))) == 3
+
+def test_transform_after_counts_part(parts, tmp_path_factory, monkeypatch):
+    pytest.importorskip("pyarrow")
+    from etl import columnar
+    base, _ = parts
+    out = tmp_path_factory.mktemp("processed")
+    monkeypatch.setattr(transform, "PROC_DIR", str(out))
+    transform.transform(posts=raw_store.iter_raw_posts(base=str(base), legacy_file=None), output_format="parquet")
+    comments = columnar.read_table("comments", str(out))
+    assert sorted(comments["comment_id"]) == ["c1", "c2"]
+    posts = columnar.read_table("posts", str(out))
+    assert posts["like_count"].tolist() == [12]
+
+def test_gzip_parts_and_legacy(tmp_path):
+    import json
+    for likes in (10, 11):
+        with raw_store.RawWriter(base=str(tmp_path), compression="gzip") as w:
+            w.write({**media(like_count=likes), "fetched_comments": COMMENTS[:likes - 9]})
+    parts = raw_store.list_parts(str(tmp_path))
+    assert len(parts) == 2 and all(p.endswith(".ndjson.gz") for p in parts) and parts == sorted(parts)
+    merged = list(raw_store.iter_raw_posts(base=str(tmp_path), legacy_file=None))
+    assert merged[0]["like_count"] == 11 and [c["id"] for c in merged[0]["fetched_comments"]] == ["c2", "c1"]
+    # sans parts, l'ancien fichier JSON unique est relu
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text(json.dumps([{**media(), "fetched_comments": COMMENTS[:1]}]), encoding="utf-8")
+    assert list(raw_store.iter_raw_posts(base=str(tmp_path / "vide"), legacy_file=str(legacy)))[0]["fetched_comments"][0]["id"] == "c1"
@@ -0,0 +1,46 @@
+# test/test_registry.py
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from scripts_models import registry
+
+TEXTS = ["super top génial", "nul horrible", "bof moyen", "génial bravo", "horrible déçu", "moyen sans plus"] * 5
+LABELS = ["positif", "negatif", "neutre", "positif", "negatif", "neutre"] * 5
+
+@pytest.mark.parametrize("make_vect, make_model", [
+    (lambda: TfidfVectorizer(ngram_range=(1, 2)), lambda: LogisticRegression(max_iter=200)),
+    (lambda: HashingVectorizer(n_features=2 ** 12, alternate_sign=False), lambda: SGDClassifier(loss="log_loss", random_state=0)),
+    (lambda: TfidfVectorizer(), lambda: RandomForestClassifier(n_estimators=5, random_state=0)),
+], ids=["tfidf_logreg", "hashing_sgd", "tfidf_rf"])
+@pytest.mark.parametrize("mmap", [False, True])
+def test_roundtrip(tmp_path, make_vect, make_model, mmap):
+    vect = make_vect()
+    X = vect.fit_transform(TEXTS)
+    model = make_model().fit(X, LABELS)
+    version = registry.register(model, vect, "test", {"f1_macro": 0.5}, snapshot={"rows": 30}, registry_dir=str(tmp_path))
+    model2, vect2, info = registry.load(registry_dir=str(tmp_path), mmap=mmap)
+    assert info["version"] == version and info["metrics"] == {"f1_macro": 0.5} and info["snapshot"] == {"rows": 30}
+    X2 = vect2.transform(TEXTS)
+    np.testing.assert_allclose(X2.toarray(), X.toarray())
+    assert list(model2.predict(X2)) == list(model.predict(X))
+    np.testing.assert_allclose(model2.predict_proba(X2), model.predict_proba(X))
+
+def test_versions_and_latest(tmp_path):
+    d = str(tmp_path)
+    vect = TfidfVectorizer().fit(TEXTS)
+    model = LogisticRegression(max_iter=200).fit(vect.transform(TEXTS), LABELS)
+    assert registry.latest(d) is None
+    with pytest.raises(FileNotFoundError):
+        registry.load(registry_dir=d)
+    v1 = registry.register(model, vect, "a", registry_dir=d)
+    v2 = registry.register(model, vect, "b", registry_dir=d, promote=False)
+    assert (v1, v2) == ("v0001-a", "v0002-b")
+    assert registry.versions(d) == [v1, v2]
+    assert registry.latest(d) == v1
+    with pytest.raises(ValueError):
+        registry.remove(v1, d)
+    registry.promote_version(v2, d)
+    registry.remove(v1, d)
+    assert registry.versions(d) == [v2] and registry.latest(d) == v2
@@ -0,0 +1,56 @@
+# test/test_transform.py
+# Le transform vectorisé (transform_frames) doit écrire exactement les mêmes fichiers que la boucle
+# transform_post, cas limites compris
+import json
+import pytest
+from etl import transform
+
+POSTS = [
+    {"id": "m1", "caption": "Belle  journée 🔥🔥 https://example.com/x", "media_type": "IMAGE",
+     "media_url": "https://cdn/x.jpg", "permalink": "https://instagram/p/1", "timestamp": "2025-09-01T10:00:00+0000",
+     "like_count": 12, "comments_count": 3,
+     "fetched_comments": [
+         {"id": "c1", "text": "Super ! ❤️", "username": "alice", "timestamp": "2025-09-01T11:00:00+0000", "like_count": 2,
+          "replies": {"data": [{"id": "r1", "text": "Merci 🙏🏽", "username": "bob", "timestamp": "2025-09-01T11:05:00+0000"},
+                               {"id": "r2", "text": None, "username": "carol"}]}},
+         {"id": "c2", "text": "👨‍👩‍👧 🇫🇷 #1️⃣", "username": "dan", "timestamp": "2025-09-01T12:00:00+0000", "like_count": "3"},
+     ]},
+    # légende absente, pas de date, compteurs absents, pas de commentaires récupérés
+    {"id": "m2", "media_type": "VIDEO"},
+    # date absente sur le commentaire seulement, liste de commentaires vide
+    {"id": "m3", "caption": "", "timestamp": "2025-09-02T08:00:00+0000", "fetched_comments": [
+        {"id": "c3", "text": "sans date", "username": "eve"}]},
+    {"id": "m4", "caption": "rien", "timestamp": "2025-09-03T08:00:00+0000", "fetched_comments": []},
+]
+
+def outputs(tmp_path, monkeypatch, engine, posts):
+    out = tmp_path / engine
+    monkeypatch.setattr(transform, "PROC_DIR", str(out))
+    transform.transform(posts=iter(posts), engine=engine, output_format="csv")
+    with open(out / "flat_texts.json", encoding="utf-8") as f:
+        flat = json.load(f)
+    return (out / "posts.csv").read_text(encoding="utf-8"), (out / "comments.csv").read_text(encoding="utf-8"), flat
+
+@pytest.mark.parametrize("posts", [POSTS, POSTS[1:2], POSTS[2:], []], ids=["mixte", "vide", "sans_date", "aucun"])
+def test_engines_identical(tmp_path, monkeypatch, posts):
+    python = outputs(tmp_path, monkeypatch, "python", posts)
+    vectorized = outputs(tmp_path, monkeypatch, "vectorized", posts)
+    assert python == vectorized
+
+def test_rows(tmp_path, monkeypatch):
+    _, comments, flat = outputs(tmp_path, monkeypatch, "vectorized", POSTS)
+    by_id = {r["source_id"]: r for r in flat}
+    assert [r["source_type"] for r in flat[:5]] == ["post", "comment", "reply", "reply", "comment"]
+    assert by_id["m1"]["text"] == "Belle journée 🔥🔥"
+    assert by_id["m1"]["emoji_summary"] == {"🔥": 2}
+    assert by_id["r1"]["emoji_summary"] == {"🙏🏽": 1} and by_id["r1"]["parent_comment_id"] == "c1"
+    assert by_id["c2"]["emoji_summary"] == {"👨‍👩‍👧": 1, "🇫🇷": 1, "1️⃣": 1}
+    assert by_id["c2"]["like_count"] == 3
+    assert by_id["m2"]["text"] == "" and by_id["m2"]["created_time"] is None
+    assert by_id["c3"]["created_time"] is None and by_id["m3"]["created_time"] == "2025-09-02 08:00:00+00:00"
+
+def test_transform_frames_empty():
+    posts_df, comments_df, flat_df = transform.transform_frames([])
+    assert list(posts_df.columns) == transform.POST_COLUMNS and posts_df.empty
+    assert list(comments_df.columns) == transform.COMMENT_COLUMNS and comments_df.empty
+    assert list(flat_df.columns) == transform.FLAT_COLUMNS and flat_df.empty
@@ -0,0 +1,53 @@
+# test/test_webhook.py
+import json
+from datetime import datetime, timezone
+from etl import webhook
+
+BODY = json.dumps({"object": "instagram", "entry": []}).encode("utf-8")
+
+def test_verify_signature():
+    header = webhook.sign(BODY, "s3cret")
+    assert header.startswith("sha256=")
+    assert webhook.verify_signature(BODY, header, "s3cret")
+    assert not webhook.verify_signature(BODY + b" ", header, "s3cret")
+    assert not webhook.verify_signature(BODY, header, "autre")
+    assert not webhook.verify_signature(BODY, None, "s3cret")
+    # sans secret, rien n'est authentifiable
+    assert not webhook.verify_signature(BODY, header, "")
+
+def test_parse_notification():
+    payload = {"object": "instagram", "entry": [{"id": "1", "time": 1756720800, "changes": [
+        {"field": "comments", "value": {"id": "c1", "text": "Top", "media": {"id": "m1"}, "from": {"username": "alice"}}},
+        {"field": "comments", "value": {"id": "r1", "text": "Merci", "parent_id": "c1", "media": {"id": "m1"},
+                                        "timestamp": "2025-09-01T11:00:00+0000"}},
+        {"field": "live_comments", "value": {"id": "l1", "text": "Live", "media": {"id": 42}, "timestamp": 1756720900000}},
+        {"field": "mentions", "value": {"id": "x", "media": {"id": "m1"}}},
+        {"field": "comments", "value": {"id": "sans_media"}},
+    ]}]}
+    events = webhook.parse_notification(payload)
+    assert [(e["comment_id"], e["post_id"], e["parent_comment_id"]) for e in events] == \
+        [("c1", "m1", None), ("r1", "m1", "c1"), ("l1", "42", None)]
+    assert events[0]["username"] == "alice" and events[1]["username"] is None
+    # heure de la notification, horodatage ISO du commentaire, millisecondes
+    assert events[0]["created_time"] == datetime(2025, 9, 1, 10, 0, tzinfo=timezone.utc)
+    assert events[1]["created_time"] == datetime(2025, 9, 1, 11, 0, tzinfo=timezone.utc)
+    assert events[2]["created_time"] == datetime(2025, 9, 1, 10, 1, 40, tzinfo=timezone.utc)
+
+def test_parse_notification_ignores_other_objects():
+    assert webhook.parse_notification({"object": "page", "entry": [{"changes": []}]}) == []
+    assert webhook.parse_notification([]) == []
+
+def test_build_payload_roundtrip():
+    events = [{"comment_id": "c1", "post_id": "m1", "parent_comment_id": None, "username": "alice", "text": "Top",
+               "created_time": datetime(2025, 9, 1, 10, 0, tzinfo=timezone.utc)},
+              {"comment_id": "r1", "post_id": "m1", "parent_comment_id": "c1", "username": "bob", "text": "Merci",
+               "created_time": datetime(2025, 9, 1, 10, 5, tzinfo=timezone.utc)}]
+    assert webhook.parse_notification(json.loads(json.dumps(webhook.build_payload(events)))) == events
+
+def test_submit_whole_notification_or_nothing():
+    ingestor = webhook.Ingestor(queue_size=5)
+    assert ingestor.submit([{}] * 3)
+    assert not ingestor.submit([{}] * 3)
+    assert ingestor.events.qsize() == 3
+    assert ingestor.submit([{}] * 2)
+    assert ingestor.counts["received"] == 5 and ingestor.counts["rejected"] == 1